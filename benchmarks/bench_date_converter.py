@@ -0,0 +1,63 @@
+"""Time Jalali date formatting: jdatetime per value against DateConverter
+
+    python -m benchmarks.bench_date_converter [dates]
+"""
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import jdatetime
+
+from utils import date_converter
+from utils.date_converter import DateConverter
+
+
+def make_dates(count: int, seed: int = 1):
+    """Synthetic hire and attendance dates over the last thirty years"""
+    rng = random.Random(seed)
+    start = date(1995, 1, 1)
+    return [start + timedelta(days=rng.randrange(30 * 365)) for _ in range(count)]
+
+
+def best_of(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(count: int = 50000, repeat: int = 5):
+    dates = make_dates(count)
+
+    def clear_and_format():
+        date_converter._format_other.cache_clear()
+        [DateConverter.gregorian_to_jalali_str(value, "%d %B %Y") for value in dates]
+
+    DateConverter.gregorian_to_jalali(dates[0])  # build the table outside the timings
+    timings = {
+        'jdatetime strftime': best_of(
+            lambda: [jdatetime.date.fromgregorian(date=value).strftime("%Y/%m/%d") for value in dates], repeat),
+        'gregorian_to_jalali_str': best_of(
+            lambda: [DateConverter.gregorian_to_jalali_str(value) for value in dates], repeat),
+        'gregorian_to_jalali_str (other format, cold)': best_of(clear_and_format, repeat),
+        'gregorian_to_jalali_str (other format, cached)': best_of(
+            lambda: [DateConverter.gregorian_to_jalali_str(value, "%d %B %Y") for value in dates], repeat),
+        'gregorian_to_jalali_array': best_of(lambda: DateConverter.gregorian_to_jalali_array(dates), repeat)
+    }
+    if date_converter.NUMPY_AVAILABLE:
+        import numpy as np
+        column = np.array(dates, dtype='datetime64[D]')
+        timings['gregorian_to_jalali_array (numpy column)'] = best_of(
+            lambda: DateConverter.gregorian_to_jalali_array(column), repeat)
+        timings['jalali_components (numpy)'] = best_of(lambda: DateConverter.jalali_components(column), repeat)
+
+    baseline = timings['jdatetime strftime']
+    for name, best in timings.items():
+        print(f"{name}: {count} dates in {best * 1000:.1f} ms ({baseline / best:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,37 @@
+"""Time the payroll run diff on synthetic runs
+
+    python -m benchmarks.bench_payroll_diff [employees]
+"""
+import sys
+import time
+
+from benchmarks.bench_payroll_engine import make_inputs, make_personnel
+from payroll.diff import PayrollRun, diff_runs
+from payroll.engine import RateSnapshot, calculate_bulk
+
+
+def main(count: int = 50000, repeat: int = 5):
+    personnel = make_personnel(count)
+    inputs = make_inputs(personnel)
+    before = PayrollRun.from_rows("before", calculate_bulk(personnel, inputs, RateSnapshot())[0])
+
+    # A rate change touches everyone; a few employees leave and join
+    changed = [dict(personnel_row) for personnel_row in personnel[100:]]
+    for personnel_row in changed[::20]:
+        personnel_row['base_salary'] += 1000000
+    after_results, _ = calculate_bulk(changed, inputs, RateSnapshot(insurance_employer=0.235))
+    after = PayrollRun.from_rows("after", after_results)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        diff = diff_runs(before, after)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    print(f"{count} employees: best {best * 1000:.1f} ms, {len(diff.changed)} changed, "
+          f"{len(diff.removed)} removed, {len(diff.added)} added")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
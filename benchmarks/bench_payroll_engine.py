@@ -0,0 +1,54 @@
+"""Time the pure payroll engine on synthetic personnel
+
+    python -m benchmarks.bench_payroll_engine [employees]
+"""
+import random
+import sys
+import time
+
+from payroll.engine import PayrollInputs, RateSnapshot, calculate_bulk
+
+
+def make_personnel(count: int, seed: int = 1):
+    """Synthetic active personnel rows shaped like the personnel table"""
+    rng = random.Random(seed)
+    return [{
+        'id': personnel_id,
+        'base_salary': rng.randrange(56000000, 200000000, 100000),
+        'housing_allowance_rate': 0.25,
+        'family_allowance_rate': rng.choice([0, 0.1]),
+        'children_count': rng.randint(0, 4)
+    } for personnel_id in range(1, count + 1)]
+
+
+def make_inputs(personnel, seed: int = 2) -> PayrollInputs:
+    rng = random.Random(seed)
+    inputs = PayrollInputs()
+    for personnel_row in personnel:
+        personnel_id = personnel_row['id']
+        inputs.overtime_hours[personnel_id] = rng.choice([0, 0, 4, 8.5, 20])
+        if rng.random() < 0.3:
+            inputs.loan_deductions[personnel_id] = 500000
+        if rng.random() < 0.1:
+            inputs.advance_deductions[personnel_id] = 2000000
+    return inputs
+
+
+def main(count: int = 50000, repeat: int = 5):
+    personnel = make_personnel(count)
+    inputs = make_inputs(personnel)
+    rates = RateSnapshot()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results, errors = calculate_bulk(personnel, inputs, rates)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    print(f"{count} employees: best {best * 1000:.1f} ms "
+          f"({count / best:,.0f} employees/s), {len(errors)} errors")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
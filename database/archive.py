@@ -0,0 +1,365 @@
+"""Columnar archive of closed payroll years
+
+The payroll and attendance rows of a closed Jalali year are written to one
+compressed file per table, Parquet or Arrow IPC, with a JSON manifest
+beside them. Each month is its own row group (Parquet) or record batch
+(Arrow), and the manifest records which, so a report of one archived
+month memory-maps the file and decodes only that month. Employee code and
+name are stored with every row, as they were when the year was archived.
+
+Once the files are written and read back, the year can be detached: its
+rows are deleted from the live tables in one transaction, which is only
+committed if exactly the archived rows are deleted. Reports of an archived
+year read the files whether or not it was detached.
+
+Without pyarrow years cannot be archived and archived years cannot be
+read: reports of a year still in the live tables fall back to them, and
+reports of a detached year raise ArchiveError.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from database.backup import file_sha256
+from utils.date_converter import DateConverter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+ARCHIVE_PREFIX = "faran_archive_"
+MANIFEST_EXTENSION = ".json"
+ARCHIVE_FORMATS = {'parquet': ".parquet", 'arrow': ".arrow"}
+DEFAULT_ARCHIVE_FORMAT = 'parquet'
+ARCHIVE_COMPRESSION = 'zstd'
+DEFAULT_ARCHIVE_PATH = './archive'
+
+# Archived columns of each table with their Arrow type names; rows of a
+# month are selected by the query, and "month" is the Jalali month
+ARCHIVE_TABLES = {
+    'payroll': {
+        'columns': [
+            ('id', 'int'), ('personnel_id', 'int'), ('employee_code', 'text'), ('full_name', 'text'),
+            ('year', 'int'), ('month', 'int'),
+            ('base_salary', 'money'), ('housing_allowance', 'money'), ('family_allowance', 'money'),
+            ('child_allowance', 'money'), ('overtime_amount', 'money'), ('other_allowances', 'money'),
+            ('gross_salary', 'money'), ('insurance_employee', 'money'), ('insurance_employer', 'money'),
+            ('tax_amount', 'money'), ('loan_deduction', 'money'), ('advance_deduction', 'money'),
+            ('other_deductions', 'money'), ('net_salary', 'money'),
+            ('payment_date', 'date'), ('is_paid', 'bool'), ('created_at', 'timestamp'),
+            ('calculated_at', 'timestamp'), ('settings_hash', 'text')
+        ],
+        'query': """
+            SELECT pr.*, p.employee_code, p.first_name || ' ' || p.last_name AS full_name
+            FROM payroll pr
+            LEFT JOIN personnel p ON p.id = pr.personnel_id
+            WHERE pr.year = %(year)s AND pr.month = %(month)s
+            ORDER BY p.employee_code, pr.id
+        """,
+        'delete': "DELETE FROM payroll WHERE year = %(year)s"
+    },
+    'attendance': {
+        'columns': [
+            ('id', 'int'), ('personnel_id', 'int'), ('employee_code', 'text'), ('full_name', 'text'),
+            ('month', 'int'), ('date', 'date'), ('entry_time', 'time'), ('exit_time', 'time'),
+            ('overtime_hours', 'hours'), ('absence_type', 'text'), ('description', 'text'),
+            ('created_at', 'timestamp')
+        ],
+        'query': """
+            SELECT a.*, %(month)s AS month, p.employee_code, p.first_name || ' ' || p.last_name AS full_name
+            FROM attendance a
+            LEFT JOIN personnel p ON p.id = a.personnel_id
+            WHERE a.date >= %(start)s AND a.date < %(end)s
+            ORDER BY a.date, a.id
+        """,
+        'delete': "DELETE FROM attendance WHERE date >= %(start)s AND date < %(end)s"
+    }
+}
+
+# Called with the table being archived, months done and total months
+ArchiveProgressCallback = Callable[[str, int, int], None]
+
+
+class ArchiveError(Exception):
+    """A year that could not be archived, detached or read"""
+
+
+def arrow_schema(table: str):
+    """Arrow schema of an archived table"""
+    types = {
+        'int': pa.int64(),
+        'text': pa.string(),
+        'money': pa.decimal128(18, 2),
+        'hours': pa.decimal128(8, 2),
+        'bool': pa.bool_(),
+        'date': pa.date32(),
+        'time': pa.time64('us'),
+        'timestamp': pa.timestamp('us')
+    }
+    return pa.schema([(name, types[kind]) for name, kind in ARCHIVE_TABLES[table]['columns']])
+
+
+def manifest_path(archive_dir: str, year: int) -> str:
+    return os.path.join(archive_dir, f"{ARCHIVE_PREFIX}{year}{MANIFEST_EXTENSION}")
+
+
+def read_archive_manifest(archive_dir: str, year: int) -> Optional[Dict[str, Any]]:
+    """Manifest of an archived year, or None if the year is not archived"""
+    try:
+        with open(manifest_path(archive_dir, year), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def archived_years(archive_dir: str) -> List[int]:
+    """Jalali years with an archive manifest in a directory"""
+    if not os.path.isdir(archive_dir):
+        return []
+    years = []
+    for name in os.listdir(archive_dir):
+        stem = name[len(ARCHIVE_PREFIX):-len(MANIFEST_EXTENSION)]
+        if name.startswith(ARCHIVE_PREFIX) and name.endswith(MANIFEST_EXTENSION) and stem.isdigit():
+            years.append(int(stem))
+    return sorted(years)
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    partial_path = path + '.part'
+    with open(partial_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+    os.replace(partial_path, path)
+
+
+class YearArchive:
+    """Read-only access to the archived years of a directory
+
+    Files are memory-mapped and only the month asked for is decoded.
+    """
+
+    def __init__(self, archive_dir: str = DEFAULT_ARCHIVE_PATH):
+        self.archive_dir = archive_dir
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> 'YearArchive':
+        """Archive of the "archive_path" application setting"""
+        return cls(settings.get('application', {}).get('archive_path', DEFAULT_ARCHIVE_PATH))
+
+    def years(self) -> List[int]:
+        return archived_years(self.archive_dir)
+
+    def manifest(self, year: int) -> Optional[Dict[str, Any]]:
+        # Read each time: a year may be archived while a report window is open
+        return read_archive_manifest(self.archive_dir, year)
+
+    def has_year(self, year: int) -> bool:
+        """Whether reports of a year are read from the archive"""
+        manifest = self.manifest(year)
+        if manifest is None:
+            return False
+        if not PYARROW_AVAILABLE:
+            # The live tables of a detached year are empty; never report them as its data
+            if manifest.get('detached'):
+                raise ArchiveError(f"{year} is detached to the archive, and pyarrow is not installed to read it")
+            logger.warning(f"{year} is archived, but pyarrow is not installed to read it")
+            return False
+        return True
+
+    def rows(self, table: str, year: int, month: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Archived rows of a table in a year, or in one month of it"""
+        manifest = self.manifest(year)
+        if manifest is None or table not in manifest['tables']:
+            raise ArchiveError(f"{table} of {year} is not archived")
+        entry = manifest['tables'][table]
+        path = os.path.join(self.archive_dir, entry['file'])
+        months = entry['months'] if month is None else {str(month): entry['months'].get(str(month))}
+        chunks = [chunk for chunk in months.values() if chunk is not None]
+
+        if manifest['format'] == 'parquet':
+            with pq.ParquetFile(path, memory_map=True) as archive_file:
+                return [row for chunk in chunks for row in archive_file.read_row_group(chunk).to_pylist()]
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            return [row for chunk in chunks for row in reader.get_batch(chunk).to_pylist()]
+
+
+class DatabaseArchive:
+    """Archives one closed Jalali year of a database, optionally detaching it"""
+
+    def __init__(self, db, archive_dir: str, file_format: str = DEFAULT_ARCHIVE_FORMAT,
+                 progress: Optional[ArchiveProgressCallback] = None):
+        if file_format not in ARCHIVE_FORMATS:
+            raise ArchiveError(f"Unknown archive format: {file_format}")
+        self.db = db
+        self.archive_dir = archive_dir
+        self.file_format = file_format
+        self.progress = progress
+
+    def run(self, year: int, detach: bool = False) -> Dict[str, Any]:
+        """Write and verify the archive of a year; returns its manifest"""
+        if not PYARROW_AVAILABLE:
+            raise ArchiveError("pyarrow is needed to archive a year")
+        if self.db.connection is None:
+            raise ArchiveError("A database connection is needed to archive a year")
+        if year >= DateConverter.get_current_jalali_date().year:
+            raise ArchiveError(f"{year} is not closed yet")
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        start = time.perf_counter()
+        previous = read_archive_manifest(self.archive_dir, year)
+        tables = self._export(year, previous)
+
+        manifest = {
+            'year': year,
+            'format': self.file_format,
+            'compression': ARCHIVE_COMPRESSION,
+            'database': self.db.config.get('database'),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'detached': False,
+            'tables': tables
+        }
+        for entry in tables.values():
+            partial_path = os.path.join(self.archive_dir, entry['file'] + '.part')
+            os.replace(partial_path, os.path.join(self.archive_dir, entry['file']))
+        _write_json(manifest_path(self.archive_dir, year), manifest)
+        # Files of an earlier archive of the year in the other format
+        current = {entry['file'] for entry in tables.values()}
+        for entry in (previous or {}).get('tables', {}).values():
+            if entry['file'] not in current and os.path.exists(os.path.join(self.archive_dir, entry['file'])):
+                os.remove(os.path.join(self.archive_dir, entry['file']))
+
+        if detach:
+            self._detach(year, tables)
+            manifest.update({'detached': True, 'detached_at': datetime.now().isoformat(timespec='seconds')})
+            _write_json(manifest_path(self.archive_dir, year), manifest)
+
+        manifest['duration'] = time.perf_counter() - start
+        logger.info(f"Archived {year}: " + ", ".join(f"{entry['rows']:,} {table} rows"
+                                                     for table, entry in tables.items())
+                    + f" in {manifest['duration']:.1f}s")
+        return manifest
+
+    def _report(self, table: str, done: int, total: int):
+        if self.progress:
+            self.progress(table, done, total)
+
+    def _period_params(self, year: int, month: int) -> Dict[str, Any]:
+        start, end = DateConverter.jalali_period_range(year, month)
+        return {'year': year, 'month': month, 'start': start, 'end': end}
+
+    def _export(self, year: int, previous: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Write every table month by month from one read-only snapshot"""
+        connection = self.db.connection
+        tables = {}
+        partial_paths = []
+        connection.rollback()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                for table in ARCHIVE_TABLES:
+                    name = f"{ARCHIVE_PREFIX}{year}_{table}{ARCHIVE_FORMATS[self.file_format]}"
+                    partial_path = os.path.join(self.archive_dir, name + '.part')
+                    partial_paths.append(partial_path)
+                    entry = self._write_table(cursor, table, year, partial_path)
+                    entry['file'] = name
+
+                    # A detached year is no longer in the database to archive again
+                    archived = (previous or {}).get('tables', {}).get(table, {}).get('rows', 0)
+                    if entry['rows'] < archived:
+                        raise ArchiveError(f"{table} of {year} has {entry['rows']} rows, "
+                                           f"{archived} were archived before; keeping the old archive")
+                    self._verify(partial_path, entry)
+                    tables[table] = entry
+            connection.rollback()
+            return tables
+        except BaseException:
+            connection.rollback()
+            for partial_path in partial_paths:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            raise
+
+    def _write_table(self, cursor, table: str, year: int, path: str) -> Dict[str, Any]:
+        """One row group or record batch per month that has rows"""
+        schema = arrow_schema(table)
+        if self.file_format == 'parquet':
+            writer = pq.ParquetWriter(path, schema, compression=ARCHIVE_COMPRESSION)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=ARCHIVE_COMPRESSION)
+            writer = pa.ipc.new_file(path, schema, options=options)
+
+        months = {}
+        rows = 0
+        try:
+            for month in range(1, 13):
+                self._report(table, month - 1, 12)
+                cursor.execute(ARCHIVE_TABLES[table]['query'], self._period_params(year, month))
+                columns = [desc[0] for desc in cursor.description]
+                records = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                if not records:
+                    continue
+                batch = pa.RecordBatch.from_pylist(records, schema=schema)
+                if self.file_format == 'parquet':
+                    writer.write_table(pa.Table.from_batches([batch]), row_group_size=batch.num_rows)
+                else:
+                    writer.write_batch(batch)
+                months[str(month)] = len(months)
+                rows += batch.num_rows
+            self._report(table, 12, 12)
+        finally:
+            writer.close()
+        return {'rows': rows, 'months': months}
+
+    def _verify(self, path: str, entry: Dict[str, Any]):
+        """Read a written file back and record its checksum"""
+        if self.file_format == 'parquet':
+            with pq.ParquetFile(path, memory_map=True) as archive_file:
+                chunks, rows = archive_file.metadata.num_row_groups, archive_file.metadata.num_rows
+        else:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                chunks = reader.num_record_batches
+                rows = sum(reader.get_batch(chunk).num_rows for chunk in range(chunks))
+        if chunks != len(entry['months']) or rows != entry['rows']:
+            raise ArchiveError(f"{os.path.basename(path)} holds {rows} rows in {chunks} chunks, "
+                               f"expected {entry['rows']} in {len(entry['months'])}")
+        entry['size'] = os.path.getsize(path)
+        entry['sha256'] = file_sha256(path)
+
+    def _detach(self, year: int, tables: Dict[str, Dict[str, Any]]):
+        """Delete the archived rows from the live tables if nothing changed since"""
+        first_day = DateConverter.jalali_period_range(year, 1)[0]
+        last_day = DateConverter.jalali_period_range(year, 12)[1]
+        params = {'year': year, 'start': first_day, 'end': last_day}
+
+        connection = self.db.connection
+        try:
+            with connection.cursor() as cursor:
+                # Deleting old attendance changes no payroll that is still open
+                cursor.execute("ALTER TABLE attendance DISABLE TRIGGER payroll_dirty_delete")
+                for table, entry in tables.items():
+                    cursor.execute(ARCHIVE_TABLES[table]['delete'], params)
+                    if cursor.rowcount != entry['rows']:
+                        raise ArchiveError(f"{table} of {year} changed while it was archived "
+                                           f"({cursor.rowcount} rows, {entry['rows']} archived)")
+                cursor.execute("ALTER TABLE attendance ENABLE TRIGGER payroll_dirty_delete")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        logger.info(f"Detached {year} from the payroll and attendance tables")
+
+
+def archive_year(db, year: int, archive_dir: str, file_format: str = DEFAULT_ARCHIVE_FORMAT,
+                 detach: bool = False, progress: Optional[ArchiveProgressCallback] = None) -> Dict[str, Any]:
+    """Archive a closed year; raises ArchiveError or OSError on failure"""
+    return DatabaseArchive(db, archive_dir, file_format, progress).run(year, detach)
@@ -0,0 +1,544 @@
+"""Streaming database backups
+
+A backup is written chunk by chunk and never held in memory. With the
+pg_dump client installed it is a custom-format archive (compressed by
+pg_dump itself, restorable in parallel by pg_restore). Otherwise every
+table is dumped with COPY inside one read-only snapshot into a gzip file
+of COPY text sections; in demo mode the demo rows are written the same
+way.
+
+A differential backup holds only what changed since the latest full
+backup: triggers log the keys of every changed row to backup_changes with
+the id of the writing transaction, and the rows the full backup's
+snapshot did not see are written as COPY sections (the changed keys, then
+the current rows). Restoring the full backup and then its newest
+differential gives the state at the differential.
+
+Every backup gets a JSON manifest beside it with the SHA-256 of the file
+as written. The file is read back once at the end and the backup only
+succeeds if the checksum matches. One backup runs at a time per process;
+scheduled backups run at low CPU and IO priority and old files are pruned
+by a retention count.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from database.database_manager import CHANGE_TRACKED_TABLES, DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = "faran_payroll_backup_"
+CUSTOM_EXTENSION = ".dump"
+COPY_EXTENSION = ".copy.gz"
+MANIFEST_EXTENSION = ".json"
+CHUNK_SIZE = 1024 * 1024
+# Seconds between progress reports
+PROGRESS_INTERVAL = 0.2
+
+# Tables of a COPY backup, in an order that satisfies their foreign keys
+BACKUP_TABLES = [
+    'personnel', 'attendance', 'loans', 'advances', 'payroll',
+    'payroll_month_summary', 'payroll_dirty', 'loan_installments',
+    'balance_ledger', 'employee_balances', 'payroll_rate_snapshots',
+    'payroll_inputs', 'jalali_calendar'
+]
+
+# Header lines of a COPY backup; a section holds a table's rows ("table")
+# or, in a differential backup, the keys of its changed rows ("keys")
+COPY_FORMAT_HEADER = "-- faran copy backup 1\n"
+COPY_SECTION_HEADER = "-- {section} {table} ({columns})\n"
+COPY_END_OF_DATA = "\\.\n"
+
+# backup_changes rows that are not row changes: the snapshot of the last
+# full backup, and a restore (after which only a full backup is valid)
+FULL_BACKUP_MARKER = '*full'
+RESTORE_MARKER = '*restore'
+SNAPSHOT_QUERY = "SELECT pg_current_snapshot()::text, to_regclass('backup_changes') IS NOT NULL"
+
+# Called with the bytes written so far and the fraction done (None when unknown)
+ProgressCallback = Callable[[int, Optional[float]], None]
+
+# Held while a backup is written, so manual and scheduled backups never overlap
+BACKUP_LOCK = threading.Lock()
+
+# Niceness of low-priority backups and of the pg_dump they start
+LOW_PRIORITY_NICENESS = 10
+
+
+class BackupError(Exception):
+    """A backup that could not be written or did not verify"""
+
+
+class _ProgressWriter:
+    """File wrapper hashing and counting what is written, reporting progress now and then"""
+
+    def __init__(self, file, progress: Optional[ProgressCallback] = None):
+        self.file = file
+        self.progress = progress
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.fraction: Optional[float] = None
+        self._reported = 0.0
+
+    def write(self, data: bytes) -> int:
+        self.file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        now = time.perf_counter()
+        if self.progress and now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            self.progress(self.size, self.fraction)
+        return len(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+def backup_filename(kind: str = 'full', extension: str = CUSTOM_EXTENSION,
+                    timestamp: Optional[datetime] = None) -> str:
+    """File name of a new backup"""
+    stamp = (timestamp or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    suffix = '' if kind == 'full' else f"_{kind}"
+    return f"{BACKUP_PREFIX}{stamp}{suffix}{extension}"
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Manifest of a backup file, or None if it has none"""
+    try:
+        with open(path + MANIFEST_EXTENSION, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def list_backups(backup_dir: str) -> List[Dict[str, Any]]:
+    """Backups in a directory with their manifests, newest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        if name.startswith(BACKUP_PREFIX) and name.endswith((CUSTOM_EXTENSION, COPY_EXTENSION, '.sql')):
+            path = os.path.join(backup_dir, name)
+            backups.append({
+                'path': path,
+                'name': name,
+                'modified': os.path.getmtime(path),
+                'size': os.path.getsize(path),
+                'manifest': read_manifest(path)
+            })
+    backups.sort(key=lambda backup: backup['modified'], reverse=True)
+    return backups
+
+
+def backup_due(backup_dir: str, interval_days: int, now: Optional[datetime] = None) -> bool:
+    """Whether the newest backup is older than the interval (or there is none)"""
+    backups = [backup for backup in list_backups(backup_dir) if backup['manifest']]
+    if not backups:
+        return True
+    newest = datetime.fromtimestamp(backups[0]['modified'])
+    return (now or datetime.now()) - newest >= timedelta(days=interval_days)
+
+
+def latest_full_backup(backup_dir: str, database: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Manifest of the newest full backup of a database in a directory"""
+    for backup in list_backups(backup_dir):
+        manifest = backup['manifest']
+        if manifest and manifest.get('kind', 'full') == 'full' and \
+                (database is None or manifest.get('database') == database):
+            return manifest
+    return None
+
+
+def next_backup_kind(backup_dir: str, full_interval_days: int, now: Optional[datetime] = None) -> str:
+    """'full' when the latest full backup is older than the interval, else 'differential'"""
+    base = latest_full_backup(backup_dir)
+    if base is None or not base.get('snapshot'):
+        return 'full'
+    created = datetime.fromisoformat(base['created_at'])
+    return 'full' if (now or datetime.now()) - created >= timedelta(days=full_interval_days) else 'differential'
+
+
+def apply_retention(backup_dir: str, keep: int) -> List[str]:
+    """Delete all but the newest ``keep`` full backups (at least one) and their differentials
+
+    A differential is kept exactly as long as the full backup it is based on.
+    Returns the removed files.
+    """
+    backups = list_backups(backup_dir)
+    full_backups = [backup for backup in backups if (backup['manifest'] or {}).get('kind', 'full') == 'full']
+    kept = {backup['name'] for backup in full_backups[:max(keep, 1)]}
+
+    removed = []
+    for backup in backups:
+        manifest = backup['manifest'] or {}
+        if manifest.get('kind') == 'differential':
+            if manifest.get('base') in kept:
+                continue
+        elif backup['name'] in kept:
+            continue
+        for path in (backup['path'], backup['path'] + MANIFEST_EXTENSION):
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+    if removed:
+        logger.info(f"Removed {len(removed)} old backup files from {backup_dir}")
+    return removed
+
+
+def copy_text_value(value) -> str:
+    """A Python value in COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class DatabaseBackup:
+    """Writes one backup of a database to a directory"""
+
+    def __init__(self, config: Dict[str, Any], backup_dir: str,
+                 progress: Optional[ProgressCallback] = None,
+                 demo_data: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 low_priority: bool = False, kind: str = 'full'):
+        self.config = config
+        self.backup_dir = backup_dir
+        self.progress = progress
+        # Rows written instead of a database when there is no server
+        self.demo_data = demo_data
+        self.low_priority = low_priority
+        self.kind = kind
+
+    def connection_params(self) -> Dict[str, Any]:
+        return DatabaseManager(self.config).connection_params()
+
+    def run(self) -> Dict[str, Any]:
+        """Write, verify and describe a backup; returns its manifest
+
+        A differential backup falls back to a full one when there is no
+        usable base.
+        """
+        if not BACKUP_LOCK.acquire(blocking=False):
+            raise BackupError("Another backup is already running")
+        try:
+            if self.low_priority:
+                self._lower_thread_priority()
+            return self._run(self.kind)
+        finally:
+            BACKUP_LOCK.release()
+
+    @staticmethod
+    def _lower_thread_priority():
+        """Renice the calling thread (a thread is its own task on Linux)"""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOW_PRIORITY_NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not lower backup priority: {e}")
+
+    def _priority_prefix(self) -> List[str]:
+        """nice/ionice wrappers for a low-priority pg_dump, where installed"""
+        if not self.low_priority:
+            return []
+        prefix = []
+        if shutil.which('ionice'):
+            prefix += ['ionice', '-c', '3']
+        if shutil.which('nice'):
+            prefix += ['nice', '-n', str(LOW_PRIORITY_NICENESS)]
+        return prefix
+
+    def _run(self, kind: str) -> Dict[str, Any]:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        start = time.perf_counter()
+
+        base = self._differential_base() if kind == 'differential' else None
+        if base is not None:
+            path = os.path.join(self.backup_dir, backup_filename('differential', COPY_EXTENSION))
+            manifest = self._write(path, lambda writer: self._dump_differential(writer, base))
+            manifest.update({'format': 'copy', 'kind': 'differential',
+                             'base': base['file'], 'base_sha256': base['sha256']})
+        elif shutil.which('pg_dump') and self.demo_data is None:
+            # Taken before the dump: changes in between are in both, which is harmless
+            snapshot = self._change_snapshot()
+            path = os.path.join(self.backup_dir, backup_filename())
+            manifest = self._write(path, self._dump_custom)
+            manifest.update({'format': 'custom', 'kind': 'full', 'snapshot': snapshot})
+        else:
+            path = os.path.join(self.backup_dir, backup_filename(extension=COPY_EXTENSION))
+            manifest = self._write(path, self._dump_copy)
+            manifest.update({'format': 'copy', 'kind': 'full'})
+
+        manifest.update({
+            'file': os.path.basename(path),
+            'database': self.config.get('database'),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': time.perf_counter() - start
+        })
+        with open(path + MANIFEST_EXTENSION, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=4, ensure_ascii=False)
+        if manifest['kind'] == 'full' and manifest.get('snapshot'):
+            self._prune_change_log(manifest['snapshot'])
+
+        manifest['path'] = path
+        logger.info(f"{manifest['kind'].capitalize()} backup written to {path}: "
+                    f"{manifest['size']:,} bytes in {manifest['duration']:.1f}s")
+        return manifest
+
+    def _connect(self, readonly: bool = False):
+        """A connection of its own, in one read-only snapshot if asked"""
+        import psycopg2
+
+        connection = psycopg2.connect(**self.connection_params())
+        if readonly:
+            connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        return connection
+
+    def _change_snapshot(self) -> Optional[str]:
+        """Current snapshot, or None when the database does not log changes"""
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(SNAPSHOT_QUERY)
+                snapshot, logged = cursor.fetchone()
+            connection.rollback()
+            return snapshot if logged else None
+        finally:
+            connection.close()
+
+    def _prune_change_log(self, snapshot: str):
+        """Drop the changes a full backup contains and record it as the base of differentials"""
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM backup_changes WHERE pg_visible_in_snapshot(changed_xid, %s::pg_snapshot)",
+                    (snapshot,)
+                )
+                cursor.execute(
+                    "INSERT INTO backup_changes (table_name, row_key) VALUES (%s, %s)",
+                    (FULL_BACKUP_MARKER, json.dumps({'snapshot': snapshot}))
+                )
+            connection.commit()
+        except Exception as e:
+            # The next differential finds no matching marker and is written in full
+            logger.error(f"Error pruning backup change log: {e}")
+            connection.rollback()
+        finally:
+            connection.close()
+
+    def _differential_base(self) -> Optional[Dict[str, Any]]:
+        """The full backup a differential can be based on, or None to write a full one"""
+        if self.demo_data is not None:
+            return None
+        base = latest_full_backup(self.backup_dir, self.config.get('database'))
+        if base is None or not base.get('snapshot'):
+            logger.info("No full backup with a change snapshot, writing a full backup")
+            return None
+
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT
+                        (SELECT row_key->>'snapshot' FROM backup_changes
+                         WHERE table_name = %s ORDER BY id DESC LIMIT 1),
+                        EXISTS (SELECT 1 FROM backup_changes
+                                WHERE table_name = %s
+                                  AND NOT pg_visible_in_snapshot(changed_xid, %s::pg_snapshot))
+                """, (FULL_BACKUP_MARKER, RESTORE_MARKER, base['snapshot']))
+                last_full_snapshot, restored_since = cursor.fetchone()
+            connection.rollback()
+        finally:
+            connection.close()
+
+        # The log only goes back to the last full backup, and a restore replaces everything
+        if last_full_snapshot != base['snapshot'] or restored_since:
+            logger.info(f"{base['file']} is not the base of the change log, writing a full backup")
+            return None
+        return base
+
+    def _write(self, path: str, dump: Callable[[_ProgressWriter], Dict[str, Any]]) -> Dict[str, Any]:
+        """Stream a dump into a temporary file, verify it and move it in place"""
+        partial_path = path + '.part'
+        try:
+            with open(partial_path, 'wb') as file:
+                writer = _ProgressWriter(file, self.progress)
+                manifest = dump(writer)
+                writer.flush()
+                os.fsync(file.fileno())
+
+            checksum = writer.sha256.hexdigest()
+            if file_sha256(partial_path) != checksum:
+                raise BackupError(f"Checksum mismatch after writing {partial_path}")
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+        if self.progress:
+            self.progress(writer.size, 1.0)
+        manifest.update({'size': writer.size, 'sha256': checksum})
+        return manifest
+
+    def _dump_custom(self, writer: _ProgressWriter) -> Dict[str, Any]:
+        """pg_dump custom-format archive, copied from its stdout as it arrives"""
+        params = self.connection_params()
+        command = self._priority_prefix() + ['pg_dump', '--format=custom', '--compress=6', '--no-owner',
+                   '--host', str(params['host']), '--port', str(params['port']),
+                   '--username', params['user'], '--dbname', params['database']]
+        env = dict(os.environ, PGPASSWORD=str(params['password']))
+
+        # stderr goes to a file so a chatty pg_dump cannot block on a full pipe
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors, env=env)
+            try:
+                for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                    writer.write(chunk)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                message = errors.read().decode('utf-8', 'replace').strip()
+                raise BackupError(f"pg_dump failed ({returncode}): {message}")
+        return {}
+
+    def _dump_copy(self, writer: _ProgressWriter) -> Dict[str, Any]:
+        """COPY text of every table through gzip"""
+        with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6) as compressed:
+            compressed.write(COPY_FORMAT_HEADER.encode('utf-8'))
+            if self.demo_data is not None:
+                return {'tables': self._copy_demo_tables(compressed, writer)}
+            return self._copy_database_tables(compressed, writer)
+
+    def _copy_database_tables(self, compressed, writer: _ProgressWriter) -> Dict[str, Any]:
+        """COPY every table from one read-only snapshot"""
+        connection = self._connect(readonly=True)
+        try:
+            tables = {}
+            with connection.cursor() as cursor:
+                cursor.execute(SNAPSHOT_QUERY)
+                snapshot, logged = cursor.fetchone()
+                names = [table for table in BACKUP_TABLES if table in self._existing_tables(cursor)]
+                for position, table in enumerate(names):
+                    columns = self._columns(cursor, table)
+                    tables[table] = self._copy_section(cursor, compressed, 'table', table, columns,
+                                                       f"{table} ({', '.join(columns)})")
+                    writer.fraction = (position + 1) / len(names)
+            connection.rollback()
+            return {'tables': tables, 'snapshot': snapshot if logged else None}
+        finally:
+            connection.close()
+
+    def _dump_differential(self, writer: _ProgressWriter, base: Dict[str, Any]) -> Dict[str, Any]:
+        """Keys of the rows changed since the base backup, then those rows as they are now
+
+        Key sections come first, children before parents, so a restore can
+        delete rows removed since the base before it upserts the changed
+        rows parents first.
+        """
+        connection = self._connect(readonly=True)
+        try:
+            tables, keys = {}, {}
+            with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6) as compressed, \
+                    connection.cursor() as cursor:
+                compressed.write(COPY_FORMAT_HEADER.encode('utf-8'))
+                cursor.execute(SNAPSHOT_QUERY)
+                snapshot, _ = cursor.fetchone()
+                existing = self._existing_tables(cursor)
+                names = [table for table in BACKUP_TABLES if table in CHANGE_TRACKED_TABLES and table in existing]
+                base_snapshot = cursor.mogrify("%s::pg_snapshot", (base['snapshot'],)).decode('utf-8')
+
+                def changed_keys(table: str) -> str:
+                    key_columns = ', '.join(f"r.{column}" for column in CHANGE_TRACKED_TABLES[table])
+                    return f"""
+                        SELECT DISTINCT {key_columns}
+                        FROM backup_changes c
+                        CROSS JOIN LATERAL jsonb_populate_record(NULL::{table}, c.row_key) r
+                        WHERE c.table_name = '{table}'
+                          AND NOT pg_visible_in_snapshot(c.changed_xid, {base_snapshot})
+                    """
+
+                for position, table in enumerate(reversed(names)):
+                    keys[table] = self._copy_section(cursor, compressed, 'keys', table,
+                                                     list(CHANGE_TRACKED_TABLES[table]),
+                                                     f"({changed_keys(table)})")
+                    writer.fraction = (position + 1) / (2 * len(names))
+                for position, table in enumerate(names):
+                    columns = self._columns(cursor, table)
+                    key_columns = ', '.join(f"t.{column}" for column in CHANGE_TRACKED_TABLES[table])
+                    tables[table] = self._copy_section(
+                        cursor, compressed, 'table', table, columns,
+                        f"(SELECT {', '.join(f't.{column}' for column in columns)} FROM {table} t "
+                        f"WHERE ({key_columns}) IN ({changed_keys(table)}))"
+                    )
+                    writer.fraction = (len(names) + position + 1) / (2 * len(names))
+            connection.rollback()
+            return {'tables': tables, 'keys': keys, 'snapshot': snapshot}
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _existing_tables(cursor) -> set:
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def _columns(cursor, table: str) -> List[str]:
+        cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+        return [column[0] for column in cursor.description]
+
+    @staticmethod
+    def _copy_section(cursor, compressed, section: str, table: str, columns: List[str], source: str) -> int:
+        """One section: its header line, COPY text of source and the end-of-data line"""
+        compressed.write(COPY_SECTION_HEADER.format(section=section, table=table,
+                                                    columns=', '.join(columns)).encode('utf-8'))
+        cursor.copy_expert(f"COPY {source} TO STDOUT", compressed, CHUNK_SIZE)
+        compressed.write(COPY_END_OF_DATA.encode('utf-8'))
+        return cursor.rowcount
+
+    def _copy_demo_tables(self, compressed, writer: _ProgressWriter) -> Dict[str, int]:
+        """The demo rows in the same COPY text layout"""
+        names = [table for table in BACKUP_TABLES if self.demo_data.get(table)]
+        tables = {}
+        for position, table in enumerate(names):
+            rows = self.demo_data[table]
+            columns = list(dict.fromkeys(column for row in rows for column in row))
+            compressed.write(COPY_SECTION_HEADER.format(section='table', table=table,
+                                                        columns=', '.join(columns)).encode('utf-8'))
+            for row in rows:
+                line = '\t'.join(copy_text_value(row.get(column)) for column in columns) + '\n'
+                compressed.write(line.encode('utf-8'))
+            compressed.write(COPY_END_OF_DATA.encode('utf-8'))
+            tables[table] = len(rows)
+            writer.fraction = (position + 1) / len(names)
+        return tables
+
+
+def create_backup(config: Dict[str, Any], backup_dir: str, progress: Optional[ProgressCallback] = None,
+                  demo_data: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                  low_priority: bool = False, kind: str = 'full') -> Dict[str, Any]:
+    """Write a full or differential backup; raises BackupError or OSError on failure"""
+    return DatabaseBackup(config, backup_dir, progress, demo_data, low_priority, kind).run()
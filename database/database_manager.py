@@ -1,6 +1,11 @@
 import logging
 import json
-from typing import List, Dict, Any, Optional
+import re
+import weakref
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils.date_converter import DateConverter
+from utils.jalali_calendar import JalaliCalendar, load_calendar
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +17,79 @@ except ImportError:
     PSYCOPG2_AVAILABLE = False
     logger.warning("psycopg2 not available, running in demo mode")
 
+# Aggregates kept per (year, month) in payroll_month_summary
+PAYROLL_SUMMARY_COLUMNS = {
+    'employee_count': "COUNT(*)",
+    'total_base_salary': "COALESCE(SUM(base_salary), 0)",
+    'total_housing_allowance': "COALESCE(SUM(housing_allowance), 0)",
+    'total_family_allowance': "COALESCE(SUM(family_allowance), 0)",
+    'total_child_allowance': "COALESCE(SUM(child_allowance), 0)",
+    'total_overtime_amount': "COALESCE(SUM(overtime_amount), 0)",
+    'total_other_allowances': "COALESCE(SUM(other_allowances), 0)",
+    'total_gross_salary': "COALESCE(SUM(gross_salary), 0)",
+    'total_insurance_employee': "COALESCE(SUM(insurance_employee), 0)",
+    'total_insurance_employer': "COALESCE(SUM(insurance_employer), 0)",
+    'total_tax': "COALESCE(SUM(tax_amount), 0)",
+    'total_loan_deduction': "COALESCE(SUM(loan_deduction), 0)",
+    'total_advance_deduction': "COALESCE(SUM(advance_deduction), 0)",
+    'total_other_deductions': "COALESCE(SUM(other_deductions), 0)",
+    'total_net_salary': "COALESCE(SUM(net_salary), 0)",
+    'paid_count': "COUNT(*) FILTER (WHERE is_paid)",
+    'paid_amount': "COALESCE(SUM(net_salary) FILTER (WHERE is_paid), 0)",
+    'unpaid_amount': "COALESCE(SUM(net_salary) FILTER (WHERE is_paid IS NOT TRUE), 0)"
+}
+
+# Tables posting to balance_ledger: account, amount column, status column and its value while open
+BALANCE_SOURCES = {
+    'loans': ('loan', 'loan_amount', 'is_active', 'TRUE'),
+    'advances': ('advance', 'advance_amount', 'is_settled', 'FALSE')
+}
+
+# Tables whose changed rows are logged to backup_changes for differential
+# backups, with their key columns (derived summaries are rebuilt instead)
+CHANGE_TRACKED_TABLES = {
+    'personnel': ('id',),
+    'attendance': ('id',),
+    'loans': ('id',),
+    'advances': ('id',),
+    'payroll': ('id',),
+    'payroll_dirty': ('personnel_id',),
+    'loan_installments': ('id',),
+    'balance_ledger': ('id',),
+    'payroll_rate_snapshots': ('settings_hash',),
+    'payroll_inputs': ('year', 'month', 'personnel_id'),
+    'jalali_calendar': ('gregorian_date',)
+}
+
+
+def summarize_payroll_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Aggregate payroll rows held in memory like payroll_month_summary"""
+    fields = {column: 'tax_amount' if column == 'total_tax' else column[len('total_'):]
+              for column in PAYROLL_SUMMARY_COLUMNS if column.startswith('total_')}
+    summary = {}
+    for row in rows:
+        month = summary.setdefault((row['year'], row['month']), {
+            'year': row['year'], 'month': row['month'],
+            **{column: 0 for column in PAYROLL_SUMMARY_COLUMNS}
+        })
+        month['employee_count'] += 1
+        for column, field in fields.items():
+            month[column] += row.get(field) or 0
+        if row.get('is_paid'):
+            month['paid_count'] += 1
+            month['paid_amount'] += row['net_salary']
+        else:
+            month['unpaid_amount'] += row['net_salary']
+    return list(summary.values())
+
+
 class DatabaseManager:
-    def __init__(self):
+    # Connected managers of this process, so their transactions can be ended before a restore
+    _connected = weakref.WeakSet()
+    
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
         self.connection = None
-        self.config = self.load_config()
+        self.config = config if config is not None else self.load_config()
         self.demo_data = self.load_demo_data()
         
     def load_config(self) -> Dict[str, Any]:
@@ -73,14 +147,25 @@ class DatabaseManager:
                     'id': 1, 'personnel_id': 1, 'loan_amount': 10000000,
                     'installment_amount': 500000, 'remaining_installments': 18,
                     'total_installments': 20, 'start_date': '2024-01-01',
-                    'description': 'وام مسکن', 'is_active': True
+                    'description': 'وام مسکن', 'is_active': True,
+                    'created_at': '2024-01-01 09:00:00'
                 }
             ],
+            'loan_installments': [
+                {
+                    'id': 3, 'loan_id': 1, 'personnel_id': 1, 'installment_number': 3,
+                    'due_year': 1402, 'due_month': 12, 'amount': 500000, 'status': 'due'
+                }
+            ],
+            'employee_balances': [
+                {'personnel_id': 1, 'loan_balance': 9000000, 'advance_balance': 0},
+                {'personnel_id': 2, 'loan_balance': 0, 'advance_balance': 2000000}
+            ],
             'advances': [
                 {
                     'id': 1, 'personnel_id': 2, 'advance_amount': 2000000,
                     'advance_date': '2024-01-10', 'description': 'مساعده درمان',
-                    'is_settled': False
+                    'is_settled': False, 'created_at': '2024-01-10 11:00:00'
                 }
             ],
             'payroll': [
@@ -105,13 +190,8 @@ class DatabaseManager:
             return True
             
         try:
-            self.connection = psycopg2.connect(
-                host=self.config.get('host', 'localhost'),
-                port=self.config.get('port', 5432),
-                database=self.config.get('database', 'faran_payroll'),
-                user=self.config.get('username', 'postgres'),
-                password=self.config.get('password', 'password')
-            )
+            self.connection = psycopg2.connect(**self.connection_params())
+            DatabaseManager._connected.add(self)
             logger.info("Database connected successfully")
             return True
         except Exception as e:
@@ -119,6 +199,28 @@ class DatabaseManager:
             logger.info("Falling back to demo mode")
             return False
     
+    def connection_params(self) -> Dict[str, Any]:
+        """psycopg2 connection keyword arguments from the database config"""
+        return {
+            'host': self.config.get('host', 'localhost'),
+            'port': self.config.get('port', 5432),
+            'database': self.config.get('database', 'faran_payroll'),
+            'user': self.config.get('username', 'postgres'),
+            'password': self.config.get('password', 'password')
+        }
+    
+    @classmethod
+    def end_open_transactions(cls):
+        """Roll back idle open transactions of this process's connections
+        
+        Called before a restore, which needs exclusive locks on every table.
+        """
+        idle = (psycopg2.extensions.TRANSACTION_STATUS_INTRANS, psycopg2.extensions.TRANSACTION_STATUS_INERROR)
+        for manager in list(cls._connected):
+            connection = manager.connection
+            if connection is not None and not connection.closed and connection.info.transaction_status in idle:
+                connection.rollback()
+    
     def disconnect(self):
         """Close database connection"""
         if self.connection:
@@ -142,24 +244,35 @@ class DatabaseManager:
                 self.connection.rollback()
             return False
     
+    def execute_transaction(self, statements: List[Tuple[str, Optional[tuple]]]) -> Optional[List[int]]:
+        """Execute statements in one transaction, returning each one's row count
+        
+        Nothing is committed unless every statement succeeds; None is
+        returned after a rollback.
+        """
+        if not PSYCOPG2_AVAILABLE or not self.connection:
+            logger.info("Demo mode: Transaction execution simulated")
+            return [0] * len(statements)
+            
+        try:
+            row_counts = []
+            with self.connection.cursor() as cursor:
+                for query, params in statements:
+                    cursor.execute(query, params)
+                    row_counts.append(cursor.rowcount)
+            self.connection.commit()
+            return row_counts
+        except Exception as e:
+            logger.error(f"Transaction error: {e}")
+            if self.connection:
+                self.connection.rollback()
+            return None
+    
     def fetch_all(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
         """Fetch all results from query"""
         if not PSYCOPG2_AVAILABLE or not self.connection:
-            # Return demo data based on query type
-            query_lower = query.lower()
-            
-            if 'personnel' in query_lower:
-                return self.demo_data['personnel']
-            elif 'attendance' in query_lower:
-                return self.demo_data['attendance']
-            elif 'loans' in query_lower:
-                return self.demo_data['loans']
-            elif 'advances' in query_lower:
-                return self.demo_data['advances']
-            elif 'payroll' in query_lower:
-                return self.demo_data['payroll']
-            else:
-                return []
+            # Return demo data based on the table the query selects from
+            return self.fetch_demo_data(query)
             
         try:
             with self.connection.cursor() as cursor:
@@ -168,10 +281,45 @@ class DatabaseManager:
                 results = []
                 for row in cursor.fetchall():
                     results.append(dict(zip(columns, row)))
-                return results
+            # End the transaction, so no locks are held between queries
+            self.connection.commit()
+            return results
         except Exception as e:
             logger.error(f"Fetch all error: {e}")
+            self.connection.rollback()
+            return []
+    
+    def fetch_demo_data(self, query: str) -> List[Dict[str, Any]]:
+        """Return demo rows for the main table of a query"""
+        match = re.search(r'\bfrom\s+(\w+)', query, re.IGNORECASE)
+        table = match.group(1).lower() if match else ''
+        
+        if table == 'payroll_month_summary':
+            return self.demo_payroll_month_summary()
+        
+        if table not in self.demo_data:
             return []
+        
+        rows = self.demo_data[table]
+        if table == 'personnel':
+            return rows
+        
+        # Demo rows of other tables carry the joined personnel columns
+        personnel = {person['id']: person for person in self.demo_data['personnel']}
+        joined = []
+        for row in rows:
+            person = personnel.get(row.get('personnel_id'), {})
+            joined.append({
+                'employee_code': person.get('employee_code'),
+                'first_name': person.get('first_name'),
+                'last_name': person.get('last_name'),
+                **row
+            })
+        return joined
+    
+    def demo_payroll_month_summary(self) -> List[Dict[str, Any]]:
+        """Aggregate the demo payroll rows like payroll_month_summary"""
+        return summarize_payroll_rows(self.demo_data['payroll'])
     
     def fetch_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
         """Fetch single result from query"""
@@ -265,8 +413,124 @@ class DatabaseManager:
                     payment_date DATE,
                     is_paid BOOLEAN DEFAULT FALSE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    calculated_at TIMESTAMP,
+                    settings_hash VARCHAR(40),
                     UNIQUE(personnel_id, year, month)
                 )
+            """,
+            'payroll_month_summary': """
+                CREATE TABLE IF NOT EXISTS payroll_month_summary (
+                    year INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    employee_count INTEGER DEFAULT 0,
+                    total_base_salary DECIMAL(18,2) DEFAULT 0,
+                    total_housing_allowance DECIMAL(18,2) DEFAULT 0,
+                    total_family_allowance DECIMAL(18,2) DEFAULT 0,
+                    total_child_allowance DECIMAL(18,2) DEFAULT 0,
+                    total_overtime_amount DECIMAL(18,2) DEFAULT 0,
+                    total_other_allowances DECIMAL(18,2) DEFAULT 0,
+                    total_gross_salary DECIMAL(18,2) DEFAULT 0,
+                    total_insurance_employee DECIMAL(18,2) DEFAULT 0,
+                    total_insurance_employer DECIMAL(18,2) DEFAULT 0,
+                    total_tax DECIMAL(18,2) DEFAULT 0,
+                    total_loan_deduction DECIMAL(18,2) DEFAULT 0,
+                    total_advance_deduction DECIMAL(18,2) DEFAULT 0,
+                    total_other_deductions DECIMAL(18,2) DEFAULT 0,
+                    total_net_salary DECIMAL(18,2) DEFAULT 0,
+                    paid_count INTEGER DEFAULT 0,
+                    paid_amount DECIMAL(18,2) DEFAULT 0,
+                    unpaid_amount DECIMAL(18,2) DEFAULT 0,
+                    PRIMARY KEY (year, month)
+                )
+            """,
+            'payroll_dirty': """
+                CREATE TABLE IF NOT EXISTS payroll_dirty (
+                    personnel_id INTEGER PRIMARY KEY,
+                    changed_at TIMESTAMP NOT NULL,
+                    source VARCHAR(20)
+                )
+            """,
+            'loan_installments': """
+                CREATE TABLE IF NOT EXISTS loan_installments (
+                    id SERIAL PRIMARY KEY,
+                    loan_id INTEGER NOT NULL REFERENCES loans(id) ON DELETE CASCADE,
+                    personnel_id INTEGER REFERENCES personnel(id),
+                    installment_number INTEGER NOT NULL,
+                    due_year INTEGER NOT NULL,
+                    due_month INTEGER NOT NULL,
+                    amount DECIMAL(15,2) NOT NULL,
+                    status VARCHAR(10) DEFAULT 'due',
+                    paid_at TIMESTAMP,
+                    UNIQUE (loan_id, installment_number)
+                )
+            """,
+            'balance_ledger': """
+                CREATE TABLE IF NOT EXISTS balance_ledger (
+                    id BIGSERIAL PRIMARY KEY,
+                    personnel_id INTEGER NOT NULL REFERENCES personnel(id),
+                    account VARCHAR(10) NOT NULL,
+                    source_id INTEGER NOT NULL,
+                    entry_type VARCHAR(20) NOT NULL,
+                    amount DECIMAL(15,2) NOT NULL,
+                    year INTEGER,
+                    month INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            'employee_balances': """
+                CREATE TABLE IF NOT EXISTS employee_balances (
+                    personnel_id INTEGER PRIMARY KEY REFERENCES personnel(id),
+                    loan_balance DECIMAL(15,2) DEFAULT 0,
+                    advance_balance DECIMAL(15,2) DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            'payroll_rate_snapshots': """
+                CREATE TABLE IF NOT EXISTS payroll_rate_snapshots (
+                    settings_hash VARCHAR(40) PRIMARY KEY,
+                    rates TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            'payroll_inputs': """
+                CREATE TABLE IF NOT EXISTS payroll_inputs (
+                    year INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    personnel_id INTEGER NOT NULL,
+                    employee_code VARCHAR(20),
+                    position VARCHAR(100),
+                    base_salary DECIMAL(15,2) NOT NULL,
+                    housing_allowance_rate DECIMAL(5,2) DEFAULT 0,
+                    family_allowance_rate DECIMAL(5,2) DEFAULT 0,
+                    children_count INTEGER DEFAULT 0,
+                    overtime_hours DECIMAL(8,2) DEFAULT 0,
+                    loan_deduction DECIMAL(15,2) DEFAULT 0,
+                    advance_deduction DECIMAL(15,2) DEFAULT 0,
+                    settings_hash VARCHAR(40) REFERENCES payroll_rate_snapshots(settings_hash),
+                    captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (year, month, personnel_id)
+                )
+            """,
+            'jalali_calendar': """
+                CREATE TABLE IF NOT EXISTS jalali_calendar (
+                    gregorian_date DATE PRIMARY KEY,
+                    jalali_year INTEGER NOT NULL,
+                    jalali_month INTEGER NOT NULL,
+                    jalali_day INTEGER NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    is_holiday BOOLEAN DEFAULT FALSE,
+                    is_working_day BOOLEAN DEFAULT TRUE,
+                    holiday_name VARCHAR(100)
+                )
+            """,
+            'backup_changes': """
+                CREATE TABLE IF NOT EXISTS backup_changes (
+                    id BIGSERIAL PRIMARY KEY,
+                    table_name VARCHAR(63) NOT NULL,
+                    row_key JSONB NOT NULL,
+                    changed_xid XID8 DEFAULT pg_current_xact_id(),
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
             """
         }
         
@@ -275,5 +539,425 @@ class DatabaseManager:
                 logger.error(f"Failed to create table: {table_name}")
                 return False
         
+        # Columns added after the first release; CREATE TABLE IF NOT EXISTS skips them
+        columns = {
+            'payroll.calculated_at': "ALTER TABLE payroll ADD COLUMN IF NOT EXISTS calculated_at TIMESTAMP",
+            'payroll.settings_hash': "ALTER TABLE payroll ADD COLUMN IF NOT EXISTS settings_hash VARCHAR(40)"
+        }
+        
+        for column_name, column_query in columns.items():
+            if not self.execute_query(column_query):
+                logger.error(f"Failed to add column: {column_name}")
+                return False
+        
+        indexes = {
+            # Keyset pagination of the attendance, loans and advances lists
+            'idx_attendance_date_id': "CREATE INDEX IF NOT EXISTS idx_attendance_date_id ON attendance (date DESC, id DESC)",
+            'idx_loans_created_id': "CREATE INDEX IF NOT EXISTS idx_loans_created_id ON loans (created_at DESC, id DESC)",
+            'idx_advances_created_id': "CREATE INDEX IF NOT EXISTS idx_advances_created_id ON advances (created_at DESC, id DESC)",
+            # List filters; the trailing sort key keeps filtered pages index-ordered
+            'idx_attendance_personnel_date': "CREATE INDEX IF NOT EXISTS idx_attendance_personnel_date ON attendance (personnel_id, date DESC, id DESC)",
+            'idx_loans_personnel_active': "CREATE INDEX IF NOT EXISTS idx_loans_personnel_active ON loans (personnel_id, is_active, created_at DESC, id DESC)",
+            'idx_advances_personnel_settled': "CREATE INDEX IF NOT EXISTS idx_advances_personnel_settled ON advances (personnel_id, is_settled, created_at DESC, id DESC)",
+            # Month-end lookup of the installments due in a period
+            'idx_loan_installments_due': "CREATE INDEX IF NOT EXISTS idx_loan_installments_due ON loan_installments (due_year, due_month, personnel_id) WHERE status = 'due'",
+            # Ledger history of one loan/advance and one employee's statement
+            'idx_balance_ledger_source': "CREATE INDEX IF NOT EXISTS idx_balance_ledger_source ON balance_ledger (account, source_id)",
+            'idx_balance_ledger_personnel': "CREATE INDEX IF NOT EXISTS idx_balance_ledger_personnel ON balance_ledger (personnel_id, id)",
+            # Days of a Jalali month
+            'idx_jalali_calendar_period': "CREATE INDEX IF NOT EXISTS idx_jalali_calendar_period ON jalali_calendar (jalali_year, jalali_month, jalali_day)"
+        }
+        
+        for index_name, index_query in indexes.items():
+            if not self.execute_query(index_query):
+                logger.error(f"Failed to create index: {index_name}")
+                return False
+        
+        if not self.execute_query(self.payroll_summary_trigger_sql()):
+            logger.error("Failed to create payroll summary triggers")
+            return False
+        
+        # Edits to the inputs of an employee's payroll mark them for recalculation
+        dirty_sources = {
+            'attendance': 'personnel_id',
+            'loans': 'personnel_id',
+            'advances': 'personnel_id',
+            'personnel': 'id'
+        }
+        for table_name, key_column in dirty_sources.items():
+            if not self.execute_query(self.payroll_dirty_trigger_sql(table_name, key_column)):
+                logger.error(f"Failed to create payroll change tracking for: {table_name}")
+                return False
+        
+        # Changed rows are logged for differential backups
+        for table_name, key_columns in CHANGE_TRACKED_TABLES.items():
+            if not self.execute_query(self.backup_change_trigger_sql(table_name, key_columns)):
+                logger.error(f"Failed to create backup change tracking for: {table_name}")
+                return False
+        
+        if not self.rebuild_payroll_month_summary():
+            return False
+        
+        if not self.backfill_loan_installments():
+            return False
+        
+        # Loans and advances post their disbursements and changes to balance_ledger
+        if not self.execute_query(self.employee_balances_trigger_sql()):
+            logger.error("Failed to create employee balance triggers")
+            return False
+        for table_name, source in BALANCE_SOURCES.items():
+            if not self.execute_query(self.balance_ledger_trigger_sql(table_name, *source)):
+                logger.error(f"Failed to create balance ledger triggers for: {table_name}")
+                return False
+        
+        if not self.backfill_balance_ledger() or not self.rebuild_employee_balances():
+            return False
+        
+        if not self.seed_jalali_calendar():
+            return False
+        
         logger.info("All tables created successfully")
+        return True
+    
+    def payroll_summary_upsert_sql(self, source: str, sign: str = '') -> str:
+        """SQL adding the aggregates of source rows to payroll_month_summary"""
+        columns = ', '.join(PAYROLL_SUMMARY_COLUMNS)
+        aggregates = ', '.join(f"{sign}{expression}" for expression in PAYROLL_SUMMARY_COLUMNS.values())
+        updates = ', '.join(f"{column} = s.{column} + EXCLUDED.{column}" for column in PAYROLL_SUMMARY_COLUMNS)
+        return f"""
+            INSERT INTO payroll_month_summary AS s (year, month, {columns})
+            SELECT year, month, {aggregates}
+            FROM {source}
+            GROUP BY year, month
+            ON CONFLICT (year, month) DO UPDATE SET {updates};
+        """
+    
+    def payroll_summary_trigger_sql(self) -> str:
+        """SQL of the statement-level triggers that keep payroll_month_summary current
+        
+        Each statement applies the aggregated delta of its transition tables
+        (old rows subtracted, new rows added), so a bulk payroll calculation
+        touches every affected summary row once rather than once per employee.
+        """
+        return f"""
+            CREATE OR REPLACE FUNCTION payroll_month_summary_apply() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    {self.payroll_summary_upsert_sql('old_rows', '-')}
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    {self.payroll_summary_upsert_sql('new_rows')}
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS payroll_month_summary_insert ON payroll;
+            CREATE TRIGGER payroll_month_summary_insert AFTER INSERT ON payroll
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_month_summary_apply();
+            
+            DROP TRIGGER IF EXISTS payroll_month_summary_update ON payroll;
+            CREATE TRIGGER payroll_month_summary_update AFTER UPDATE ON payroll
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_month_summary_apply();
+            
+            DROP TRIGGER IF EXISTS payroll_month_summary_delete ON payroll;
+            CREATE TRIGGER payroll_month_summary_delete AFTER DELETE ON payroll
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_month_summary_apply();
+        """
+    
+    def payroll_dirty_trigger_sql(self, table: str, key_column: str) -> str:
+        """SQL of the statement-level triggers that record changed employees of a table"""
+        mark = """
+            INSERT INTO payroll_dirty (personnel_id, changed_at, source)
+            SELECT DISTINCT {key_column}, CURRENT_TIMESTAMP, TG_TABLE_NAME FROM {rows}
+            WHERE {key_column} IS NOT NULL
+            ON CONFLICT (personnel_id) DO UPDATE
+            SET changed_at = EXCLUDED.changed_at, source = EXCLUDED.source;
+        """
+        return f"""
+            CREATE OR REPLACE FUNCTION payroll_mark_dirty_{table}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    {mark.format(key_column=key_column, rows='old_rows')}
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    {mark.format(key_column=key_column, rows='new_rows')}
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS payroll_dirty_insert ON {table};
+            CREATE TRIGGER payroll_dirty_insert AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_mark_dirty_{table}();
+            
+            DROP TRIGGER IF EXISTS payroll_dirty_update ON {table};
+            CREATE TRIGGER payroll_dirty_update AFTER UPDATE ON {table}
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_mark_dirty_{table}();
+            
+            DROP TRIGGER IF EXISTS payroll_dirty_delete ON {table};
+            CREATE TRIGGER payroll_dirty_delete AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION payroll_mark_dirty_{table}();
+        """
+    
+    def backup_change_trigger_sql(self, table: str, key_columns: Tuple[str, ...]) -> str:
+        """SQL of the statement-level triggers that log the keys of a table's changed rows
+        
+        Each row is logged with the id of the transaction that changed it,
+        so a differential backup can take exactly the changes its base
+        backup's snapshot did not see.
+        """
+        row_key = "jsonb_build_object(" + ", ".join(f"'{column}', {column}" for column in key_columns) + ")"
+        old_row_key = "jsonb_build_object(" + ", ".join(f"'{column}', o.{column}" for column in key_columns) + ")"
+        same_key = " AND ".join(f"n.{column} = o.{column}" for column in key_columns)
+        return f"""
+            CREATE OR REPLACE FUNCTION backup_log_changes_{table}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO backup_changes (table_name, row_key)
+                    SELECT TG_TABLE_NAME, {row_key} FROM new_rows;
+                END IF;
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO backup_changes (table_name, row_key)
+                    SELECT TG_TABLE_NAME, {row_key} FROM old_rows;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    -- Rows whose key itself changed also drop their old key
+                    INSERT INTO backup_changes (table_name, row_key)
+                    SELECT TG_TABLE_NAME, {old_row_key} FROM old_rows o
+                    WHERE NOT EXISTS (SELECT 1 FROM new_rows n WHERE {same_key});
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS backup_changes_insert ON {table};
+            CREATE TRIGGER backup_changes_insert AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION backup_log_changes_{table}();
+            
+            DROP TRIGGER IF EXISTS backup_changes_update ON {table};
+            CREATE TRIGGER backup_changes_update AFTER UPDATE ON {table}
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION backup_log_changes_{table}();
+            
+            DROP TRIGGER IF EXISTS backup_changes_delete ON {table};
+            CREATE TRIGGER backup_changes_delete AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION backup_log_changes_{table}();
+        """
+    
+    def employee_balances_upsert_sql(self, source: str) -> str:
+        """SQL adding the ledger amounts of source rows to employee_balances"""
+        return f"""
+            INSERT INTO employee_balances AS b (personnel_id, loan_balance, advance_balance, updated_at)
+            SELECT personnel_id,
+                   COALESCE(SUM(amount) FILTER (WHERE account = 'loan'), 0),
+                   COALESCE(SUM(amount) FILTER (WHERE account = 'advance'), 0),
+                   CURRENT_TIMESTAMP
+            FROM {source}
+            GROUP BY personnel_id
+            ON CONFLICT (personnel_id) DO UPDATE SET
+                loan_balance = b.loan_balance + EXCLUDED.loan_balance,
+                advance_balance = b.advance_balance + EXCLUDED.advance_balance,
+                updated_at = EXCLUDED.updated_at;
+        """
+    
+    def employee_balances_trigger_sql(self) -> str:
+        """SQL keeping balance_ledger append-only and employee_balances current
+        
+        New ledger rows are applied per statement from the transition table,
+        so the balance of an employee is always one row away.
+        """
+        return f"""
+            CREATE OR REPLACE FUNCTION employee_balances_apply() RETURNS trigger AS $$
+            BEGIN
+                {self.employee_balances_upsert_sql('new_rows')}
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS employee_balances_insert ON balance_ledger;
+            CREATE TRIGGER employee_balances_insert AFTER INSERT ON balance_ledger
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION employee_balances_apply();
+            
+            CREATE OR REPLACE FUNCTION balance_ledger_append_only() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'balance_ledger is append-only; post a correcting entry instead';
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS balance_ledger_append_only ON balance_ledger;
+            CREATE TRIGGER balance_ledger_append_only BEFORE UPDATE OR DELETE ON balance_ledger
+                FOR EACH STATEMENT EXECUTE FUNCTION balance_ledger_append_only();
+        """
+    
+    def balance_ledger_trigger_sql(self, table: str, account: str, amount_column: str,
+                                   status_column: str, open_value: str) -> str:
+        """SQL of the row triggers posting a loan/advance table's changes to balance_ledger
+        
+        The outstanding amount of an open row is its amount less the
+        deductions already posted, and zero once it is closed or deleted. A
+        change that moves the outstanding amount posts the difference:
+        a disbursement for new rows, an adjustment otherwise. Payroll
+        deductions are posted before rows are closed, so closing a fully
+        repaid row posts nothing.
+        """
+        return f"""
+            CREATE OR REPLACE FUNCTION balance_ledger_sync_{table}() RETURNS trigger AS $$
+            DECLARE
+                source RECORD;
+                posted DECIMAL(15,2);
+                deducted DECIMAL(15,2);
+                target DECIMAL(15,2) := 0;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    source := OLD;
+                ELSE
+                    source := NEW;
+                END IF;
+                
+                SELECT COALESCE(SUM(amount), 0), COALESCE(-SUM(amount) FILTER (WHERE entry_type = 'deduction'), 0)
+                INTO posted, deducted
+                FROM balance_ledger WHERE account = '{account}' AND source_id = source.id;
+                
+                -- Moving a row to another employee moves its balance with it
+                IF TG_OP = 'UPDATE' AND OLD.personnel_id IS DISTINCT FROM NEW.personnel_id AND posted <> 0 THEN
+                    INSERT INTO balance_ledger (personnel_id, account, source_id, entry_type, amount)
+                    VALUES (OLD.personnel_id, '{account}', OLD.id, 'adjustment', -posted);
+                    posted := 0;
+                END IF;
+                
+                IF TG_OP <> 'DELETE' AND NEW.{status_column} = {open_value} THEN
+                    target := NEW.{amount_column} - deducted;
+                END IF;
+                
+                IF target <> posted AND source.personnel_id IS NOT NULL THEN
+                    INSERT INTO balance_ledger (personnel_id, account, source_id, entry_type, amount)
+                    VALUES (source.personnel_id, '{account}', source.id,
+                            CASE WHEN TG_OP = 'INSERT' THEN 'disbursement' ELSE 'adjustment' END,
+                            target - posted);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS balance_ledger_sync ON {table};
+            CREATE TRIGGER balance_ledger_sync
+                AFTER INSERT OR DELETE OR UPDATE OF personnel_id, {amount_column}, {status_column} ON {table}
+                FOR EACH ROW EXECUTE FUNCTION balance_ledger_sync_{table}();
+        """
+    
+    def backfill_balance_ledger(self) -> bool:
+        """Opening ledger entries of loans and advances recorded before the ledger existed"""
+        query = """
+            INSERT INTO balance_ledger (personnel_id, account, source_id, entry_type, amount, created_at)
+            SELECT personnel_id, 'loan', id, 'disbursement', loan_amount, COALESCE(created_at, start_date)
+            FROM loans l
+            WHERE personnel_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM balance_ledger b WHERE b.account = 'loan' AND b.source_id = l.id)
+            UNION ALL
+            -- Everything not outstanding any more counts as deducted
+            SELECT personnel_id, 'loan', id, 'deduction',
+                   CASE WHEN is_active THEN COALESCE(
+                       (SELECT SUM(amount) FROM loan_installments li WHERE li.loan_id = l.id AND li.status = 'due'),
+                       installment_amount * remaining_installments) ELSE 0 END - loan_amount,
+                   CURRENT_TIMESTAMP
+            FROM loans l
+            WHERE personnel_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM balance_ledger b WHERE b.account = 'loan' AND b.source_id = l.id)
+            UNION ALL
+            SELECT personnel_id, 'advance', id, 'disbursement', advance_amount, COALESCE(created_at, advance_date)
+            FROM advances a
+            WHERE personnel_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM balance_ledger b WHERE b.account = 'advance' AND b.source_id = a.id)
+            UNION ALL
+            SELECT personnel_id, 'advance', id, 'deduction', -advance_amount, CURRENT_TIMESTAMP
+            FROM advances a
+            WHERE personnel_id IS NOT NULL AND is_settled = TRUE
+              AND NOT EXISTS (SELECT 1 FROM balance_ledger b WHERE b.account = 'advance' AND b.source_id = a.id)
+        """
+        if not self.execute_query(query):
+            logger.error("Failed to open balance ledger of existing loans and advances")
+            return False
+        return True
+    
+    def rebuild_employee_balances(self) -> bool:
+        """Recompute employee_balances from balance_ledger"""
+        query = "DELETE FROM employee_balances;" + self.employee_balances_upsert_sql('balance_ledger')
+        if not self.execute_query(query):
+            logger.error("Failed to rebuild employee balances")
+            return False
+        return True
+    
+    def loan_schedule_insert_sql(self, source: str, first_period: str, first_number: str = '1') -> str:
+        """SQL inserting the installment schedule of the loans selected by source
+        
+        Installment n of a loan is due in period ``first_period + n - 1``,
+        where a period is the Jalali ``year * 12 + month - 1``. Every
+        installment is the loan's installment_amount except the last, which
+        takes the remainder.
+        """
+        return f"""
+            INSERT INTO loan_installments
+            (loan_id, personnel_id, installment_number, due_year, due_month, amount)
+            SELECT l.id, l.personnel_id, n.number,
+                   ({first_period} + n.number - 1) / 12,
+                   MOD({first_period} + n.number - 1, 12) + 1,
+                   CASE WHEN n.number = l.total_installments
+                        THEN GREATEST(l.loan_amount - l.installment_amount * (l.total_installments - 1), 0)
+                        ELSE l.installment_amount END
+            FROM {source} l
+            CROSS JOIN LATERAL generate_series({first_number}, l.total_installments) AS n(number)
+        """
+    
+    def backfill_loan_installments(self) -> bool:
+        """Schedule the remaining installments of active loans created before schedules existed
+        
+        The next installment of such a loan falls due in the current month.
+        """
+        today = DateConverter.get_current_jalali_date()
+        source = """(
+            SELECT * FROM loans
+            WHERE is_active = TRUE AND remaining_installments > 0
+              AND NOT EXISTS (SELECT 1 FROM loan_installments li WHERE li.loan_id = loans.id)
+        )"""
+        query = self.loan_schedule_insert_sql(
+            source,
+            "%s - (l.total_installments - l.remaining_installments)",
+            "l.total_installments - l.remaining_installments + 1"
+        )
+        current_period = today.year * 12 + today.month - 1
+        if not self.execute_query(query, (current_period, current_period)):
+            logger.error("Failed to schedule installments of existing loans")
+            return False
+        return True
+    
+    def seed_jalali_calendar(self) -> bool:
+        """Load the default work calendar of the previous, current and next Jalali year
+        
+        Years already in jalali_calendar (perhaps with configured holidays)
+        are left alone.
+        """
+        current_year = DateConverter.get_current_jalali_date().year
+        years = [current_year - 1, current_year, current_year + 1]
+        rows = self.fetch_all(
+            "SELECT DISTINCT jalali_year FROM jalali_calendar WHERE jalali_year = ANY(%s)", (years,)
+        )
+        loaded = {row['jalali_year'] for row in rows}
+        missing = [year for year in years if year not in loaded]
+        return not missing or load_calendar(self, JalaliCalendar(), missing)
+    
+    def rebuild_payroll_month_summary(self) -> bool:
+        """Recompute payroll_month_summary from the payroll table"""
+        query = "DELETE FROM payroll_month_summary;" + self.payroll_summary_upsert_sql('payroll')
+        if not self.execute_query(query):
+            logger.error("Failed to rebuild payroll month summary")
+            return False
         return True
\ No newline at end of file
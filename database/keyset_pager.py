@@ -0,0 +1,81 @@
+import logging
+from typing import List, Dict, Any, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+class KeysetPager:
+    """Fetch a list query page by page using keyset (seek) pagination
+
+    Instead of OFFSET, each page continues from the sort key of the last row
+    already fetched, e.g. ``WHERE (a.date, a.id) < (%s, %s) LIMIT n``, so the
+    cost of a page does not grow with how far the user has scrolled.
+    Rows are returned newest first (descending key order).
+
+    ``select`` is the query without WHERE/ORDER BY/LIMIT. ``key_columns`` are
+    the SQL expressions of the sort key and ``key_fields`` the matching names
+    in the result rows; the last key column must be unique (usually the id).
+    """
+
+    def __init__(self, db, select: str, key_columns: Sequence[str], key_fields: Sequence[str],
+                 conditions: Optional[List[str]] = None, params: tuple = (), page_size: int = 200):
+        self.db = db
+        self.select = select
+        self.key_columns = list(key_columns)
+        self.key_fields = list(key_fields)
+        self.conditions = list(conditions or [])
+        self.params = tuple(params)
+        self.page_size = page_size
+        self.last_key = None
+        self.has_more = True
+
+    def build_query(self, after_key: Optional[tuple] = None) -> tuple:
+        """Build the SQL and parameters for the page following ``after_key``"""
+        conditions = list(self.conditions)
+        params = list(self.params)
+
+        if after_key is not None:
+            columns = ', '.join(self.key_columns)
+            placeholders = ', '.join(['%s'] * len(self.key_columns))
+            conditions.append(f"({columns}) < ({placeholders})")
+            params.extend(after_key)
+
+        query = self.select
+        if conditions:
+            query += "\nWHERE " + " AND ".join(conditions)
+        query += "\nORDER BY " + ", ".join(f"{column} DESC" for column in self.key_columns)
+        query += "\nLIMIT %s"
+        params.append(self.page_size)
+
+        return query, tuple(params)
+
+    def fetch_next(self) -> List[Dict[str, Any]]:
+        """Fetch the next page of rows"""
+        if not self.has_more:
+            return []
+
+        rows = self.fetch_page(self.last_key)
+
+        if len(rows) < self.page_size:
+            self.has_more = False
+        if rows:
+            last = rows[-1]
+            self.last_key = tuple(last[field] for field in self.key_fields)
+
+        return rows
+
+    def fetch_page(self, after_key: Optional[tuple]) -> List[Dict[str, Any]]:
+        """Fetch the page following ``after_key`` (None for the first page)
+
+        Does not move the pager, so a page that was dropped from memory can
+        be read again from the key it started after.
+        """
+        query, params = self.build_query(after_key)
+        rows = self.db.fetch_all(query, params)
+
+        # Demo mode ignores LIMIT; never hand out more than a page
+        return rows[:self.page_size]
+
+    def reset(self):
+        """Start again from the first page"""
+        self.last_key = None
+        self.has_more = True
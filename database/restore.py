@@ -0,0 +1,371 @@
+"""Validation and restore of database backups
+
+A backup is only restored after its checksum matches its manifest and its
+table of contents could be read in full: ``pg_restore --list`` for a
+custom-format archive, one streaming pass over the sections of a COPY
+backup. Custom-format archives are restored by pg_restore with parallel
+jobs, so tables load and indexes build concurrently; COPY backups are
+streamed table by table into one transaction. A differential backup is
+restored as a chain: its full base first, then its changes in one more
+transaction. Either way create_tables runs afterwards, which brings an
+older backup's schema up to date and rebuilds the derived tables
+(payroll_month_summary, employee_balances).
+"""
+import gzip
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from database.backup import (BACKUP_TABLES, COPY_END_OF_DATA, COPY_FORMAT_HEADER, RESTORE_MARKER,
+                             BackupError, file_sha256, read_manifest)
+from database.database_manager import CHANGE_TRACKED_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Tables without which a backup is not a payroll database
+REQUIRED_TABLES = ('personnel',)
+
+_TOC_TABLE_DATA = re.compile(r'\bTABLE DATA \S+ (\S+)')
+_VERBOSE_TABLE_DATA = re.compile(r'processing data for table "(?:[^"]+\.)?([^"]+)"')
+_VERBOSE_INDEX = re.compile(r'creating (?:INDEX|CONSTRAINT) "(?:[^"]+\.)?([^"]+)"')
+_COPY_SECTION_HEADER = re.compile(r'^-- (table|keys) (\w+) \(([^)]*)\)\n$')
+
+# How long a restore waits for a table lock before failing; other sessions
+# reading the tables (an open window, a report) would block it otherwise
+RESTORE_LOCK_TIMEOUT = '10s'
+# SQLSTATE lock_not_available, raised when lock_timeout expires
+LOCK_NOT_AVAILABLE = '55P03'
+
+# Called with the table (or index) being restored, steps done and total steps
+RestoreProgressCallback = Callable[[str, int, int], None]
+
+
+def default_jobs() -> int:
+    """Parallel pg_restore jobs: one per core, at most four"""
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def copy_backup_sections(path: str):
+    """(section, table, columns, line iterator) of each section of a COPY backup, streamed"""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='\n') as file:
+        if file.readline() != COPY_FORMAT_HEADER:
+            raise BackupError(f"{os.path.basename(path)} is not a COPY backup")
+        for header in file:
+            match = _COPY_SECTION_HEADER.match(header)
+            if not match:
+                raise BackupError(f"Unexpected line in {os.path.basename(path)}: {header[:80]!r}")
+            columns = [column.strip() for column in match.group(3).split(',') if column.strip()]
+
+            def lines(file=file):
+                for line in file:
+                    if line == COPY_END_OF_DATA:
+                        return
+                    yield line
+                raise BackupError(f"{os.path.basename(path)} ends inside a table")
+
+            section = lines()
+            yield match.group(1), match.group(2), columns, section
+            # Skip whatever the caller did not consume
+            for _ in section:
+                pass
+
+
+def validate_backup(path: str) -> Dict[str, Any]:
+    """Check a backup's checksum and read its table of contents
+
+    Returns the manifest with a ``toc`` list of the tables holding data
+    (and, for a differential, the validated manifest of its base as
+    ``base_manifest``); raises BackupError when the backup cannot be
+    restored.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise BackupError(f"{os.path.basename(path)} has no manifest")
+    if file_sha256(path) != manifest.get('sha256'):
+        raise BackupError(f"Checksum of {os.path.basename(path)} does not match its manifest")
+
+    if manifest.get('format') == 'custom':
+        if not shutil.which('pg_restore'):
+            raise BackupError("pg_restore is needed to restore custom-format backups")
+        result = subprocess.run(['pg_restore', '--list', path], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise BackupError(f"pg_restore cannot read {os.path.basename(path)}: {result.stderr.strip()}")
+        toc = _TOC_TABLE_DATA.findall(result.stdout)
+    elif manifest.get('format') == 'copy':
+        # Reading every section to the end also checks the gzip CRC
+        toc = []
+        for section, table, _, lines in copy_backup_sections(path):
+            if section == 'table':
+                toc.append(table)
+            for _ in lines:
+                pass
+    else:
+        raise BackupError(f"Unknown backup format: {manifest.get('format')}")
+
+    if manifest.get('kind') == 'differential':
+        base_path = os.path.join(os.path.dirname(path), manifest.get('base', ''))
+        if not os.path.exists(base_path):
+            raise BackupError(f"The full backup {manifest.get('base')} of {os.path.basename(path)} is missing")
+        base_manifest = validate_backup(base_path)
+        if base_manifest.get('sha256') != manifest.get('base_sha256'):
+            raise BackupError(f"{manifest.get('base')} is not the backup {os.path.basename(path)} was based on")
+        manifest['base_manifest'] = base_manifest
+        manifest['toc'] = toc
+        return manifest
+
+    missing = [table for table in REQUIRED_TABLES if table not in toc]
+    if missing:
+        raise BackupError(f"{os.path.basename(path)} has no data for {', '.join(missing)}")
+    manifest['toc'] = toc
+    return manifest
+
+
+class _LineReader:
+    """File-like view of a line iterator for COPY FROM STDIN"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line.encode('utf-8')
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class DatabaseRestore:
+    """Restores one validated backup into a database"""
+
+    def __init__(self, db, path: str, progress: Optional[RestoreProgressCallback] = None,
+                 jobs: Optional[int] = None):
+        self.db = db
+        self.path = path
+        self.progress = progress
+        self.jobs = jobs or default_jobs()
+
+    def run(self) -> Dict[str, Any]:
+        """Validate, restore and rebuild; returns the manifest with the restore duration"""
+        if self.db.connection is None:
+            raise BackupError("A database connection is needed to restore a backup")
+
+        start = time.perf_counter()
+        manifest = validate_backup(self.path)
+        self._take_locks()
+        base = manifest.get('base_manifest', manifest)
+        base_path = os.path.join(os.path.dirname(self.path), base['file'])
+        if base['format'] == 'custom':
+            self._restore_custom(base_path, base['toc'])
+        else:
+            self._restore_copy(base_path, base['toc'])
+        if base is not manifest:
+            self._apply_differential(manifest['toc'])
+
+        self._report("payroll_month_summary", len(manifest['toc']), len(manifest['toc']))
+        if not self.db.create_tables():
+            raise BackupError("Restored data, but rebuilding the derived tables failed "
+                              "(another connection may be holding locks on them)")
+        # Changes logged before the restore no longer describe the data
+        if not self.db.execute_query(
+            "INSERT INTO backup_changes (table_name, row_key) VALUES (%s, '{}')", (RESTORE_MARKER,)
+        ):
+            raise BackupError("Restored data, but could not reset differential backups")
+
+        manifest['restore_duration'] = time.perf_counter() - start
+        logger.info(f"Restored {os.path.basename(self.path)} in {manifest['restore_duration']:.1f}s")
+        return manifest
+
+    def _take_locks(self):
+        """Set the lock timeout and check that no other session holds the tables
+
+        Every table is locked once and released again, so a restore that
+        would wait on another connection fails before changing anything and
+        names the sessions in the way.
+        """
+        connection = self.db.connection
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET lock_timeout = '{RESTORE_LOCK_TIMEOUT}'")
+            connection.commit()
+            cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename = ANY(%s)",
+                           (BACKUP_TABLES,))
+            tables = [row[0] for row in cursor.fetchall()]
+            try:
+                if tables:
+                    cursor.execute(f"LOCK TABLE {', '.join(tables)} IN ACCESS EXCLUSIVE MODE")
+                connection.rollback()
+            except Exception as e:
+                connection.rollback()
+                if getattr(e, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+                    raise
+                cursor.execute("""
+                    SELECT pid, COALESCE(NULLIF(application_name, ''), 'unknown'), state
+                    FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                      AND state IS DISTINCT FROM 'idle'
+                """)
+                sessions = ", ".join(f"{pid} ({name}, {state})" for pid, name, state in cursor.fetchall())
+                connection.rollback()
+                raise BackupError(f"Other connections are using the database tables: {sessions or 'unknown'}. "
+                                  f"Close them and restore again") from e
+
+    def _report(self, name: str, done: int, total: int):
+        if self.progress:
+            self.progress(name, done, total)
+
+    def _restore_custom(self, path: str, toc: List[str]):
+        """pg_restore with parallel jobs, following its verbose output for progress"""
+        params = self.db.connection_params()
+        command = ['pg_restore', '--clean', '--if-exists', '--no-owner', '--verbose',
+                   '--jobs', str(self.jobs),
+                   '--host', str(params['host']), '--port', str(params['port']),
+                   '--username', params['user'], '--dbname', params['database'], path]
+        env = dict(os.environ, PGPASSWORD=str(params['password']),
+                   PGOPTIONS=f"-c lock_timeout={RESTORE_LOCK_TIMEOUT}")
+
+        # Nothing of ours may hold locks on the tables pg_restore drops
+        self.db.connection.rollback()
+        done = 0
+        tail: List[str] = []
+        with tempfile.TemporaryFile() as output:
+            process = subprocess.Popen(command, stdout=output, stderr=subprocess.PIPE, env=env,
+                                       text=True, encoding='utf-8', errors='replace')
+            for line in process.stderr:
+                tail = (tail + [line.rstrip()])[-20:]
+                table = _VERBOSE_TABLE_DATA.search(line)
+                if table:
+                    done += 1
+                    self._report(table.group(1), done, len(toc))
+                    continue
+                index = _VERBOSE_INDEX.search(line)
+                if index:
+                    self._report(index.group(1), done, len(toc))
+            returncode = process.wait()
+        if returncode != 0:
+            raise BackupError(f"pg_restore failed ({returncode}): " + "\n".join(tail))
+
+    def _restore_copy(self, path: str, toc: List[str]):
+        """Replace every table with the backup's rows in one transaction"""
+        # The schema of the running version, which the backup's columns must fit
+        if not self.db.create_tables():
+            raise BackupError("Could not create the database tables "
+                              "(another connection may be holding locks on them)")
+
+        connection = self.db.connection
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+                existing = {row[0] for row in cursor.fetchall()}
+                tables = [table for table in BACKUP_TABLES if table in existing]
+                unknown = [table for table in toc if table not in existing]
+                if unknown:
+                    raise BackupError(f"The database has no tables {', '.join(unknown)}")
+
+                # Ledger and summary triggers must not fire for restored rows;
+                # FK constraint triggers stay on and the sections are in FK order
+                for table in tables:
+                    cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+                cursor.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE")
+
+                for done, (_, table, columns, lines) in enumerate(copy_backup_sections(path), 1):
+                    self._report(table, done - 1, len(toc))
+                    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", _LineReader(lines))
+                    if 'id' in columns:
+                        self._reset_sequence(cursor, table)
+                    self._report(table, done, len(toc))
+
+                for table in tables:
+                    cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+
+    @staticmethod
+    def _reset_sequence(cursor, table: str):
+        """Move a table's id sequence past the restored ids"""
+        cursor.execute(f"""
+            SELECT setval(s.sequence, COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)
+            FROM (SELECT pg_get_serial_sequence('{table}', 'id') AS sequence) s
+            WHERE s.sequence IS NOT NULL
+        """)
+
+    def _apply_differential(self, toc: List[str]):
+        """Apply the changes of a differential backup on top of its restored base
+
+        All sections are staged in temporary tables first. Rows whose key
+        is logged but which no longer exist are deleted children first;
+        the changed rows are then upserted parents first.
+        """
+        connection = self.db.connection
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+                existing = {row[0] for row in cursor.fetchall()}
+                tables = [table for table in BACKUP_TABLES if table in CHANGE_TRACKED_TABLES and table in existing]
+                for table in tables:
+                    cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+                row_columns: Dict[str, List[str]] = {}
+                for section, table, columns, lines in copy_backup_sections(self.path):
+                    if table not in tables:
+                        raise BackupError(f"The database has no table {table}")
+                    stage = f"restore_{section}_{table}"
+                    if section == 'keys':
+                        cursor.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+                                       f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA")
+                    else:
+                        cursor.execute(f"CREATE TEMP TABLE {stage} (LIKE {table}) ON COMMIT DROP")
+                        row_columns[table] = columns
+                    cursor.copy_expert(f"COPY {stage} ({', '.join(columns)}) FROM STDIN", _LineReader(lines))
+
+                changed = [table for table in tables if table in row_columns]
+                for done, table in enumerate(reversed(changed), 1):
+                    self._report(table, done, 2 * len(changed))
+                    key_columns = CHANGE_TRACKED_TABLES[table]
+                    cursor.execute(f"""
+                        DELETE FROM {table} t USING restore_keys_{table} k
+                        WHERE {' AND '.join(f't.{column} = k.{column}' for column in key_columns)}
+                          AND NOT EXISTS (
+                              SELECT 1 FROM restore_table_{table} r
+                              WHERE {' AND '.join(f'r.{column} = k.{column}' for column in key_columns)}
+                          )
+                    """)
+                for done, table in enumerate(changed, len(changed) + 1):
+                    self._report(table, done, 2 * len(changed))
+                    key_columns = CHANGE_TRACKED_TABLES[table]
+                    columns = row_columns[table]
+                    updates = [f"{column} = EXCLUDED.{column}" for column in columns if column not in key_columns]
+                    conflict = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+                    cursor.execute(f"""
+                        INSERT INTO {table} ({', '.join(columns)})
+                        SELECT {', '.join(columns)} FROM restore_table_{table}
+                        ON CONFLICT ({', '.join(key_columns)}) {conflict}
+                    """)
+                    if 'id' in columns:
+                        self._reset_sequence(cursor, table)
+
+                for table in tables:
+                    cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def restore_backup(db, path: str, progress: Optional[RestoreProgressCallback] = None,
+                   jobs: Optional[int] = None) -> Dict[str, Any]:
+    """Restore a backup into a connected database; raises BackupError on failure"""
+    return DatabaseRestore(db, path, progress, jobs).run()
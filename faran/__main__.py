@@ -0,0 +1,218 @@
+"""Command line entry point for headless payroll jobs
+
+    python -m faran calc --year 1403 --month 7 [--full] [--shards N] [--workers N]
+    python -m faran report financial --year 1403 [--output report.txt]
+    python -m faran report balances [--output balances.txt]
+    python -m faran export attendance --year 1403 --month 7 --output attendance.csv
+    python -m faran diff --year 1403 --month 7 [--snapshot]
+    python -m faran calendar --years 1403 1404
+    python -m faran archive --year 1400 [--format parquet|arrow] [--detach]
+
+Nothing here imports PyQt6, so jobs can be scheduled on a server without a
+display. Run from the application directory (config/settings.json).
+"""
+import argparse
+import json
+import logging
+import sys
+from typing import Any, Dict, List, Optional
+
+from database.archive import ARCHIVE_FORMATS, DEFAULT_ARCHIVE_FORMAT, ArchiveError, YearArchive, archive_year
+from database.database_manager import DatabaseManager
+from payroll.balances import format_balances_report, outstanding_balances
+from payroll.batch import PayrollBatchCoordinator, load_companies, write_report
+from payroll.diff import diff_months, diff_runs, format_payroll_diff, load_snapshot_run, load_stored_run
+from payroll.reports import (attendance_report_rows, export_attendance_csv,
+                             financial_report_rows, format_financial_report)
+from payroll.service import PayrollService
+from utils.jalali_calendar import JalaliCalendar, load_calendar
+
+logger = logging.getLogger('faran')
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    """Load the application settings file"""
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def select_companies(config: Dict[str, Any], name: Optional[str]) -> List[Dict[str, Any]]:
+    """Companies from the config, optionally narrowed to one by name"""
+    companies = load_companies(config)
+    if name is None:
+        return companies
+    selected = [company for company in companies if company['name'] == name]
+    if not selected:
+        raise SystemExit(f"Unknown company: {name}")
+    return selected
+
+
+def connect(config: Dict[str, Any], company_name: Optional[str]) -> DatabaseManager:
+    """Connect to a company's database, refusing to fall back to demo data"""
+    company = select_companies(config, company_name)[0]
+    db = DatabaseManager(company['database'])
+    if not db.connect() or db.connection is None:
+        raise SystemExit(f"Could not connect to the database of {company['name']}")
+    return db
+
+
+def run_calc(args, config: Dict[str, Any]) -> int:
+    coordinator = PayrollBatchCoordinator(select_companies(config, args.company),
+                                          config.get('calculation', {}),
+                                          args.workers, args.shards)
+    report = coordinator.run(args.year, args.month, args.full)
+    path = write_report(report, config.get('report', {}).get('save_path', './reports'))
+
+    logger.info(f"Calculated {report['calculated']}, skipped {report['skipped']}, "
+                f"failed {report['failed']}, errors {report['errors']} in {report['duration']:.1f}s")
+    logger.info(f"Run report written to {path}")
+    return 1 if report['failed'] or report['errors'] else 0
+
+
+def run_report(args, config: Dict[str, Any]) -> int:
+    if args.kind == 'financial' and args.year is None:
+        raise SystemExit("The financial report needs --year")
+
+    db = connect(config, args.company)
+    try:
+        if args.kind == 'balances':
+            text = format_balances_report(outstanding_balances(db))
+        else:
+            text = format_financial_report(args.year, financial_report_rows(db, args.year,
+                                                                            YearArchive.from_settings(config)))
+    except ArchiveError as e:
+        logger.error(f"Could not read the archive of {args.year}: {e}")
+        return 1
+    finally:
+        db.disconnect()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+        logger.info(f"Report written to {args.output}")
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+def run_export(args, config: Dict[str, Any]) -> int:
+    db = connect(config, args.company)
+    try:
+        rows = attendance_report_rows(db, args.year, args.month, JalaliCalendar.from_settings(config),
+                                      YearArchive.from_settings(config))
+    except ArchiveError as e:
+        logger.error(f"Could not read the archive of {args.year}: {e}")
+        return 1
+    finally:
+        db.disconnect()
+
+    export_attendance_csv(rows, args.output)
+    logger.info(f"Exported attendance of {len(rows)} employees to {args.output}")
+    return 0
+
+
+def run_diff(args, config: Dict[str, Any]) -> int:
+    db = connect(config, args.company)
+    try:
+        if args.snapshot:
+            # What recalculating the month's frozen inputs with today's settings would change
+            service = PayrollService(db, config.get('calculation', {}))
+            diff = diff_runs(load_stored_run(db, args.year, args.month, "stored"),
+                             load_snapshot_run(service, args.year, args.month,
+                                               service.rates_for(args.year), "recalculated"))
+        else:
+            diff = diff_months(db, args.year, args.month)
+    finally:
+        db.disconnect()
+
+    sys.stdout.write(format_payroll_diff(diff))
+    return 0
+
+
+def run_calendar(args, config: Dict[str, Any]) -> int:
+    calendar = JalaliCalendar.from_settings(config)
+    db = connect(config, args.company)
+    try:
+        loaded = load_calendar(db, calendar, args.years)
+    finally:
+        db.disconnect()
+
+    for year in args.years:
+        logger.info(f"{year}: {calendar.working_days(year)} working days")
+    return 0 if loaded else 1
+
+
+def run_archive(args, config: Dict[str, Any]) -> int:
+    archive_dir = YearArchive.from_settings(config).archive_dir
+    db = connect(config, args.company)
+    try:
+        manifest = archive_year(db, args.year, archive_dir, args.format, args.detach)
+    except ArchiveError as e:
+        logger.error(f"Could not archive {args.year}: {e}")
+        return 1
+    finally:
+        db.disconnect()
+
+    for table, entry in manifest['tables'].items():
+        logger.info(f"{table}: {entry['rows']:,} rows, {entry['size']:,} bytes in {entry['file']}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m faran', description="Faran payroll batch jobs")
+    parser.add_argument('--config', default='config/settings.json', help="settings file")
+    parser.add_argument('--company', help="run for this company only (name from settings)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    calc = commands.add_parser('calc', help="calculate a month's payroll")
+    calc.add_argument('--year', type=int, required=True, help="Jalali year")
+    calc.add_argument('--month', type=int, required=True, choices=range(1, 13), metavar='MONTH')
+    calc.add_argument('--full', action='store_true', help="recalculate unchanged employees too")
+    calc.add_argument('--shards', type=int, default=1, help="employee shards per company")
+    calc.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    calc.set_defaults(handler=run_calc)
+
+    report = commands.add_parser('report', help="generate a report")
+    report.add_argument('kind', choices=['financial', 'balances'])
+    report.add_argument('--year', type=int, help="Jalali year (financial report)")
+    report.add_argument('--output', help="write to a file instead of stdout")
+    report.set_defaults(handler=run_report)
+
+    export = commands.add_parser('export', help="export data")
+    export.add_argument('kind', choices=['attendance'])
+    export.add_argument('--year', type=int, required=True, help="Jalali year")
+    export.add_argument('--month', type=int, required=True, choices=range(1, 13), metavar='MONTH')
+    export.add_argument('--output', required=True, help="CSV file to write")
+    export.set_defaults(handler=run_export)
+
+    diff = commands.add_parser('diff', help="compare a month's payroll with the month before")
+    diff.add_argument('--year', type=int, required=True, help="Jalali year")
+    diff.add_argument('--month', type=int, required=True, choices=range(1, 13), metavar='MONTH')
+    diff.add_argument('--snapshot', action='store_true',
+                      help="compare with a recalculation of the month's frozen inputs instead")
+    diff.set_defaults(handler=run_diff)
+
+    calendar = commands.add_parser('calendar', help="load the Jalali work calendar into the database")
+    calendar.add_argument('--years', type=int, nargs='+', required=True, help="Jalali years")
+    calendar.set_defaults(handler=run_calendar)
+
+    archive = commands.add_parser('archive', help="archive a closed year's payroll and attendance to files")
+    archive.add_argument('--year', type=int, required=True, help="Jalali year")
+    archive.add_argument('--format', choices=list(ARCHIVE_FORMATS), default=DEFAULT_ARCHIVE_FORMAT,
+                         help="Parquet, or Arrow IPC for the fastest reads")
+    archive.add_argument('--detach', action='store_true',
+                         help="delete the archived rows from the database afterwards")
+    archive.set_defaults(handler=run_archive)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return args.handler(args, load_config(args.config))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
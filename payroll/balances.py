@@ -0,0 +1,80 @@
+"""Loan and advance balances
+
+Every disbursement, payroll deduction and correction of a loan or advance
+is an append-only row of balance_ledger; database triggers post them and
+keep employee_balances, one row per employee, in step. Outstanding
+balances are read from that row, and a statement is the employee's ledger
+with a running balance.
+"""
+from typing import Any, Dict, List, Optional
+
+# Ledger entry types and accounts as shown to users
+ENTRY_TYPE_LABELS = {
+    'disbursement': "پرداخت",
+    'deduction': "کسر از حقوق",
+    'adjustment': "اصلاح"
+}
+ACCOUNT_LABELS = {
+    'loan': "وام",
+    'advance': "مساعده"
+}
+
+
+def outstanding_balances(db, only_open: bool = True) -> List[Dict[str, Any]]:
+    """Loan and advance balance of every employee"""
+    query = """
+        SELECT b.personnel_id, p.employee_code, p.first_name, p.last_name,
+               b.loan_balance, b.advance_balance, b.updated_at
+        FROM employee_balances b
+        JOIN personnel p ON p.id = b.personnel_id
+    """
+    if only_open:
+        query += " WHERE b.loan_balance <> 0 OR b.advance_balance <> 0"
+    query += " ORDER BY p.employee_code"
+    return db.fetch_all(query)
+
+
+def employee_balance(db, personnel_id: int) -> Dict[str, float]:
+    """Outstanding loan and advance balance of one employee"""
+    row = db.fetch_one(
+        "SELECT loan_balance, advance_balance FROM employee_balances WHERE personnel_id = %s",
+        (personnel_id,)
+    )
+    if not row:
+        return {'loan_balance': 0.0, 'advance_balance': 0.0}
+    return {'loan_balance': float(row['loan_balance'] or 0), 'advance_balance': float(row['advance_balance'] or 0)}
+
+
+def balance_statement(db, personnel_id: int, account: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Ledger entries of an employee, oldest first, with the running balance of their account"""
+    query = """
+        SELECT id, account, source_id, entry_type, amount, year, month, created_at,
+               SUM(amount) OVER (PARTITION BY account ORDER BY id) AS balance
+        FROM balance_ledger
+        WHERE personnel_id = %s
+    """
+    params: tuple = (personnel_id,)
+    if account is not None:
+        query += " AND account = %s"
+        params += (account,)
+    query += " ORDER BY id"
+    return db.fetch_all(query, params)
+
+
+def format_balances_report(rows: List[Dict[str, Any]]) -> str:
+    """Format outstanding balances as text"""
+    text = "مانده وام و مساعده پرسنل\n\n"
+    text += "کد پرسنلی | نام و نام خانوادگی | مانده وام | مانده مساعده\n"
+    text += "-" * 70 + "\n"
+
+    loan_total = 0
+    advance_total = 0
+    for row in rows:
+        text += (f"{row['employee_code']} | {row['first_name']} {row['last_name']} | "
+                 f"{row['loan_balance']:,.0f} | {row['advance_balance']:,.0f}\n")
+        loan_total += row['loan_balance']
+        advance_total += row['advance_balance']
+
+    text += "-" * 70 + "\n"
+    text += f"جمع کل | {len(rows)} نفر | {loan_total:,.0f} | {advance_total:,.0f}\n"
+    return text
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from database.database_manager import DatabaseManager
+from payroll.service import PayrollService
+
+logger = logging.getLogger(__name__)
+
+try:
+    from psycopg2 import pool
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
+# Connection pools of the current worker process, one per company database
+_pools: Dict[str, Any] = {}
+
+
+def load_companies(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Companies to run from settings.json
+
+    A ``companies`` list of ``{"name": ..., "database": {...}}`` entries is
+    used when present; otherwise the single ``database`` block is one company.
+    """
+    companies = config.get('companies')
+    if companies:
+        return companies
+    name = config.get('application', {}).get('company_name', 'default')
+    return [{'name': name, 'database': config.get('database', {})}]
+
+
+def get_pool(company: Dict[str, Any]):
+    """Connection pool of this worker process for a company's database"""
+    company_pool = _pools.get(company['name'])
+    if company_pool is None:
+        params = DatabaseManager(company['database']).connection_params()
+        company_pool = pool.SimpleConnectionPool(1, 2, **params)
+        _pools[company['name']] = company_pool
+    return company_pool
+
+
+def run_shard(company: Dict[str, Any], calculation: Dict[str, Any], year: int, month: int,
+              shard: tuple, full: bool) -> Dict[str, Any]:
+    """Worker entry point: calculate one employee shard of one company"""
+    start = time.perf_counter()
+    result = {
+        'company': company['name'],
+        'shard': shard[0],
+        'total': 0,
+        'calculated': 0,
+        'failed': [],
+        'skipped': 0,
+        'error': None
+    }
+
+    company_pool = None
+    connection = None
+    try:
+        if not PSYCOPG2_AVAILABLE:
+            raise RuntimeError("psycopg2 is required for batch payroll runs")
+
+        company_pool = get_pool(company)
+        connection = company_pool.getconn()
+
+        db = DatabaseManager(company['database'])
+        db.connection = connection
+
+        outcome = PayrollService(db, calculation).calculate_month(year, month, full, shard)
+        result.update({
+            'total': outcome['total'],
+            'calculated': outcome['calculated'],
+            'failed': outcome['failed'],
+            'skipped': len(outcome['skipped'])
+        })
+    except Exception as e:
+        logger.error(f"Error running payroll shard {shard[0]} of {company['name']}: {e}")
+        result['error'] = str(e)
+    finally:
+        if connection is not None:
+            company_pool.putconn(connection)
+        result['duration'] = time.perf_counter() - start
+
+    return result
+
+
+class PayrollBatchCoordinator:
+    """Run a month's payroll for several companies across a process pool
+
+    Each company's active personnel are split into ``shards`` by id, and
+    every (company, shard) pair is one task. Worker processes keep a
+    connection pool per company database for the tasks they receive.
+    """
+
+    def __init__(self, companies: List[Dict[str, Any]], calculation: Dict[str, Any],
+                 workers: Optional[int] = None, shards: int = 1):
+        self.companies = companies
+        self.calculation = calculation
+        self.shards = max(1, shards)
+        self.workers = workers or min(len(companies) * self.shards, os.cpu_count() or 1)
+
+    def run(self, year: int, month: int, full: bool = False) -> Dict[str, Any]:
+        """Run all tasks and return the consolidated run report"""
+        started_at = datetime.now()
+        start = time.perf_counter()
+        results = []
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for company in self.companies:
+                for index in range(self.shards):
+                    future = executor.submit(run_shard, company, self.calculation, year, month,
+                                             (index, self.shards), full)
+                    futures[future] = (company['name'], index)
+
+            for future in as_completed(futures):
+                name, index = futures[future]
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # The worker process itself failed (e.g. it was killed)
+                    logger.error(f"Payroll worker for {name} shard {index} failed: {e}")
+                    results.append({
+                        'company': name, 'shard': index, 'total': 0, 'calculated': 0,
+                        'failed': [], 'skipped': 0, 'error': str(e), 'duration': 0
+                    })
+
+        return self.build_report(results, year, month, full, started_at, time.perf_counter() - start)
+
+    def build_report(self, results: List[Dict[str, Any]], year: int, month: int, full: bool,
+                     started_at: datetime, duration: float) -> Dict[str, Any]:
+        """Consolidate shard results per company"""
+        companies = {}
+        for company in self.companies:
+            companies[company['name']] = {
+                'total': 0, 'calculated': 0, 'failed': [], 'skipped': 0,
+                'duration': 0, 'errors': [], 'shards': []
+            }
+
+        for result in sorted(results, key=lambda item: (item['company'], item['shard'])):
+            summary = companies[result['company']]
+            summary['shards'].append(result)
+            summary['total'] += result['total']
+            summary['calculated'] += result['calculated']
+            summary['failed'].extend(result['failed'])
+            summary['skipped'] += result['skipped']
+            # Shards run concurrently; the slowest one bounds the company's time
+            summary['duration'] = max(summary['duration'], result['duration'])
+            if result['error']:
+                summary['errors'].append(f"shard {result['shard']}: {result['error']}")
+
+        return {
+            'year': year,
+            'month': month,
+            'full': full,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'duration': duration,
+            'workers': self.workers,
+            'shards': self.shards,
+            'companies': companies,
+            'calculated': sum(summary['calculated'] for summary in companies.values()),
+            'skipped': sum(summary['skipped'] for summary in companies.values()),
+            'failed': sum(len(summary['failed']) for summary in companies.values()),
+            'errors': sum(len(summary['errors']) for summary in companies.values())
+        }
+
+
+def write_report(report: Dict[str, Any], directory: str) -> str:
+    """Write a run report as JSON and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(directory, f"payroll_run_{report['year']}_{report['month']:02d}_{timestamp}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4, ensure_ascii=False)
+    return path
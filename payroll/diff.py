@@ -0,0 +1,191 @@
+"""Comparison of two payroll runs
+
+A run is the result columns of one calculation held column-wise: the
+stored payroll of a month, a recalculation from its input snapshot, or
+the rows just before a recalculation. Two runs are joined on personnel id
+through a dict of the earlier run's positions, every component column is
+compared at once, and only the employees and components that changed are
+reported, together with the change in each column's total.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from payroll.engine import RESULT_FIELDS, RateSnapshot
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Amounts are Rials; smaller differences are rounding noise
+DEFAULT_TOLERANCE = 0.5
+
+# Component names shown in the payroll window
+FIELD_LABELS = {
+    'base_salary': "حقوق پایه",
+    'housing_allowance': "حق مسکن",
+    'family_allowance': "حق عائله",
+    'child_allowance': "حق اولاد",
+    'overtime_amount': "اضافه کاری",
+    'other_allowances': "سایر مزایا",
+    'gross_salary': "حقوق ناخالص",
+    'insurance_employee': "بیمه کارمند",
+    'insurance_employer': "بیمه کارفرما",
+    'tax_amount': "مالیات",
+    'loan_deduction': "کسر وام",
+    'advance_deduction': "کسر مساعده",
+    'other_deductions': "سایر کسورات",
+    'net_salary': "حقوق خالص"
+}
+
+
+class PayrollRun:
+    """Result columns of one calculation, one row per employee"""
+
+    def __init__(self, label: str, personnel_ids: Sequence[int], columns: Mapping[str, Sequence[float]]):
+        self.label = label
+        self.personnel_ids = list(personnel_ids)
+        self.fields = tuple(columns)
+        if NUMPY_AVAILABLE:
+            # One (employees x components) matrix, compared in a single operation
+            self.values = np.zeros((len(self.personnel_ids), len(self.fields)))
+            for column, name in enumerate(self.fields):
+                self.values[:, column] = columns[name]
+        else:
+            self.values = [list(map(float, row)) for row in zip(*(columns[name] for name in self.fields))]
+
+    @classmethod
+    def from_rows(cls, label: str, rows: Iterable[Mapping[str, Any]],
+                  fields: Sequence[str] = RESULT_FIELDS) -> 'PayrollRun':
+        """Build a run from result rows carrying personnel_id"""
+        rows = list(rows)
+        columns = {name: [float(row[name] or 0) for row in rows] for name in fields}
+        return cls(label, [row['personnel_id'] for row in rows], columns)
+
+    def __len__(self) -> int:
+        return len(self.personnel_ids)
+
+    def totals(self) -> Dict[str, float]:
+        """Sum of every component over all employees"""
+        if NUMPY_AVAILABLE:
+            return dict(zip(self.fields, map(float, self.values.sum(axis=0))))
+        return {name: sum(row[i] for row in self.values) for i, name in enumerate(self.fields)}
+
+
+@dataclass
+class PayrollDiff:
+    """Changed employees and components between two runs"""
+    before: str
+    after: str
+    # personnel_id -> {component: (before, after)}
+    changed: Dict[int, Dict[str, Tuple[float, float]]] = field(default_factory=dict)
+    added: List[int] = field(default_factory=list)
+    removed: List[int] = field(default_factory=list)
+    unchanged_count: int = 0
+    # component -> (before total, after total, delta)
+    totals: Dict[str, Tuple[float, float, float]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.added or self.removed)
+
+    def component_counts(self) -> Dict[str, int]:
+        """Number of changed employees per component"""
+        counts: Dict[str, int] = {}
+        for changes in self.changed.values():
+            for name in changes:
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+def diff_runs(before: PayrollRun, after: PayrollRun,
+              tolerance: float = DEFAULT_TOLERANCE) -> PayrollDiff:
+    """Compare two runs column by column across all employees"""
+    if before.fields != after.fields:
+        raise ValueError("Payroll runs with different components cannot be compared")
+    fields = after.fields
+
+    # Hash join on personnel id
+    before_positions = {personnel_id: i for i, personnel_id in enumerate(before.personnel_ids)}
+    after_matched, before_matched, added = [], [], []
+    for i, personnel_id in enumerate(after.personnel_ids):
+        position = before_positions.pop(personnel_id, None)
+        if position is None:
+            added.append(personnel_id)
+        else:
+            after_matched.append(i)
+            before_matched.append(position)
+
+    result = PayrollDiff(before.label, after.label, added=added, removed=sorted(before_positions))
+
+    if NUMPY_AVAILABLE:
+        before_values = before.values[before_matched]
+        after_values = after.values[after_matched]
+        rows, columns = np.nonzero(np.abs(after_values - before_values) > tolerance)
+        # Only the changed cells are converted back to Python values
+        for row, column, old, new in zip(rows.tolist(), columns.tolist(),
+                                         before_values[rows, columns].tolist(),
+                                         after_values[rows, columns].tolist()):
+            personnel_id = after.personnel_ids[after_matched[row]]
+            result.changed.setdefault(personnel_id, {})[fields[column]] = (old, new)
+        result.unchanged_count = len(after_matched) - len(result.changed)
+    else:
+        for after_index, before_index in zip(after_matched, before_matched):
+            before_row = before.values[before_index]
+            after_row = after.values[after_index]
+            changes = {name: (before_row[column], after_row[column]) for column, name in enumerate(fields)
+                       if abs(after_row[column] - before_row[column]) > tolerance}
+            if changes:
+                result.changed[after.personnel_ids[after_index]] = changes
+        result.unchanged_count = len(after_matched) - len(result.changed)
+
+    before_totals = before.totals()
+    after_totals = after.totals()
+    result.totals = {name: (before_totals[name], after_totals[name], after_totals[name] - before_totals[name])
+                     for name in fields}
+    return result
+
+
+def previous_month(year: int, month: int) -> Tuple[int, int]:
+    """The Jalali month before (year, month)"""
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def load_stored_run(db, year: int, month: int, label: Optional[str] = None) -> PayrollRun:
+    """Stored payroll results of a month"""
+    query = f"""
+        SELECT personnel_id, {', '.join(RESULT_FIELDS)}
+        FROM payroll
+        WHERE year = %s AND month = %s
+        ORDER BY personnel_id
+    """
+    return PayrollRun.from_rows(label or f"{year}/{month}", db.fetch_all(query, (year, month)))
+
+
+def load_snapshot_run(service, year: int, month: int, rates: Optional[RateSnapshot] = None,
+                      label: Optional[str] = None) -> PayrollRun:
+    """Recalculation of a month from its input snapshot (nothing is saved)"""
+    results, _ = service.recalculate_snapshot(year, month, rates)
+    return PayrollRun.from_rows(label or f"{year}/{month}", results)
+
+
+def diff_months(db, year: int, month: int, tolerance: float = DEFAULT_TOLERANCE) -> PayrollDiff:
+    """Stored payroll of a month against the month before it"""
+    previous_year, previous = previous_month(year, month)
+    return diff_runs(load_stored_run(db, previous_year, previous), load_stored_run(db, year, month), tolerance)
+
+
+def format_payroll_diff(diff: PayrollDiff, limit: int = 50) -> str:
+    """Text summary of a diff: counts, total deltas and the first changed employees"""
+    text = (f"{diff.before} -> {diff.after}: {len(diff.changed)} changed, {len(diff.added)} added, "
+            f"{len(diff.removed)} removed, {diff.unchanged_count} unchanged\n\n")
+    for name, (before, after, delta) in diff.totals.items():
+        if abs(delta) >= 1:
+            text += f"{name}: {before:,.0f} -> {after:,.0f} ({delta:+,.0f})\n"
+
+    for personnel_id in list(diff.changed)[:limit]:
+        changes = ", ".join(f"{name} {after - before:+,.0f}" for name, (before, after) in diff.changed[personnel_id].items())
+        text += f"\npersonnel {personnel_id}: {changes}"
+    if len(diff.changed) > limit:
+        text += f"\n... {len(diff.changed) - limit} more"
+    return text + "\n"
@@ -0,0 +1,202 @@
+"""Pure payroll calculation
+
+No database or Qt access: callers pass an immutable RateSnapshot and the
+inputs of all employees at once, and get result rows back. The same code
+runs in the payroll window, the CLI, batch workers and benchmarks.
+"""
+import hashlib
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from payroll.rules import Rule, get_rule_set, parse_rules
+from payroll.tax import Brackets, brackets_for_year, flat_brackets, get_tax_table
+
+# Result columns, in payroll table order
+RESULT_FIELDS = (
+    'base_salary', 'housing_allowance', 'family_allowance', 'child_allowance',
+    'overtime_amount', 'other_allowances', 'gross_salary', 'insurance_employee',
+    'insurance_employer', 'tax_amount', 'loan_deduction', 'advance_deduction',
+    'other_deductions', 'net_salary'
+)
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Calculation settings captured once per run"""
+    child_allowance: float = 500000
+    insurance_employee: float = 0.07
+    insurance_employer: float = 0.23
+    tax_threshold: float = 56000000
+    tax_rate: float = 0.1
+    # Overtime hours are paid at the employee's hourly base salary times a multiplier
+    monthly_work_hours: float = 240
+    overtime_multiplier: float = 1.4
+    # Share of net pay (before advances) that outstanding advances may take each month
+    advance_deduction_cap: float = 1.0
+    # Progressive brackets of the fiscal year; empty means a flat tax_rate above tax_threshold
+    tax_brackets: Brackets = ()
+    # Configured allowance/deduction rules (other_allowances, other_deductions)
+    rules: Tuple[Rule, ...] = ()
+
+    @classmethod
+    def from_settings(cls, settings: Mapping[str, Any], year: Optional[int] = None) -> 'RateSnapshot':
+        """Build a snapshot from a config "calculation" block for a fiscal year"""
+        names = cls.__dataclass_fields__
+        values = {key: float(value) for key, value in settings.items()
+                  if key in names and key not in ('tax_brackets', 'rules')}
+        values['tax_brackets'] = brackets_for_year(settings, year) or ()
+        values['rules'] = parse_rules(settings.get('rules'))
+        return cls(**values)
+
+    def __post_init__(self):
+        # Resolved once per snapshot; tables are shared between equal bracket sets
+        table = get_tax_table(self.tax_brackets or flat_brackets(self.tax_threshold, self.tax_rate))
+        object.__setattr__(self, 'tax_table', table)
+        object.__setattr__(self, 'rule_set', get_rule_set(self.rules))
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> 'RateSnapshot':
+        """Rebuild a snapshot stored with to_dict()"""
+        values = dict(data)
+        values['tax_brackets'] = tuple(tuple(bracket) for bracket in values.get('tax_brackets', ()))
+        values['rules'] = tuple(Rule(**{key: tuple(value) if isinstance(value, list) else value
+                                        for key, value in rule.items()})
+                                for rule in values.get('rules', ()))
+        return cls(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain data of the snapshot, for storing with a payroll run"""
+        return asdict(self)
+
+    def fingerprint(self) -> str:
+        """Stable hash of the rates, stored with each calculated payroll row"""
+        return hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+@dataclass
+class PayrollInputs:
+    """Per-employee monthly inputs keyed by personnel id; missing ids count as zero
+
+    ``advance_deductions`` holds the outstanding advance balance; the engine
+    deducts as much of it as the advance cap allows.
+    """
+    overtime_hours: Dict[int, float] = field(default_factory=dict)
+    loan_deductions: Dict[int, float] = field(default_factory=dict)
+    advance_deductions: Dict[int, float] = field(default_factory=dict)
+
+
+def calculate_tax(taxable_income: float, rates: RateSnapshot) -> float:
+    """Calculate tax amount based on taxable income"""
+    return rates.tax_table.tax(taxable_income)
+
+
+def calculate_employee(personnel: Mapping[str, Any], overtime_hours: float, loan_deduction: float,
+                       advance_balance: float, rates: RateSnapshot) -> Dict[str, float]:
+    """Calculate payroll for a single employee"""
+    # Base salary
+    base_salary = float(personnel['base_salary'])
+
+    # Allowances
+    housing_allowance = base_salary * float(personnel['housing_allowance_rate'])
+    family_allowance = base_salary * float(personnel['family_allowance_rate'])
+    child_allowance = rates.child_allowance * (personnel['children_count'] or 0)
+
+    # Overtime
+    overtime_amount = float(overtime_hours) * base_salary / rates.monthly_work_hours * rates.overtime_multiplier
+
+    # Other allowances from configured rules
+    rule_set = rates.rule_set
+    other_allowances = 0.0
+    if rule_set:
+        values = {
+            'base_salary': base_salary,
+            'housing_allowance_rate': float(personnel['housing_allowance_rate']),
+            'family_allowance_rate': float(personnel['family_allowance_rate']),
+            'children_count': personnel['children_count'] or 0,
+            'position': personnel.get('position') or '',
+            'employee_code': str(personnel.get('employee_code') or ''),
+            'housing_allowance': housing_allowance,
+            'family_allowance': family_allowance,
+            'child_allowance': child_allowance,
+            'overtime_hours': float(overtime_hours),
+            'overtime_amount': overtime_amount
+        }
+        other_allowances = sum(rule_set.evaluate_allowances(values).values())
+
+    # Gross salary
+    gross_salary = base_salary + housing_allowance + family_allowance + child_allowance + overtime_amount + other_allowances
+
+    # Deductions
+    insurance_employee = gross_salary * rates.insurance_employee
+    insurance_employer = gross_salary * rates.insurance_employer
+    taxable_income = gross_salary - insurance_employee
+    tax_amount = calculate_tax(taxable_income, rates)
+    loan_deduction = float(loan_deduction)
+
+    # Other deductions from configured rules
+    other_deductions = 0.0
+    if rule_set.deductions:
+        values.update({
+            'other_allowances': other_allowances,
+            'gross_salary': gross_salary,
+            'insurance_employee': insurance_employee,
+            'taxable_income': taxable_income,
+            'tax_amount': tax_amount
+        })
+        other_deductions = sum(rule_set.evaluate_deductions(values).values())
+
+    # Advances are repaid from what is left, at most the capped share of it
+    net_before_advances = gross_salary - insurance_employee - tax_amount - loan_deduction - other_deductions
+    advance_deduction = min(float(advance_balance), max(net_before_advances, 0.0) * rates.advance_deduction_cap)
+    
+    # Net salary
+    net_salary = net_before_advances - advance_deduction
+
+    return {
+        'base_salary': base_salary,
+        'housing_allowance': housing_allowance,
+        'family_allowance': family_allowance,
+        'child_allowance': child_allowance,
+        'overtime_amount': overtime_amount,
+        'other_allowances': other_allowances,
+        'gross_salary': gross_salary,
+        'insurance_employee': insurance_employee,
+        'insurance_employer': insurance_employer,
+        'tax_amount': tax_amount,
+        'loan_deduction': loan_deduction,
+        'advance_deduction': advance_deduction,
+        'other_deductions': other_deductions,
+        'net_salary': net_salary
+    }
+
+
+def calculate_bulk(personnel_list: Iterable[Mapping[str, Any]], inputs: PayrollInputs,
+                   rates: RateSnapshot) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    """Calculate payroll for many employees
+
+    Returns the results, each carrying its personnel_id, and the error
+    message of every employee whose data could not be calculated.
+    """
+    overtime_hours = inputs.overtime_hours
+    loan_deductions = inputs.loan_deductions
+    advance_deductions = inputs.advance_deductions
+
+    results = []
+    errors = {}
+    for personnel in personnel_list:
+        personnel_id = personnel['id']
+        try:
+            result = calculate_employee(
+                personnel,
+                overtime_hours.get(personnel_id, 0),
+                loan_deductions.get(personnel_id, 0),
+                advance_deductions.get(personnel_id, 0),
+                rates
+            )
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            errors[personnel_id] = str(e)
+            continue
+        result['personnel_id'] = personnel_id
+        results.append(result)
+    return results, errors
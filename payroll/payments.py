@@ -0,0 +1,180 @@
+"""Posting of salary payments
+
+Paying a month's payroll also consumes what it deducted: the loan
+installments due by the month (overdue ones included) that its loan
+deduction covers, and the payroll's advance deduction, allocated to the
+employee's unsettled advances oldest first. An advance is settled once its
+allocations cover it; a partly repaid one carries its rest to later
+months. Each deduction is also posted to balance_ledger, which keeps
+employee_balances current. Everything is done with a few set-based
+statements in one transaction, so loans, advances and balances always
+agree with the paid rows.
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Payroll rows paid by this posting, with what they deducted
+CREATE_POSTING_TABLE = """
+    CREATE TEMP TABLE payroll_posting (
+        personnel_id INTEGER PRIMARY KEY,
+        loan_deduction DECIMAL(15,2),
+        advance_deduction DECIMAL(15,2)
+    ) ON COMMIT DROP
+"""
+
+MARK_PAID = """
+    WITH paid AS (
+        UPDATE payroll SET is_paid = TRUE, payment_date = CURRENT_DATE
+        WHERE year = %s AND month = %s AND is_paid = FALSE {condition}
+        RETURNING personnel_id, loan_deduction, advance_deduction
+    )
+    INSERT INTO payroll_posting (personnel_id, loan_deduction, advance_deduction)
+    SELECT personnel_id, loan_deduction, advance_deduction FROM paid
+"""
+
+# Installments and advances paid off by this posting
+CREATE_LOAN_POSTING_TABLE = """
+    CREATE TEMP TABLE loan_posting (
+        loan_id INTEGER,
+        personnel_id INTEGER,
+        amount DECIMAL(15,2)
+    ) ON COMMIT DROP
+"""
+
+CREATE_ADVANCE_POSTING_TABLE = """
+    CREATE TEMP TABLE advance_posting (
+        advance_id INTEGER PRIMARY KEY,
+        personnel_id INTEGER,
+        amount DECIMAL(15,2),
+        outstanding DECIMAL(15,2)
+    ) ON COMMIT DROP
+"""
+
+# The loan deduction pays the employee's installments due by the month,
+# overdue ones included, newest first: months paid out of order then each
+# find the installments they deducted. Installments are paid whole, except
+# one only partly covered when the deduction was capped by the balance
+PAY_INSTALLMENTS = """
+    WITH due AS (
+        SELECT li.id, pp.loan_deduction, li.amount,
+               SUM(li.amount) OVER (
+                   PARTITION BY li.personnel_id
+                   ORDER BY li.due_year DESC, li.due_month DESC, li.id DESC
+               ) - li.amount AS allocated_before
+        FROM loan_installments li
+        JOIN payroll_posting pp ON pp.personnel_id = li.personnel_id AND pp.loan_deduction > 0
+        JOIN loans l ON l.id = li.loan_id AND l.is_active = TRUE
+        WHERE (li.due_year, li.due_month) <= (%s, %s) AND li.status = 'due'
+    ),
+    paid AS (
+        UPDATE loan_installments li SET status = 'paid', paid_at = CURRENT_TIMESTAMP
+        FROM due
+        WHERE li.id = due.id AND due.allocated_before < due.loan_deduction
+        RETURNING li.loan_id, li.personnel_id, LEAST(due.amount, due.loan_deduction - due.allocated_before) AS amount
+    )
+    INSERT INTO loan_posting (loan_id, personnel_id, amount)
+    SELECT loan_id, personnel_id, amount FROM paid
+"""
+
+# Deductions are posted before loans are closed and advances settled, so
+# the ledger triggers of those tables find nothing left to adjust
+POST_LOAN_DEDUCTIONS = """
+    INSERT INTO balance_ledger (personnel_id, account, source_id, entry_type, amount, year, month)
+    SELECT personnel_id, 'loan', loan_id, 'deduction', -amount, %s, %s
+    FROM loan_posting
+"""
+
+DECREMENT_INSTALLMENTS = """
+    UPDATE loans l SET remaining_installments = GREATEST(l.remaining_installments - lp.paid_count, 0)
+    FROM (SELECT loan_id, COUNT(*) AS paid_count FROM loan_posting GROUP BY loan_id) lp
+    WHERE l.id = lp.loan_id
+"""
+
+CLOSE_FINISHED_LOANS = """
+    UPDATE loans l SET is_active = FALSE
+    FROM payroll_posting pp
+    WHERE l.personnel_id = pp.personnel_id
+      AND l.is_active = TRUE AND l.remaining_installments <= 0
+"""
+
+# Each advance takes what is left of the deduction after the older ones
+ALLOCATE_ADVANCES = """
+    INSERT INTO advance_posting (advance_id, personnel_id, amount, outstanding)
+    SELECT id, personnel_id, LEAST(outstanding, advance_deduction - allocated_before), outstanding
+    FROM (
+        SELECT a.id, a.personnel_id, pp.advance_deduction, o.outstanding,
+               COALESCE(SUM(o.outstanding) OVER (
+                   PARTITION BY a.personnel_id ORDER BY a.advance_date, a.id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS allocated_before
+        FROM advances a
+        JOIN payroll_posting pp ON pp.personnel_id = a.personnel_id AND pp.advance_deduction > 0
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(SUM(bl.amount), a.advance_amount) AS outstanding
+            FROM balance_ledger bl
+            WHERE bl.account = 'advance' AND bl.source_id = a.id
+        ) o
+        WHERE a.is_settled = FALSE
+    ) queue
+    WHERE outstanding > 0 AND advance_deduction > allocated_before
+"""
+
+POST_ADVANCE_DEDUCTIONS = """
+    INSERT INTO balance_ledger (personnel_id, account, source_id, entry_type, amount, year, month)
+    SELECT personnel_id, 'advance', advance_id, 'deduction', -amount, %s, %s
+    FROM advance_posting
+"""
+
+SETTLE_ADVANCES = """
+    UPDATE advances SET is_settled = TRUE
+    WHERE id IN (SELECT advance_id FROM advance_posting WHERE amount >= outstanding)
+"""
+
+
+def post_payments(db, year: int, month: int, payroll_ids: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+    """Mark a month's unpaid payroll as paid and settle its loans and advances
+
+    ``payroll_ids`` restricts the posting to some payroll rows. Returns the
+    number of rows each step changed and the duration, or None when the
+    transaction failed and was rolled back.
+    """
+    start = time.perf_counter()
+    condition = ""
+    params: tuple = (year, month)
+    if payroll_ids is not None:
+        condition = "AND id = ANY(%s)"
+        params += (list(payroll_ids),)
+
+    statements = [
+        (CREATE_POSTING_TABLE, None),
+        (CREATE_LOAN_POSTING_TABLE, None),
+        (CREATE_ADVANCE_POSTING_TABLE, None),
+        (MARK_PAID.format(condition=condition), params),
+        (PAY_INSTALLMENTS, (year, month)),
+        (POST_LOAN_DEDUCTIONS, (year, month)),
+        (DECREMENT_INSTALLMENTS, None),
+        (CLOSE_FINISHED_LOANS, None),
+        (ALLOCATE_ADVANCES, None),
+        (POST_ADVANCE_DEDUCTIONS, (year, month)),
+        (SETTLE_ADVANCES, None)
+    ]
+    row_counts = db.execute_transaction(statements)
+    if row_counts is None:
+        logger.error(f"Failed to post payroll payments of {year}/{month}")
+        return None
+
+    _, _, _, paid, installments, _, _, closed_loans, advance_allocations, _, settled_advances = row_counts
+    result = {
+        'paid': paid,
+        'installments': installments,
+        'closed_loans': closed_loans,
+        'advance_allocations': advance_allocations,
+        'settled_advances': settled_advances,
+        'duration': time.perf_counter() - start
+    }
+    logger.info(f"Posted payroll {year}/{month}: {paid} paid, {installments} installments, "
+                f"{closed_loans} loans closed, {advance_allocations} advance allocations, "
+                f"{settled_advances} advances settled")
+    return result
@@ -0,0 +1,204 @@
+import csv
+import logging
+from datetime import time
+from typing import Any, Dict, List, Optional
+
+from database.archive import YearArchive
+from database.database_manager import summarize_payroll_rows
+from utils.date_converter import DateConverter
+from utils.jalali_calendar import JalaliCalendar
+
+logger = logging.getLogger(__name__)
+
+# Column headers of the monthly attendance report, in result column order
+ATTENDANCE_REPORT_COLUMNS = [
+    ('employee_code', "کد پرسنلی"),
+    ('full_name', "نام و نام خانوادگی"),
+    ('work_days', "روزهای کاری"),
+    ('month_working_days', "روزهای کاری ماه"),
+    ('sick_leave', "مرخصی استعلاجی"),
+    ('annual_leave', "مرخصی استحقاقی"),
+    ('absence_days', "غیبت"),
+    ('holiday_days', "تعطیلات"),
+    ('overtime_hours', "اضافه کاری (ساعت)"),
+    ('late_days', "تأخیر"),
+    ('total_work_hours', "مجموع ساعات کاری")
+]
+
+
+# Entries after this time count as late
+LATE_ENTRY_TIME = time(8, 15)
+PAYMENT_STATUS_PAID = "پرداخت شده"
+PAYMENT_STATUS_UNPAID = "پرداخت نشده"
+
+
+def payroll_report_rows(db, year: int, month: int,
+                        archive: Optional[YearArchive] = None) -> List[Dict[str, Any]]:
+    """Per-employee payroll of a Jalali month, from the archive for archived years"""
+    if archive is not None and archive.has_year(year):
+        rows = []
+        for row in archive.rows('payroll', year, month):
+            rows.append({
+                'employee_code': row['employee_code'],
+                'full_name': row['full_name'],
+                'base_salary': row['base_salary'],
+                'allowances': (row['housing_allowance'] + row['family_allowance'] + row['child_allowance']
+                               + row['overtime_amount'] + row['other_allowances']),
+                'deductions': (row['insurance_employee'] + row['tax_amount'] + row['loan_deduction']
+                               + row['advance_deduction'] + row['other_deductions']),
+                'net_salary': row['net_salary'],
+                'payment_status': PAYMENT_STATUS_PAID if row['is_paid'] else PAYMENT_STATUS_UNPAID,
+                'payment_date': str(row['payment_date']) if row['payment_date'] else '-'
+            })
+        return rows
+
+    query = f"""
+        SELECT
+            p.employee_code,
+            p.first_name || ' ' || p.last_name as full_name,
+            pr.base_salary,
+            (pr.housing_allowance + pr.family_allowance + pr.child_allowance +
+             pr.overtime_amount + pr.other_allowances) as allowances,
+            (pr.insurance_employee + pr.tax_amount + pr.loan_deduction +
+             pr.advance_deduction + pr.other_deductions) as deductions,
+            pr.net_salary,
+            CASE WHEN pr.is_paid THEN '{PAYMENT_STATUS_PAID}' ELSE '{PAYMENT_STATUS_UNPAID}' END as payment_status,
+            COALESCE(pr.payment_date::text, '-') as payment_date
+        FROM payroll pr
+        JOIN personnel p ON pr.personnel_id = p.id
+        WHERE pr.year = %s AND pr.month = %s
+        ORDER BY p.employee_code
+    """
+    return db.fetch_all(query, (year, month))
+
+
+def attendance_report_rows(db, year: int, month: int, calendar: Optional[JalaliCalendar] = None,
+                           archive: Optional[YearArchive] = None) -> List[Dict[str, Any]]:
+    """Per-employee attendance totals of a Jalali month"""
+    period = (calendar or JalaliCalendar()).month(year, month)
+    if archive is not None and archive.has_year(year):
+        return archived_attendance_totals(archive.rows('attendance', year, month), period.working_days)
+
+    query = """
+        SELECT
+            p.employee_code,
+            p.first_name || ' ' || p.last_name as full_name,
+            COUNT(CASE WHEN a.absence_type = 'حاضر' THEN 1 END) as work_days,
+            %s as month_working_days,
+            COUNT(CASE WHEN a.absence_type = 'مرخصی استعلاجی' THEN 1 END) as sick_leave,
+            COUNT(CASE WHEN a.absence_type = 'مرخصی استحقاقی' THEN 1 END) as annual_leave,
+            COUNT(CASE WHEN a.absence_type = 'غیبت' THEN 1 END) as absence_days,
+            COUNT(CASE WHEN a.absence_type = 'تعطیل' THEN 1 END) as holiday_days,
+            COALESCE(SUM(a.overtime_hours), 0) as overtime_hours,
+            COUNT(CASE WHEN a.entry_time > '08:15' THEN 1 END) as late_days,
+            COUNT(CASE WHEN a.absence_type = 'حاضر' THEN 1 END) * 8 as total_work_hours
+        FROM personnel p
+        LEFT JOIN attendance a ON p.id = a.personnel_id
+            AND a.date >= %s AND a.date < %s
+        WHERE p.is_active = TRUE
+        GROUP BY p.id, p.employee_code, p.first_name, p.last_name
+        ORDER BY p.employee_code
+    """
+    return db.fetch_all(query, (period.working_days, period.start, period.end))
+
+
+def archived_attendance_totals(rows: List[Dict[str, Any]], month_working_days: int) -> List[Dict[str, Any]]:
+    """Attendance report rows from archived attendance rows
+
+    Lists the employees with attendance in the month; who was active then
+    is not archived.
+    """
+    counted_types = {
+        'حاضر': 'work_days',
+        'مرخصی استعلاجی': 'sick_leave',
+        'مرخصی استحقاقی': 'annual_leave',
+        'غیبت': 'absence_days',
+        'تعطیل': 'holiday_days'
+    }
+    totals = {}
+    for row in rows:
+        employee = totals.setdefault(row['personnel_id'], {
+            'employee_code': row['employee_code'],
+            'full_name': row['full_name'],
+            'month_working_days': month_working_days,
+            **{column: 0 for column in counted_types.values()},
+            'overtime_hours': 0,
+            'late_days': 0
+        })
+        column = counted_types.get(row['absence_type'])
+        if column is not None:
+            employee[column] += 1
+        employee['overtime_hours'] += row['overtime_hours'] or 0
+        if row['entry_time'] is not None and row['entry_time'] > LATE_ENTRY_TIME:
+            employee['late_days'] += 1
+    for employee in totals.values():
+        employee['total_work_hours'] = employee['work_days'] * 8
+    return sorted(totals.values(), key=lambda employee: employee['employee_code'] or '')
+
+
+def export_attendance_csv(rows: List[Dict[str, Any]], path: str):
+    """Write attendance report rows to a CSV file Excel opens as UTF-8"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([header for _, header in ATTENDANCE_REPORT_COLUMNS])
+        for row in rows:
+            writer.writerow([row.get(column, '') for column, _ in ATTENDANCE_REPORT_COLUMNS])
+
+
+def financial_report_rows(db, year: int, archive: Optional[YearArchive] = None) -> List[Dict[str, Any]]:
+    """Monthly payroll totals of a year from payroll_month_summary, or from the archive"""
+    if archive is not None and archive.has_year(year):
+        return sorted(summarize_payroll_rows(archive.rows('payroll', year)), key=lambda row: row['month'])
+
+    # At most twelve precomputed rows, whatever the headcount
+    query = """
+        SELECT *
+        FROM payroll_month_summary
+        WHERE year = %s AND employee_count > 0
+        ORDER BY month
+    """
+    return db.fetch_all(query, (year,))
+
+
+def format_financial_report(year: int, rows: List[Dict[str, Any]]) -> str:
+    """Format the yearly financial report as text"""
+    financial_text = f"گزارش مالی سال {year}\n\n"
+    financial_text += "ماه | تعداد | حقوق پایه | حقوق ناخالص | حقوق خالص | بیمه کارمند | بیمه کارفرما | مالیات | وضعیت پرداخت\n"
+    financial_text += "-" * 100 + "\n"
+
+    yearly_totals = {
+        'employees': 0,
+        'base_salary': 0,
+        'gross_salary': 0,
+        'net_salary': 0,
+        'insurance_employee': 0,
+        'insurance_employer': 0,
+        'tax': 0,
+        'paid': 0
+    }
+
+    for row_data in rows:
+        month_name = DateConverter.get_jalali_month_name(row_data['month'])
+        financial_text += f"{month_name} | {row_data['employee_count']} | {row_data['total_base_salary']:,.0f} | {row_data['total_gross_salary']:,.0f} | {row_data['total_net_salary']:,.0f} | {row_data['total_insurance_employee']:,.0f} | {row_data['total_insurance_employer']:,.0f} | {row_data['total_tax']:,.0f} | {row_data['paid_count']}/{row_data['employee_count']}\n"
+
+        # Update yearly totals
+        yearly_totals['employees'] += row_data['employee_count']
+        yearly_totals['base_salary'] += row_data['total_base_salary']
+        yearly_totals['gross_salary'] += row_data['total_gross_salary']
+        yearly_totals['net_salary'] += row_data['total_net_salary']
+        yearly_totals['insurance_employee'] += row_data['total_insurance_employee']
+        yearly_totals['insurance_employer'] += row_data['total_insurance_employer']
+        yearly_totals['tax'] += row_data['total_tax']
+        yearly_totals['paid'] += row_data['paid_count']
+
+    financial_text += f"\nجمع سالانه:\n"
+    financial_text += f"• تعداد کل پرسنل: {yearly_totals['employees']} نفر\n"
+    financial_text += f"• مجموع حقوق پایه: {yearly_totals['base_salary']:,.0f} ریال\n"
+    financial_text += f"• مجموع حقوق ناخالص: {yearly_totals['gross_salary']:,.0f} ریال\n"
+    financial_text += f"• مجموع حقوق خالص: {yearly_totals['net_salary']:,.0f} ریال\n"
+    financial_text += f"• مجموع بیمه کارمند: {yearly_totals['insurance_employee']:,.0f} ریال\n"
+    financial_text += f"• مجموع بیمه کارفرما: {yearly_totals['insurance_employer']:,.0f} ریال\n"
+    financial_text += f"• مجموع مالیات: {yearly_totals['tax']:,.0f} ریال\n"
+    financial_text += f"• تعداد پرداخت‌ها: {yearly_totals['paid']} پرداخت\n"
+
+    return financial_text
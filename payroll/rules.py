@@ -0,0 +1,178 @@
+"""Declarative allowance and deduction rules
+
+Rules come from the ``rules`` list of the calculation settings, e.g.::
+
+    {"name": "food", "kind": "allowance", "formula": "base_salary * 0.05",
+     "when": "children_count > 0", "positions": ["برنامه نویس"], "max": 5000000}
+
+``formula`` and ``when`` are Python-like expressions over the variables
+below. They are parsed and validated once, then compiled into plain
+functions, so evaluating a rule per employee costs one function call.
+Allowance rules add to ``other_allowances`` (and so to gross salary),
+deduction rules to ``other_deductions``.
+"""
+import ast
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Employee fields usable in every rule
+PERSONNEL_VARIABLES = frozenset({
+    'base_salary', 'housing_allowance_rate', 'family_allowance_rate', 'children_count',
+    'position', 'employee_code'
+})
+
+# Values available to allowance rules (before gross salary is known)
+ALLOWANCE_VARIABLES = PERSONNEL_VARIABLES | {
+    'housing_allowance', 'family_allowance', 'child_allowance', 'overtime_hours', 'overtime_amount'
+}
+
+# Deduction rules also see the gross salary and statutory deductions
+DEDUCTION_VARIABLES = ALLOWANCE_VARIABLES | {
+    'other_allowances', 'gross_salary', 'insurance_employee', 'taxable_income', 'tax_amount'
+}
+
+FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'round': round}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant, ast.List, ast.Tuple,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn
+)
+
+
+class RuleError(ValueError):
+    """A rule definition that cannot be compiled"""
+
+
+@dataclass(frozen=True)
+class Rule:
+    """One allowance or deduction definition"""
+    name: str
+    kind: str
+    formula: str
+    when: str = ''
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    positions: Tuple[str, ...] = ()
+    employee_codes: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> 'Rule':
+        """Build a rule from its settings entry"""
+        return cls(
+            name=data['name'],
+            kind=data.get('kind', 'allowance'),
+            formula=str(data['formula']),
+            when=data.get('when', ''),
+            minimum=data.get('min'),
+            maximum=data.get('max'),
+            positions=tuple(data.get('positions', ())),
+            employee_codes=tuple(str(code) for code in data.get('employee_codes', ()))
+        )
+
+
+def parse_rules(definitions: Iterable[Mapping[str, Any]]) -> Tuple[Rule, ...]:
+    """Rules from the ``rules`` list of the calculation settings"""
+    rules = []
+    for definition in definitions or ():
+        try:
+            rules.append(Rule.from_dict(definition))
+        except KeyError as e:
+            raise RuleError(f"Rule definition without {e.args[0]!r}: {dict(definition)}")
+    return tuple(rules)
+
+
+def _parse_expression(source: str, variables: frozenset, rule_name: str) -> ast.Expression:
+    """Parse an expression, allowing only arithmetic, comparisons and known names"""
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise RuleError(f"Rule {rule_name}: invalid expression {source!r}: {e.msg}")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise RuleError(f"Rule {rule_name}: {type(node).__name__} is not allowed in {source!r}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise RuleError(f"Rule {rule_name}: only {', '.join(FUNCTIONS)} can be called")
+        elif isinstance(node, ast.Name) and node.id not in variables and node.id not in FUNCTIONS:
+            raise RuleError(f"Rule {rule_name}: unknown variable {node.id!r}")
+
+    return tree
+
+
+class _VariableLookup(ast.NodeTransformer):
+    """Rewrite variable names into lookups on the employee's value dict"""
+
+    def visit_Name(self, node: ast.Name):
+        if node.id in FUNCTIONS:
+            return node
+        return ast.copy_location(
+            ast.Subscript(value=ast.Name(id='v', ctx=ast.Load()), slice=ast.Constant(node.id), ctx=ast.Load()),
+            node
+        )
+
+
+def compile_rule(rule: Rule) -> Callable[[Mapping[str, Any]], float]:
+    """Compile a rule into a function of the employee's value dict"""
+    if rule.kind not in ('allowance', 'deduction'):
+        raise RuleError(f"Rule {rule.name}: kind must be 'allowance' or 'deduction'")
+
+    variables = ALLOWANCE_VARIABLES if rule.kind == 'allowance' else DEDUCTION_VARIABLES
+    body = _parse_expression(rule.formula, variables, rule.name).body
+
+    if rule.minimum is not None:
+        body = ast.Call(func=ast.Name(id='max', ctx=ast.Load()), args=[body, ast.Constant(float(rule.minimum))], keywords=[])
+    if rule.maximum is not None:
+        body = ast.Call(func=ast.Name(id='min', ctx=ast.Load()), args=[body, ast.Constant(float(rule.maximum))], keywords=[])
+
+    conditions = []
+    if rule.when:
+        conditions.append(_parse_expression(rule.when, variables, rule.name).body)
+    if rule.positions:
+        conditions.append(_parse_expression(f"position in {list(rule.positions)!r}", variables, rule.name).body)
+    if rule.employee_codes:
+        conditions.append(_parse_expression(f"employee_code in {list(rule.employee_codes)!r}", variables, rule.name).body)
+    if conditions:
+        test = conditions[0] if len(conditions) == 1 else ast.BoolOp(op=ast.And(), values=conditions)
+        body = ast.IfExp(test=test, body=body, orelse=ast.Constant(0.0))
+
+    function = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='v')], kwonlyargs=[],
+                           kw_defaults=[], defaults=[]),
+        body=_VariableLookup().visit(body)
+    ))
+    code = compile(ast.fix_missing_locations(function), f"<rule {rule.name}>", 'eval')
+    return eval(code, {'__builtins__': {}, **FUNCTIONS})
+
+
+class RuleSet:
+    """Compiled allowance and deduction rules of a run"""
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = tuple(rules)
+        self.allowances: List[Tuple[str, Callable]] = []
+        self.deductions: List[Tuple[str, Callable]] = []
+        for rule in self.rules:
+            target = self.allowances if rule.kind == 'allowance' else self.deductions
+            target.append((rule.name, compile_rule(rule)))
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def evaluate_allowances(self, values: Mapping[str, Any]) -> Dict[str, float]:
+        """Amount of every allowance rule for one employee"""
+        return {name: float(function(values)) for name, function in self.allowances}
+
+    def evaluate_deductions(self, values: Mapping[str, Any]) -> Dict[str, float]:
+        """Amount of every deduction rule for one employee"""
+        return {name: float(function(values)) for name, function in self.deductions}
+
+
+@lru_cache(maxsize=32)
+def get_rule_set(rules: Tuple[Rule, ...]) -> RuleSet:
+    """Shared, cached compiled rule set"""
+    return RuleSet(rules)
@@ -0,0 +1,337 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from payroll.engine import RESULT_FIELDS, PayrollInputs, RateSnapshot, calculate_bulk
+from utils.jalali_calendar import JalaliCalendar
+
+logger = logging.getLogger(__name__)
+
+# payroll_inputs columns written by a run, key columns first
+SNAPSHOT_COLUMNS = (
+    'year', 'month', 'personnel_id', 'employee_code', 'position', 'base_salary',
+    'housing_allowance_rate', 'family_allowance_rate', 'children_count',
+    'overtime_hours', 'loan_deduction', 'advance_deduction', 'settings_hash'
+)
+SNAPSHOT_CHUNK_SIZE = 1000
+# Payroll rows per upsert statement
+SAVE_CHUNK_SIZE = 1000
+
+
+class PayrollService:
+    """Headless monthly payroll calculation
+
+    Used by the payroll window and by batch runs. It loads the inputs of all
+    employees with a few set-based queries, hands them to the pure engine
+    with a rate snapshot taken once, and saves the results.
+
+    Every run freezes the inputs it calculated from into payroll_inputs
+    (and its rates into payroll_rate_snapshots), so a month can later be
+    recalculated, audited or diffed exactly as it was paid, without
+    reading the live personnel, attendance, loan and advance tables.
+    """
+
+    def __init__(self, db, settings: Union[RateSnapshot, Dict[str, Any]],
+                 calendar: Optional[JalaliCalendar] = None):
+        self.db = db
+        self.settings = settings
+        self.calendar = calendar or JalaliCalendar()
+
+    def rates_for(self, year: int) -> RateSnapshot:
+        """Rate snapshot of a fiscal year (tax brackets differ per year)"""
+        if isinstance(self.settings, RateSnapshot):
+            return self.settings
+        return RateSnapshot.from_settings(self.settings, year)
+
+    def load_personnel(self, year: int, month: int, full: bool = False,
+                       shard: Optional[Tuple[int, int]] = None,
+                       include_paid: bool = False) -> Tuple[List[dict], List[dict]]:
+        """Split active personnel into (to calculate, skipped as unchanged)
+
+        ``shard`` is (index, count) and restricts the run to ids with
+        ``id % count == index``. Employees whose payroll of the month is
+        already paid are left out: their loans and advances have been
+        settled from it, so it must not change. ``include_paid`` keeps them
+        for read-only uses such as simulations.
+        """
+        # Flagged when the month's payroll is out of date: never calculated,
+        # calculated with other settings, or inputs edited since
+        query = """
+            SELECT p.*, (
+                pr.id IS NULL OR pr.calculated_at IS NULL
+                OR pr.settings_hash IS DISTINCT FROM %s
+                OR d.changed_at >= pr.calculated_at
+            ) AS is_dirty
+            FROM personnel p
+            LEFT JOIN payroll pr ON pr.personnel_id = p.id AND pr.year = %s AND pr.month = %s
+            LEFT JOIN payroll_dirty d ON d.personnel_id = p.id
+            WHERE p.is_active = TRUE
+        """
+        if not include_paid:
+            query += " AND NOT COALESCE(pr.is_paid, FALSE)"
+        params = [self.rates_for(year).fingerprint(), year, month]
+        if shard is not None:
+            query += " AND p.id %% %s = %s"
+            params.extend([shard[1], shard[0]])
+
+        active_personnel = self.db.fetch_all(query, tuple(params))
+
+        if full:
+            return active_personnel, []
+
+        to_calculate = [personnel for personnel in active_personnel if personnel.get('is_dirty', True)]
+        skipped = [personnel for personnel in active_personnel if not personnel.get('is_dirty', True)]
+        return to_calculate, skipped
+
+    def calculate_month(self, year: int, month: int, full: bool = False,
+                        shard: Optional[Tuple[int, int]] = None,
+                        from_snapshot: bool = False) -> Dict[str, Any]:
+        """Calculate and save payroll of a month, returning a run summary
+
+        With ``from_snapshot`` the month is rerun from its frozen inputs and
+        rates instead of the live tables (``full`` and ``shard`` are ignored).
+        """
+        start = time.perf_counter()
+        if from_snapshot:
+            results, errors = self.recalculate_snapshot(year, month)
+            total = len(results) + len(errors)
+            skipped = []
+            captured = total > 0
+            snapshot = []
+        else:
+            rates = self.rates_for(year)
+            personnel_list, skipped = self.load_personnel(year, month, full, shard)
+            inputs = self.load_inputs([personnel['id'] for personnel in personnel_list], year, month)
+            results, errors = calculate_bulk(personnel_list, inputs, rates)
+            total = len(personnel_list) + len(skipped)
+            settings_hash = rates.fingerprint()
+            for result in results:
+                result['settings_hash'] = settings_hash
+            # Only the employees actually calculated are frozen, with their results
+            calculated_ids = {result['personnel_id'] for result in results}
+            snapshot = self.snapshot_statements(
+                year, month, [personnel for personnel in personnel_list if personnel['id'] in calculated_ids],
+                inputs, rates)
+
+        for personnel_id, error in errors.items():
+            logger.error(f"Error calculating payroll of personnel {personnel_id}: {error}")
+
+        failed = list(errors)
+        calculated = self.save_results(year, month, results, snapshot)
+        if not from_snapshot:
+            # The snapshot is committed or rolled back with the results
+            captured = calculated is not None
+        if calculated is None:
+            calculated = 0
+            failed.extend(result['personnel_id'] for result in results)
+
+        return {
+            'total': total,
+            'calculated': calculated,
+            'failed': failed,
+            'skipped': skipped,
+            'captured': captured,
+            'duration': time.perf_counter() - start
+        }
+
+    def snapshot_statements(self, year: int, month: int, personnel_list: List[dict],
+                            inputs: PayrollInputs, rates: RateSnapshot) -> List[Tuple[str, tuple]]:
+        """Statements freezing the inputs a run calculated from into payroll_inputs
+
+        They are run in the same transaction as the results (see
+        save_results), so a snapshot exists exactly for the rows saved.
+        """
+        settings_hash = rates.fingerprint()
+        rates_query = """
+            INSERT INTO payroll_rate_snapshots (settings_hash, rates)
+            VALUES (%s, %s)
+            ON CONFLICT (settings_hash) DO NOTHING
+        """
+        statements = [(rates_query, (settings_hash, json.dumps(rates.to_dict(), sort_keys=True)))]
+
+        rows = []
+        for personnel in personnel_list:
+            personnel_id = personnel['id']
+            rows.append((
+                year, month, personnel_id, personnel.get('employee_code'), personnel.get('position'),
+                personnel['base_salary'], personnel.get('housing_allowance_rate') or 0,
+                personnel.get('family_allowance_rate') or 0, personnel.get('children_count') or 0,
+                inputs.overtime_hours.get(personnel_id, 0), inputs.loan_deductions.get(personnel_id, 0),
+                inputs.advance_deductions.get(personnel_id, 0), settings_hash
+            ))
+
+        # Multi-row upserts; employees skipped as unchanged keep their earlier snapshot
+        for offset in range(0, len(rows), SNAPSHOT_CHUNK_SIZE):
+            chunk = rows[offset:offset + SNAPSHOT_CHUNK_SIZE]
+            query = f"""
+                INSERT INTO payroll_inputs
+                ({', '.join(SNAPSHOT_COLUMNS)}, captured_at)
+                VALUES {', '.join(['(' + ', '.join(['%s'] * len(SNAPSHOT_COLUMNS)) + ', CURRENT_TIMESTAMP)'] * len(chunk))}
+                ON CONFLICT (year, month, personnel_id) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in SNAPSHOT_COLUMNS[3:])},
+                captured_at = EXCLUDED.captured_at
+            """
+            statements.append((query, tuple(value for row in chunk for value in row)))
+        return statements
+
+    def load_snapshot(self, year: int, month: int, personnel_ids: Optional[List[int]] = None
+                      ) -> Tuple[List[dict], PayrollInputs, Dict[str, RateSnapshot]]:
+        """Frozen personnel rows, inputs and rates of a month
+
+        Personnel rows carry ``id`` like live ones, so they can go straight to
+        the engine, and the ``settings_hash`` of the rates they were
+        captured with; the rates are returned keyed by that hash.
+        """
+        query = """
+            SELECT pi.*, pi.personnel_id AS id
+            FROM payroll_inputs pi
+            WHERE pi.year = %s AND pi.month = %s
+        """
+        params = [year, month]
+        if personnel_ids is not None:
+            query += " AND pi.personnel_id = ANY(%s)"
+            params.append(list(personnel_ids))
+        query += " ORDER BY pi.personnel_id"
+
+        rows = self.db.fetch_all(query, tuple(params))
+        inputs = PayrollInputs()
+        for row in rows:
+            personnel_id = row['id']
+            inputs.overtime_hours[personnel_id] = row['overtime_hours'] or 0
+            inputs.loan_deductions[personnel_id] = row['loan_deduction'] or 0
+            inputs.advance_deductions[personnel_id] = row['advance_deduction'] or 0
+
+        rates = {}
+        hashes = sorted({row['settings_hash'] for row in rows if row.get('settings_hash')})
+        if hashes:
+            rates_query = "SELECT settings_hash, rates FROM payroll_rate_snapshots WHERE settings_hash = ANY(%s)"
+            for row in self.db.fetch_all(rates_query, (hashes,)):
+                rates[row['settings_hash']] = RateSnapshot.from_dict(json.loads(row['rates']))
+        return rows, inputs, rates
+
+    def recalculate_snapshot(self, year: int, month: int, rates: Optional[RateSnapshot] = None,
+                             personnel_ids: Optional[List[int]] = None
+                             ) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+        """Recalculate a month from its snapshot without saving (reruns, audits, diffs)
+
+        Each employee is calculated with the rates frozen with their inputs,
+        unless other ``rates`` are given.
+        """
+        personnel_list, inputs, stored_rates = self.load_snapshot(year, month, personnel_ids)
+        if rates is not None:
+            return calculate_bulk(personnel_list, inputs, rates)
+
+        groups: Dict[Optional[str], List[dict]] = {}
+        for personnel in personnel_list:
+            groups.setdefault(personnel.get('settings_hash'), []).append(personnel)
+
+        results, errors = [], {}
+        for settings_hash, group in groups.items():
+            group_rates = stored_rates.get(settings_hash) or self.rates_for(year)
+            group_results, group_errors = calculate_bulk(group, inputs, group_rates)
+            for result in group_results:
+                result['settings_hash'] = group_rates.fingerprint()
+            results.extend(group_results)
+            errors.update(group_errors)
+        return results, errors
+
+    def load_inputs(self, personnel_ids: List[int], year: int, month: int) -> PayrollInputs:
+        """Load the month's overtime, loan and advance inputs of many employees"""
+        inputs = PayrollInputs()
+        if not personnel_ids:
+            return inputs
+
+        period = self.calendar.month(year, month)
+        overtime_query = """
+            SELECT personnel_id, COALESCE(SUM(overtime_hours), 0) AS overtime_hours
+            FROM attendance
+            WHERE personnel_id = ANY(%s) AND date >= %s AND date < %s
+            GROUP BY personnel_id
+        """
+        for row in self.db.fetch_all(overtime_query, (personnel_ids, period.start, period.end)):
+            inputs.overtime_hours[row['personnel_id']] = row['overtime_hours'] or 0
+
+        # Installments of all active loans due by the month, including overdue
+        # ones of months never paid, never more than the outstanding loan balance
+        loans_query = """
+            SELECT li.personnel_id, GREATEST(LEAST(SUM(li.amount), MIN(b.loan_balance)), 0) AS amount
+            FROM loan_installments li
+            JOIN loans l ON l.id = li.loan_id
+            LEFT JOIN employee_balances b ON b.personnel_id = li.personnel_id
+            WHERE (li.due_year, li.due_month) <= (%s, %s) AND li.status = 'due'
+              AND li.personnel_id = ANY(%s) AND l.is_active = TRUE
+            GROUP BY li.personnel_id
+        """
+        # Balances only fall when a month is paid, so what calculated but
+        # unpaid earlier months already deduct is not available again
+        unpaid_query = """
+            SELECT personnel_id, SUM(loan_deduction) AS loan_deduction,
+                   SUM(advance_deduction) AS advance_deduction
+            FROM payroll
+            WHERE personnel_id = ANY(%s) AND is_paid = FALSE AND (year, month) < (%s, %s)
+            GROUP BY personnel_id
+        """
+        unpaid = {row['personnel_id']: row for row in self.db.fetch_all(unpaid_query, (personnel_ids, year, month))}
+
+        for row in self.db.fetch_all(loans_query, (year, month, personnel_ids)):
+            deducted = (unpaid.get(row['personnel_id']) or {}).get('loan_deduction') or 0
+            amount = (row['amount'] or 0) - deducted
+            if amount > 0:
+                inputs.loan_deductions[row['personnel_id']] = amount
+
+        # Outstanding advances; the engine caps what is deducted this month
+        advances_query = """
+            SELECT personnel_id, advance_balance
+            FROM employee_balances
+            WHERE personnel_id = ANY(%s) AND advance_balance > 0
+        """
+        for row in self.db.fetch_all(advances_query, (personnel_ids,)):
+            deducted = (unpaid.get(row['personnel_id']) or {}).get('advance_deduction') or 0
+            amount = (row['advance_balance'] or 0) - deducted
+            if amount > 0:
+                inputs.advance_deductions[row['personnel_id']] = amount
+
+        return inputs
+
+    def save_results(self, year: int, month: int, results: List[Dict[str, Any]],
+                     snapshot: List[Tuple[str, tuple]] = ()) -> Optional[int]:
+        """Upsert the month's payroll rows of many employees in one transaction
+
+        One multi-row statement per chunk, so the statement-level summary,
+        dirty and change-log triggers fire once per chunk rather than once
+        per employee. Rows already paid are left unchanged. The ``snapshot``
+        statements of the run are committed or rolled back with the rows.
+        Returns the number of rows written, or None when nothing was saved.
+        """
+        columns = ('personnel_id', 'year', 'month') + RESULT_FIELDS + ('settings_hash',)
+        rows = [
+            (result['personnel_id'], year, month) + tuple(result[field] for field in RESULT_FIELDS)
+            + (result['settings_hash'],)
+            for result in results
+        ]
+
+        statements = list(snapshot)
+        for offset in range(0, len(rows), SAVE_CHUNK_SIZE):
+            chunk = rows[offset:offset + SAVE_CHUNK_SIZE]
+            query = f"""
+                INSERT INTO payroll ({', '.join(columns)}, calculated_at)
+                VALUES {', '.join(['(' + ', '.join(['%s'] * len(columns)) + ', CURRENT_TIMESTAMP)'] * len(chunk))}
+                ON CONFLICT (personnel_id, year, month) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in columns[3:])},
+                calculated_at = EXCLUDED.calculated_at
+                WHERE NOT payroll.is_paid
+            """
+            statements.append((query, tuple(value for row in chunk for value in row)))
+
+        row_counts = self.db.execute_transaction(statements)
+        if row_counts is None:
+            logger.error(f"Failed to save payroll of {year}/{month}")
+            return None
+        if self.db.connection is None:
+            # Demo mode only simulates the writes
+            return len(rows)
+        saved = sum(row_counts[len(snapshot):])
+        if saved < len(rows):
+            logger.info(f"{len(rows) - saved} paid payroll rows of {year}/{month} left unchanged")
+        return saved
@@ -0,0 +1,150 @@
+"""What-if payroll simulation
+
+A month's personnel and inputs are loaded once; each scenario is then
+evaluated in memory against them, so trying many variations never queries
+or writes the database. Results are grouped per department (the
+personnel ``position``).
+
+Scenarios are evaluated with numpy arrays when numpy is installed and no
+custom rules are configured; otherwise each employee goes through the
+engine, which gives the same numbers more slowly.
+"""
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Mapping, Optional
+
+from payroll.engine import PayrollInputs, RateSnapshot, calculate_bulk
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+NO_DEPARTMENT = "بدون سمت"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """A parameter variation to simulate"""
+    name: str = "وضعیت فعلی"
+    base_salary_factor: float = 1.0
+    housing_allowance_rate: Optional[float] = None
+    family_allowance_rate: Optional[float] = None
+    # Overrides of RateSnapshot fields, e.g. {"insurance_employer": 0.25}
+    rates: Mapping[str, float] = field(default_factory=dict)
+
+
+class PayrollSimulation:
+    """Cached month inputs that scenarios are evaluated against"""
+
+    def __init__(self, personnel: List[Dict[str, Any]], inputs: PayrollInputs, rates: RateSnapshot):
+        self.personnel = personnel
+        self.inputs = inputs
+        self.rates = rates
+        self.departments = [personnel_row.get('position') or NO_DEPARTMENT for personnel_row in personnel]
+        if NUMPY_AVAILABLE:
+            self._build_arrays()
+
+    @classmethod
+    def load(cls, service, year: int, month: int) -> 'PayrollSimulation':
+        """Load all active personnel and their inputs for a month (read only)"""
+        personnel, _ = service.load_personnel(year, month, full=True, include_paid=True)
+        inputs = service.load_inputs([personnel_row['id'] for personnel_row in personnel], year, month)
+        return cls(personnel, inputs, service.rates_for(year))
+
+    def _build_arrays(self):
+        """Column arrays of the cached inputs"""
+        ids = [personnel_row['id'] for personnel_row in self.personnel]
+        self.base_salary = np.array([float(row['base_salary']) for row in self.personnel])
+        self.housing_rate = np.array([float(row['housing_allowance_rate']) for row in self.personnel])
+        self.family_rate = np.array([float(row['family_allowance_rate']) for row in self.personnel])
+        self.children = np.array([float(row['children_count'] or 0) for row in self.personnel])
+        self.overtime_hours = np.array([float(self.inputs.overtime_hours.get(i, 0)) for i in ids])
+        self.loan_deductions = np.array([float(self.inputs.loan_deductions.get(i, 0)) for i in ids])
+        self.advance_balances = np.array([float(self.inputs.advance_deductions.get(i, 0)) for i in ids])
+
+    def scenario_rates(self, scenario: Scenario) -> RateSnapshot:
+        """Rates of the cached month with a scenario's overrides"""
+        if not scenario.rates:
+            return self.rates
+        return replace(self.rates, **{key: float(value) for key, value in scenario.rates.items()})
+
+    def run(self, scenario: Scenario) -> Dict[str, Dict[str, float]]:
+        """Totals per department: headcount, gross, net and employer cost"""
+        rates = self.scenario_rates(scenario)
+        if NUMPY_AVAILABLE and not rates.rule_set:
+            gross, net, employer_cost = self._run_vectorized(scenario, rates)
+        else:
+            gross, net, employer_cost = self._run_engine(scenario, rates)
+
+        totals: Dict[str, Dict[str, float]] = {}
+        for department, gross_salary, net_salary, cost in zip(self.departments, gross, net, employer_cost):
+            department_totals = totals.setdefault(department, {
+                'headcount': 0, 'gross_salary': 0.0, 'net_salary': 0.0, 'employer_cost': 0.0
+            })
+            department_totals['headcount'] += 1
+            department_totals['gross_salary'] += float(gross_salary)
+            department_totals['net_salary'] += float(net_salary)
+            department_totals['employer_cost'] += float(cost)
+        return totals
+
+    def _run_vectorized(self, scenario: Scenario, rates: RateSnapshot):
+        """The engine's formulas over whole columns"""
+        base_salary = self.base_salary * scenario.base_salary_factor
+        housing_rate = self.housing_rate if scenario.housing_allowance_rate is None else scenario.housing_allowance_rate
+        family_rate = self.family_rate if scenario.family_allowance_rate is None else scenario.family_allowance_rate
+
+        gross = (base_salary + base_salary * housing_rate + base_salary * family_rate
+                 + rates.child_allowance * self.children
+                 + self.overtime_hours * base_salary / rates.monthly_work_hours * rates.overtime_multiplier)
+        insurance_employee = gross * rates.insurance_employee
+        tax = rates.tax_table.tax_array(gross - insurance_employee)
+        net_before_advances = gross - insurance_employee - tax - self.loan_deductions
+        advance_deduction = np.minimum(self.advance_balances,
+                                       np.maximum(net_before_advances, 0) * rates.advance_deduction_cap)
+        net = net_before_advances - advance_deduction
+        employer_cost = gross + gross * rates.insurance_employer
+        return gross, net, employer_cost
+
+    def _run_engine(self, scenario: Scenario, rates: RateSnapshot):
+        """Per-employee evaluation through the engine (custom rules or no numpy)"""
+        personnel = []
+        for row in self.personnel:
+            row = dict(row)
+            row['base_salary'] = float(row['base_salary']) * scenario.base_salary_factor
+            if scenario.housing_allowance_rate is not None:
+                row['housing_allowance_rate'] = scenario.housing_allowance_rate
+            if scenario.family_allowance_rate is not None:
+                row['family_allowance_rate'] = scenario.family_allowance_rate
+            personnel.append(row)
+
+        results, errors = calculate_bulk(personnel, self.inputs, rates)
+        if errors:
+            raise ValueError(f"Cannot simulate {len(errors)} employees, e.g. {next(iter(errors.values()))}")
+
+        gross = [result['gross_salary'] for result in results]
+        net = [result['net_salary'] for result in results]
+        employer_cost = [result['gross_salary'] + result['insurance_employer'] for result in results]
+        return gross, net, employer_cost
+
+    def compare(self, scenarios: List[Scenario],
+                baseline: Optional[Scenario] = None) -> List[Dict[str, Any]]:
+        """Run scenarios and report each department's change against the baseline"""
+        baseline_totals = self.run(baseline or Scenario())
+        comparisons = []
+        for scenario in scenarios:
+            totals = self.run(scenario)
+            departments = {}
+            for department, base in baseline_totals.items():
+                simulated = totals[department]
+                delta = simulated['employer_cost'] - base['employer_cost']
+                departments[department] = {
+                    'headcount': base['headcount'],
+                    'baseline_cost': base['employer_cost'],
+                    'simulated_cost': simulated['employer_cost'],
+                    'cost_delta': delta,
+                    'cost_delta_percent': delta / base['employer_cost'] * 100 if base['employer_cost'] else 0.0,
+                    'net_delta': simulated['net_salary'] - base['net_salary']
+                }
+            comparisons.append({'scenario': scenario, 'departments': departments})
+        return comparisons
@@ -0,0 +1,98 @@
+"""Progressive payroll tax tables
+
+A table is a list of (lower bound, rate) brackets for one fiscal year, in
+monthly Rials: income above a bound is taxed at its rate up to the next
+bound. The tax owed at every bound is precomputed, so the tax of any income
+is one binary search plus one multiply-add.
+"""
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+Brackets = Tuple[Tuple[float, float], ...]
+
+
+class TaxTable:
+    """Brackets of one fiscal year with cumulative tax at each lower bound"""
+
+    def __init__(self, brackets: Iterable[Sequence[float]]):
+        brackets = sorted((float(bound), float(rate)) for bound, rate in brackets)
+        if not brackets:
+            raise ValueError("A tax table needs at least one bracket")
+
+        bounds = [bound for bound, _ in brackets]
+        rates = [rate for _, rate in brackets]
+        if bounds[0] < 0 or len(set(bounds)) != len(bounds):
+            raise ValueError("Tax bracket bounds must be distinct and not negative")
+        if any(not 0 <= rate <= 1 for rate in rates):
+            raise ValueError("Tax rates must be between 0 and 1")
+
+        cumulative = [0.0]
+        for i in range(1, len(bounds)):
+            cumulative.append(cumulative[-1] + (bounds[i] - bounds[i - 1]) * rates[i - 1])
+
+        self.bounds = bounds
+        self.rates = rates
+        self.cumulative = cumulative
+
+        if NUMPY_AVAILABLE:
+            self._bounds_array = np.array(bounds)
+            self._rates_array = np.array(rates)
+            self._cumulative_array = np.array(cumulative)
+
+    def tax(self, income: float) -> float:
+        """Tax owed on a monthly taxable income"""
+        i = bisect_right(self.bounds, income) - 1
+        if i < 0:
+            return 0.0
+        return self.cumulative[i] + (income - self.bounds[i]) * self.rates[i]
+
+    def tax_array(self, incomes):
+        """Tax of many incomes at once (a numpy array when numpy is installed)"""
+        if not NUMPY_AVAILABLE:
+            return [self.tax(income) for income in incomes]
+
+        incomes = np.asarray(incomes, dtype=float)
+        indexes = np.searchsorted(self._bounds_array, incomes, side='right') - 1
+        below = indexes < 0
+        indexes = np.maximum(indexes, 0)
+        taxes = (self._cumulative_array[indexes]
+                 + (incomes - self._bounds_array[indexes]) * self._rates_array[indexes])
+        taxes[below] = 0.0
+        return taxes
+
+    def __repr__(self) -> str:
+        return f"TaxTable({list(zip(self.bounds, self.rates))})"
+
+
+@lru_cache(maxsize=32)
+def get_tax_table(brackets: Brackets) -> TaxTable:
+    """Shared, cached table for a bracket tuple"""
+    return TaxTable(brackets)
+
+
+def flat_brackets(threshold: float, rate: float) -> Brackets:
+    """Single bracket above an exemption threshold (the original tax rule)"""
+    return ((0.0, 0.0), (float(threshold), float(rate)))
+
+
+def brackets_for_year(settings: Mapping[str, Any], year: Optional[int]) -> Optional[Brackets]:
+    """Brackets of a fiscal year from the calculation settings, if configured
+
+    Settings hold ``"tax_brackets": {"1403": [[bound, rate], ...], ...}``.
+    A year without its own table uses the latest earlier one.
+    """
+    tables: Dict[str, List] = settings.get('tax_brackets') or {}
+    if not tables or year is None:
+        return None
+
+    years = sorted(int(table_year) for table_year in tables if int(table_year) <= year)
+    if not years:
+        return None
+    return tuple((float(bound), float(rate)) for bound, rate in tables[str(years[-1])])
@@ -1,14 +1,15 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-                            QPushButton, QTableWidget, QTableWidgetItem,
+                            QPushButton, QTableWidget,
                             QLineEdit, QComboBox, QDateEdit, QDoubleSpinBox,
                             QCheckBox, QTabWidget, QHeaderView, QMessageBox,
                             QFormLayout, QGroupBox)
-from PyQt6.QtCore import QDate, Qt
+from PyQt6.QtCore import QDate, Qt, QTimer
 from widgets.modern_button import ModernButton
 from widgets.modern_input import ModernInput
-from widgets.modern_table import ModernTable
+from widgets.modern_table_view import ModernTableView
+from widgets.paged_table_model import PagedTableModel
 from database.database_manager import DatabaseManager
-from utils.date_converter import DateConverter
+from database.keyset_pager import KeysetPager
 from utils.font_manager import FontManager
 import logging
 
@@ -74,10 +75,16 @@ class AdvancesWindow(QWidget):
         """Setup filter section"""
         filter_layout = QHBoxLayout()
         
+        # Coalesce rapid combo changes into a single query
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.filter_advances)
+        
         # Status filter
         self.status_filter = QComboBox()
         self.status_filter.addItems(["همه", "تسویه نشده", "تسویه شده"])
-        self.status_filter.currentTextChanged.connect(self.filter_advances)
+        self.status_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("وضعیت:"))
         filter_layout.addWidget(self.status_filter)
         
@@ -85,7 +92,7 @@ class AdvancesWindow(QWidget):
         self.personnel_filter = QComboBox()
         self.personnel_filter.addItem("همه پرسنل")
         self.load_personnel_filter()
-        self.personnel_filter.currentTextChanged.connect(self.filter_advances)
+        self.personnel_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("پرسنل:"))
         filter_layout.addWidget(self.personnel_filter)
         
@@ -94,12 +101,20 @@ class AdvancesWindow(QWidget):
     
     def setup_advances_table(self, layout: QVBoxLayout):
         """Setup advances table"""
-        self.advances_table = ModernTable()
-        self.advances_table.setColumnCount(8)
-        self.advances_table.setHorizontalHeaderLabels([
-            "عملیات", "کد پرسنلی", "نام و نام خانوادگی", "مبلغ مساعده", 
-            "تاریخ مساعده", "وضعیت تسویه", "توضیحات", "تاریخ ثبت"
-        ])
+        self.advances_model = PagedTableModel([
+            ("عملیات", None),
+            ("کد پرسنلی", lambda row: str(row['employee_code'])),
+            ("نام و نام خانوادگی", lambda row: f"{row['first_name']} {row['last_name']}"),
+            ("مبلغ مساعده", lambda row: f"{row['advance_amount']:,.0f}"),
+            ("تاریخ مساعده", lambda row: PagedTableModel.format_date(row['advance_date'])),
+            ("وضعیت تسویه", lambda row: "تسویه شده" if row['is_settled'] else "تسویه نشده"),
+            ("توضیحات", lambda row: row['description'] or ''),
+            ("تاریخ ثبت", lambda row: PagedTableModel.format_date(row['created_at']))
+        ], self)
+        
+        self.advances_table = ModernTableView()
+        self.advances_table.setModel(self.advances_model)
+        self.advances_table.set_row_actions(self.edit_advance, self.delete_advance)
         
         # Set column widths
         header = self.advances_table.horizontalHeader()
@@ -189,68 +204,43 @@ class AdvancesWindow(QWidget):
         except Exception as e:
             logger.error(f"Error loading personnel combo: {e}")
     
+    def get_filter_conditions(self) -> tuple:
+        """Build WHERE conditions and parameters from the filter combos"""
+        conditions = []
+        params = []
+        
+        personnel_id = self.personnel_filter.currentData()
+        if personnel_id is not None:
+            conditions.append("a.personnel_id = %s")
+            params.append(personnel_id)
+        
+        # 1 = unsettled, 2 = settled
+        status = self.status_filter.currentIndex()
+        if status > 0:
+            conditions.append("a.is_settled = %s")
+            params.append(status == 2)
+        
+        return conditions, tuple(params)
+    
     def load_advances_data(self):
-        """Load advances data from database"""
+        """Load advances data from database, one page at a time"""
+        # A pending filter change is superseded by this load
+        self.filter_timer.stop()
         try:
-            query = """
+            conditions, params = self.get_filter_conditions()
+            pager = KeysetPager(
+                self.db,
+                """
                 SELECT a.*, p.employee_code, p.first_name, p.last_name
                 FROM advances a
                 JOIN personnel p ON a.personnel_id = p.id
-                ORDER BY a.created_at DESC
-            """
-            results = self.db.fetch_all(query)
-            
-            self.advances_table.setRowCount(0)
-            
-            for row_data in results:
-                row_position = self.advances_table.rowCount()
-                self.advances_table.insertRow(row_position)
-                
-                # Action buttons
-                action_widget = QWidget()
-                action_layout = QHBoxLayout(action_widget)
-                action_layout.setContentsMargins(5, 2, 5, 2)
-                
-                edit_btn = ModernButton("✏️")
-                edit_btn.setFixedSize(30, 30)
-                edit_btn.clicked.connect(lambda checked, id=row_data['id']: self.edit_advance(id))
-                
-                delete_btn = ModernButton("🗑️")
-                delete_btn.setFixedSize(30, 30)
-                delete_btn.clicked.connect(lambda checked, id=row_data['id']: self.delete_advance(id))
-                
-                action_layout.addWidget(edit_btn)
-                action_layout.addWidget(delete_btn)
-                action_layout.addStretch()
-                
-                self.advances_table.setCellWidget(row_position, 0, action_widget)
-                self.advances_table.setItem(row_position, 1, QTableWidgetItem(str(row_data['employee_code'])))
-                self.advances_table.setItem(row_position, 2, QTableWidgetItem(f"{row_data['first_name']} {row_data['last_name']}"))
-                self.advances_table.setItem(row_position, 3, QTableWidgetItem(f"{row_data['advance_amount']:,.0f}"))
-                
-                # Handle date conversion safely
-                try:
-                    if row_data['advance_date']:
-                        date_str = DateConverter.gregorian_to_jalali_str(row_data['advance_date'])
-                    else:
-                        date_str = ''
-                except:
-                    date_str = str(row_data['advance_date']) if row_data['advance_date'] else ''
-                
-                self.advances_table.setItem(row_position, 4, QTableWidgetItem(date_str))
-                self.advances_table.setItem(row_position, 5, QTableWidgetItem("تسویه شده" if row_data['is_settled'] else "تسویه نشده"))
-                self.advances_table.setItem(row_position, 6, QTableWidgetItem(row_data['description'] or ''))
-                
-                # Handle created_at date
-                try:
-                    if row_data['created_at']:
-                        created_str = DateConverter.gregorian_to_jalali_str(row_data['created_at'])
-                    else:
-                        created_str = ''
-                except:
-                    created_str = str(row_data['created_at']) if row_data['created_at'] else ''
-                
-                self.advances_table.setItem(row_position, 7, QTableWidgetItem(created_str))
+                """,
+                key_columns=['a.created_at', 'a.id'],
+                key_fields=['created_at', 'id'],
+                conditions=conditions,
+                params=params
+            )
+            self.advances_model.set_pager(pager)
                 
         except Exception as e:
             logger.error(f"Error loading advances data: {e}")
@@ -274,8 +264,7 @@ class AdvancesWindow(QWidget):
     
     def filter_advances(self):
         """Filter advances based on criteria"""
-        # Implementation for filtering
-        pass
+        self.load_advances_data()
     
     def show_add_dialog(self):
         """Show add advance dialog"""
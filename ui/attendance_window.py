@@ -3,11 +3,14 @@ from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
                             QLineEdit, QComboBox, QDateEdit, QDoubleSpinBox,
                             QCheckBox, QTabWidget, QHeaderView, QMessageBox,
                             QFormLayout, QGroupBox, QCalendarWidget)
-from PyQt6.QtCore import QDate, Qt
+from PyQt6.QtCore import QDate, Qt, QTimer
 from widgets.modern_button import ModernButton
 from widgets.modern_input import ModernInput
 from widgets.modern_table import ModernTable
+from widgets.modern_table_view import ModernTableView
+from widgets.paged_table_model import PagedTableModel
 from database.database_manager import DatabaseManager
+from database.keyset_pager import KeysetPager
 from utils.date_converter import DateConverter
 from utils.font_manager import FontManager
 import logging
@@ -82,11 +85,17 @@ class AttendanceWindow(QWidget):
         """Setup filter section"""
         filter_layout = QHBoxLayout()
         
+        # Coalesce rapid combo changes into a single query
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.filter_attendance)
+        
         # Month filter
         self.month_filter = QComboBox()
         months = ["همه ماه‌ها"] + [f"{i} - {DateConverter.get_jalali_month_name(i)}" for i in range(1, 13)]
         self.month_filter.addItems(months)
-        self.month_filter.currentTextChanged.connect(self.filter_attendance)
+        self.month_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("ماه:"))
         filter_layout.addWidget(self.month_filter)
         
@@ -95,7 +104,7 @@ class AttendanceWindow(QWidget):
         current_year = DateConverter.get_current_jalali_date().year
         years = ["همه سال‌ها"] + [str(year) for year in range(current_year-2, current_year+1)]
         self.year_filter.addItems(years)
-        self.year_filter.currentTextChanged.connect(self.filter_attendance)
+        self.year_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("سال:"))
         filter_layout.addWidget(self.year_filter)
         
@@ -103,7 +112,7 @@ class AttendanceWindow(QWidget):
         self.personnel_filter = QComboBox()
         self.personnel_filter.addItem("همه پرسنل")
         self.load_personnel_filter()
-        self.personnel_filter.currentTextChanged.connect(self.filter_attendance)
+        self.personnel_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("پرسنل:"))
         filter_layout.addWidget(self.personnel_filter)
         
@@ -112,13 +121,21 @@ class AttendanceWindow(QWidget):
     
     def setup_attendance_table(self, layout: QVBoxLayout):
         """Setup attendance table"""
-        self.attendance_table = ModernTable()
-        self.attendance_table.setColumnCount(9)
-        self.attendance_table.setHorizontalHeaderLabels([
-            "عملیات", "کد پرسنلی", "نام و نام خانوادگی", "تاریخ", 
-            "ساعت ورود", "ساعت خروج", "اضافه کاری (ساعت)", 
-            "نوع حضور", "توضیحات"
-        ])
+        self.attendance_model = PagedTableModel([
+            ("عملیات", None),
+            ("کد پرسنلی", lambda row: str(row['employee_code'])),
+            ("نام و نام خانوادگی", lambda row: f"{row['first_name']} {row['last_name']}"),
+            ("تاریخ", lambda row: PagedTableModel.format_date(row['date'])),
+            ("ساعت ورود", lambda row: str(row['entry_time'] or '')),
+            ("ساعت خروج", lambda row: str(row['exit_time'] or '')),
+            ("اضافه کاری (ساعت)", lambda row: str(row['overtime_hours'])),
+            ("نوع حضور", lambda row: row['absence_type']),
+            ("توضیحات", lambda row: row['description'] or '')
+        ], self)
+        
+        self.attendance_table = ModernTableView()
+        self.attendance_table.setModel(self.attendance_model)
+        self.attendance_table.set_row_actions(self.edit_attendance, self.delete_attendance)
         
         # Set column widths
         header = self.attendance_table.horizontalHeader()
@@ -274,59 +291,62 @@ class AttendanceWindow(QWidget):
         except Exception as e:
             logger.error(f"Error loading personnel combo: {e}")
     
+    def get_filter_conditions(self) -> tuple:
+        """Build WHERE conditions and parameters from the filter combos"""
+        conditions = []
+        params = []
+        
+        personnel_id = self.personnel_filter.currentData()
+        if personnel_id is not None:
+            conditions.append("a.personnel_id = %s")
+            params.append(personnel_id)
+        
+        # Month/year become Gregorian date ranges so the date index can be used
+        month = self.month_filter.currentIndex() or None
+        if self.year_filter.currentIndex() > 0:
+            years = [int(self.year_filter.currentText())]
+        elif month is not None:
+            years = self.attendance_years()
+        else:
+            years = []
+        
+        ranges = []
+        for year in years:
+            ranges.append("(a.date >= %s AND a.date < %s)")
+            params.extend(DateConverter.jalali_period_range(year, month))
+        if ranges:
+            conditions.append("(" + " OR ".join(ranges) + ")")
+        
+        return conditions, tuple(params)
+    
+    def attendance_years(self) -> list:
+        """Jalali years spanned by the stored attendance, oldest first"""
+        row = self.db.fetch_one("SELECT MIN(date) AS first_date, MAX(date) AS last_date FROM attendance")
+        if not row or not row.get('first_date') or not row.get('last_date'):
+            return []
+        first_year = DateConverter.gregorian_to_jalali(row['first_date']).year
+        last_year = DateConverter.gregorian_to_jalali(row['last_date']).year
+        return list(range(first_year, last_year + 1))
+    
     def load_attendance_data(self):
-        """Load attendance data from database"""
+        """Load attendance data from database, one page at a time"""
+        # A pending filter change is superseded by this load
+        self.filter_timer.stop()
         try:
-            query = """
+            conditions, params = self.get_filter_conditions()
+            pager = KeysetPager(
+                self.db,
+                """
                 SELECT a.*, p.employee_code, p.first_name, p.last_name
                 FROM attendance a
                 JOIN personnel p ON a.personnel_id = p.id
-                ORDER BY a.date DESC
-            """
-            results = self.db.fetch_all(query)
-            
-            self.attendance_table.setRowCount(0)
-            
-            for row_data in results:
-                row_position = self.attendance_table.rowCount()
-                self.attendance_table.insertRow(row_position)
-                
-                # Action buttons
-                action_widget = QWidget()
-                action_layout = QHBoxLayout(action_widget)
-                action_layout.setContentsMargins(5, 2, 5, 2)
-                
-                edit_btn = ModernButton("✏️")
-                edit_btn.setFixedSize(30, 30)
-                edit_btn.clicked.connect(lambda checked, id=row_data['id']: self.edit_attendance(id))
-                
-                delete_btn = ModernButton("🗑️")
-                delete_btn.setFixedSize(30, 30)
-                delete_btn.clicked.connect(lambda checked, id=row_data['id']: self.delete_attendance(id))
-                
-                action_layout.addWidget(edit_btn)
-                action_layout.addWidget(delete_btn)
-                action_layout.addStretch()
-                
-                self.attendance_table.setCellWidget(row_position, 0, action_widget)
-                self.attendance_table.setItem(row_position, 1, QTableWidgetItem(str(row_data['employee_code'])))
-                self.attendance_table.setItem(row_position, 2, QTableWidgetItem(f"{row_data['first_name']} {row_data['last_name']}"))
-                
-                # Handle date conversion safely
-                try:
-                    if row_data['date']:
-                        date_str = DateConverter.gregorian_to_jalali_str(row_data['date'])
-                    else:
-                        date_str = ''
-                except:
-                    date_str = str(row_data['date']) if row_data['date'] else ''
-                
-                self.attendance_table.setItem(row_position, 3, QTableWidgetItem(date_str))
-                self.attendance_table.setItem(row_position, 4, QTableWidgetItem(str(row_data['entry_time'] or '')))
-                self.attendance_table.setItem(row_position, 5, QTableWidgetItem(str(row_data['exit_time'] or '')))
-                self.attendance_table.setItem(row_position, 6, QTableWidgetItem(str(row_data['overtime_hours'])))
-                self.attendance_table.setItem(row_position, 7, QTableWidgetItem(row_data['absence_type']))
-                self.attendance_table.setItem(row_position, 8, QTableWidgetItem(row_data['description'] or ''))
+                """,
+                key_columns=['a.date', 'a.id'],
+                key_fields=['date', 'id'],
+                conditions=conditions,
+                params=params
+            )
+            self.attendance_model.set_pager(pager)
                 
         except Exception as e:
             logger.error(f"Error loading attendance data: {e}")
@@ -350,8 +370,7 @@ class AttendanceWindow(QWidget):
     
     def filter_attendance(self):
         """Filter attendance based on criteria"""
-        # Implementation for filtering
-        pass
+        self.load_attendance_data()
     
     def show_add_dialog(self):
         """Show add attendance dialog"""
@@ -0,0 +1,89 @@
+from PyQt6.QtCore import QObject, QTimer
+from database.backup import BACKUP_LOCK, apply_retention, backup_due, next_backup_kind
+from ui.backup_worker import BackupWorker
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+# Minutes between checks whether a backup is due
+CHECK_INTERVAL_MINUTES = 15
+# Delay of the first check, so startup is not slowed down
+FIRST_CHECK_SECONDS = 60
+DEFAULT_RETENTION = 10
+# Days after which a full backup is written instead of a differential one
+DEFAULT_FULL_BACKUP_INTERVAL = 30
+
+class BackupScheduler(QObject):
+    """Runs automatic backups when the configured interval has passed
+
+    Settings are re-read from settings.json at every check, so changes made
+    in the settings window apply without a restart. Between full backups
+    (every full_backup_interval days) only differential ones are written.
+    Backups run in a low-priority worker thread; a check is skipped while
+    any backup (manual or scheduled) is running.
+    """
+
+    def __init__(self, config_path: str = 'config/settings.json', parent=None):
+        super().__init__(parent)
+        self.config_path = config_path
+        self.worker = None
+        self.backup_dir = None
+        self.retention = DEFAULT_RETENTION
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.check)
+
+    def start(self):
+        QTimer.singleShot(FIRST_CHECK_SECONDS * 1000, self.check)
+        self.timer.start(CHECK_INTERVAL_MINUTES * 60 * 1000)
+
+    def stop(self):
+        """Stop checking and wait for a running backup to finish"""
+        self.timer.stop()
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.wait()
+
+    def load_config(self) -> dict:
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading config: {e}")
+            return {}
+
+    def check(self):
+        """Start a backup if one is due and none is running"""
+        if not self.timer.isActive() or BACKUP_LOCK.locked():
+            return
+        if self.worker is not None and self.worker.isRunning():
+            return
+
+        config = self.load_config()
+        app_config = config.get('application', {})
+        if not app_config.get('auto_backup', False):
+            return
+
+        backup_dir = app_config.get('backup_path', './backups')
+        try:
+            if not backup_due(backup_dir, app_config.get('backup_interval', 7)):
+                return
+            kind = next_backup_kind(backup_dir, app_config.get('full_backup_interval', DEFAULT_FULL_BACKUP_INTERVAL))
+        except Exception as e:
+            logger.error(f"Error checking backups in {backup_dir}: {e}")
+            return
+
+        logger.info(f"Automatic {kind} backup due, writing to {backup_dir}")
+        self.retention = app_config.get('backup_retention', DEFAULT_RETENTION)
+        self.backup_dir = backup_dir
+        self.worker = BackupWorker(config.get('database', {}), backup_dir, self, low_priority=True, kind=kind)
+        self.worker.finished_backup.connect(self.backup_finished)
+        self.worker.failed.connect(lambda message: logger.error(f"Automatic backup failed: {message}"))
+        self.worker.start()
+
+    def backup_finished(self, manifest: dict):
+        """Prune old backups once a new one is verified"""
+        logger.info(f"Automatic backup written: {manifest['path']}")
+        try:
+            apply_retention(self.backup_dir, self.retention)
+        except Exception as e:
+            logger.error(f"Error removing old backups: {e}")
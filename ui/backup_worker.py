@@ -0,0 +1,74 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+from database.backup import create_backup
+from database.restore import restore_backup
+from database.database_manager import DatabaseManager
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class BackupWorker(QThread):
+    """Writes a database backup off the UI thread"""
+
+    # bytes written, fraction done (None when unknown), bytes per second
+    progress = pyqtSignal(int, object, float)
+    finished_backup = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, config: dict, backup_dir: str, parent=None, low_priority: bool = False,
+                 kind: str = 'full'):
+        super().__init__(parent)
+        self.config = config
+        self.backup_dir = backup_dir
+        self.low_priority = low_priority
+        self.kind = kind
+        self.start_time = 0.0
+
+    def run(self):
+        """Back up the database, or the demo data when no server is reachable"""
+        self.start_time = time.perf_counter()
+        try:
+            db = DatabaseManager(self.config)
+            connected = db.connect() and db.connection is not None
+            db.disconnect()
+            demo_data = None if connected else db.demo_data
+
+            manifest = create_backup(self.config, self.backup_dir, self.report_progress, demo_data,
+                                     self.low_priority, self.kind)
+            self.finished_backup.emit(manifest)
+        except Exception as e:
+            logger.error(f"Error creating backup: {e}")
+            self.failed.emit(str(e))
+
+    def report_progress(self, written: int, fraction):
+        elapsed = time.perf_counter() - self.start_time
+        self.progress.emit(written, fraction, written / elapsed if elapsed > 0 else 0.0)
+
+
+class RestoreWorker(QThread):
+    """Validates and restores a backup off the UI thread"""
+
+    # table or index being restored, steps done, total steps
+    progress = pyqtSignal(str, int, int)
+    finished_restore = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, config: dict, backup_path: str, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self.backup_path = backup_path
+
+    def run(self):
+        """Restore into the configured database with its own connection"""
+        db = DatabaseManager(self.config)
+        try:
+            if not db.connect() or db.connection is None:
+                self.failed.emit("اتصال به پایگاه داده برقرار نشد")
+                return
+            manifest = restore_backup(db, self.backup_path, self.progress.emit)
+            self.finished_restore.emit(manifest)
+        except Exception as e:
+            logger.error(f"Error restoring backup: {e}")
+            self.failed.emit(str(e))
+        finally:
+            db.disconnect()
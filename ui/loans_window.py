@@ -1,13 +1,15 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-                            QPushButton, QTableWidget, QTableWidgetItem,
+                            QPushButton, QTableWidget,
                             QLineEdit, QComboBox, QDateEdit, QDoubleSpinBox,
                             QSpinBox, QCheckBox, QTabWidget, QHeaderView, 
                             QMessageBox, QFormLayout, QGroupBox)
-from PyQt6.QtCore import QDate, Qt
+from PyQt6.QtCore import QDate, Qt, QTimer
 from widgets.modern_button import ModernButton
 from widgets.modern_input import ModernInput
-from widgets.modern_table import ModernTable
+from widgets.modern_table_view import ModernTableView
+from widgets.paged_table_model import PagedTableModel
 from database.database_manager import DatabaseManager
+from database.keyset_pager import KeysetPager
 from utils.date_converter import DateConverter
 from utils.font_manager import FontManager
 import logging
@@ -74,10 +76,16 @@ class LoansWindow(QWidget):
         """Setup filter section"""
         filter_layout = QHBoxLayout()
         
+        # Coalesce rapid combo changes into a single query
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.filter_loans)
+        
         # Status filter
         self.status_filter = QComboBox()
         self.status_filter.addItems(["همه", "فعال", "تسویه شده"])
-        self.status_filter.currentTextChanged.connect(self.filter_loans)
+        self.status_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("وضعیت:"))
         filter_layout.addWidget(self.status_filter)
         
@@ -85,7 +93,7 @@ class LoansWindow(QWidget):
         self.personnel_filter = QComboBox()
         self.personnel_filter.addItem("همه پرسنل")
         self.load_personnel_filter()
-        self.personnel_filter.currentTextChanged.connect(self.filter_loans)
+        self.personnel_filter.currentIndexChanged.connect(lambda: self.filter_timer.start())
         filter_layout.addWidget(QLabel("پرسنل:"))
         filter_layout.addWidget(self.personnel_filter)
         
@@ -94,13 +102,22 @@ class LoansWindow(QWidget):
     
     def setup_loans_table(self, layout: QVBoxLayout):
         """Setup loans table"""
-        self.loans_table = ModernTable()
-        self.loans_table.setColumnCount(10)
-        self.loans_table.setHorizontalHeaderLabels([
-            "عملیات", "کد پرسنلی", "نام و نام خانوادگی", "مبلغ وام", 
-            "تعداد اقساط", "اقساط باقیمانده", "مبلغ قسط", 
-            "تاریخ شروع", "وضعیت", "توضیحات"
-        ])
+        self.loans_model = PagedTableModel([
+            ("عملیات", None),
+            ("کد پرسنلی", lambda row: str(row['employee_code'])),
+            ("نام و نام خانوادگی", lambda row: f"{row['first_name']} {row['last_name']}"),
+            ("مبلغ وام", lambda row: f"{row['loan_amount']:,.0f}"),
+            ("تعداد اقساط", lambda row: str(row['total_installments'])),
+            ("اقساط باقیمانده", lambda row: str(row['remaining_installments'])),
+            ("مبلغ قسط", lambda row: f"{row['installment_amount']:,.0f}"),
+            ("تاریخ شروع", lambda row: PagedTableModel.format_date(row['start_date'])),
+            ("وضعیت", lambda row: "فعال" if row['is_active'] else "تسویه شده"),
+            ("توضیحات", lambda row: row['description'] or '')
+        ], self)
+        
+        self.loans_table = ModernTableView()
+        self.loans_table.setModel(self.loans_model)
+        self.loans_table.set_row_actions(self.edit_loan, self.delete_loan)
         
         # Set column widths
         header = self.loans_table.horizontalHeader()
@@ -211,60 +228,43 @@ class LoansWindow(QWidget):
         except Exception as e:
             logger.error(f"Error loading personnel combo: {e}")
     
+    def get_filter_conditions(self) -> tuple:
+        """Build WHERE conditions and parameters from the filter combos"""
+        conditions = []
+        params = []
+        
+        personnel_id = self.personnel_filter.currentData()
+        if personnel_id is not None:
+            conditions.append("l.personnel_id = %s")
+            params.append(personnel_id)
+        
+        # 1 = active, 2 = settled
+        status = self.status_filter.currentIndex()
+        if status > 0:
+            conditions.append("l.is_active = %s")
+            params.append(status == 1)
+        
+        return conditions, tuple(params)
+    
     def load_loans_data(self):
-        """Load loans data from database"""
+        """Load loans data from database, one page at a time"""
+        # A pending filter change is superseded by this load
+        self.filter_timer.stop()
         try:
-            query = """
+            conditions, params = self.get_filter_conditions()
+            pager = KeysetPager(
+                self.db,
+                """
                 SELECT l.*, p.employee_code, p.first_name, p.last_name
                 FROM loans l
                 JOIN personnel p ON l.personnel_id = p.id
-                ORDER BY l.created_at DESC
-            """
-            results = self.db.fetch_all(query)
-            
-            self.loans_table.setRowCount(0)
-            
-            for row_data in results:
-                row_position = self.loans_table.rowCount()
-                self.loans_table.insertRow(row_position)
-                
-                # Action buttons
-                action_widget = QWidget()
-                action_layout = QHBoxLayout(action_widget)
-                action_layout.setContentsMargins(5, 2, 5, 2)
-                
-                edit_btn = ModernButton("✏️")
-                edit_btn.setFixedSize(30, 30)
-                edit_btn.clicked.connect(lambda checked, id=row_data['id']: self.edit_loan(id))
-                
-                delete_btn = ModernButton("🗑️")
-                delete_btn.setFixedSize(30, 30)
-                delete_btn.clicked.connect(lambda checked, id=row_data['id']: self.delete_loan(id))
-                
-                action_layout.addWidget(edit_btn)
-                action_layout.addWidget(delete_btn)
-                action_layout.addStretch()
-                
-                self.loans_table.setCellWidget(row_position, 0, action_widget)
-                self.loans_table.setItem(row_position, 1, QTableWidgetItem(str(row_data['employee_code'])))
-                self.loans_table.setItem(row_position, 2, QTableWidgetItem(f"{row_data['first_name']} {row_data['last_name']}"))
-                self.loans_table.setItem(row_position, 3, QTableWidgetItem(f"{row_data['loan_amount']:,.0f}"))
-                self.loans_table.setItem(row_position, 4, QTableWidgetItem(str(row_data['total_installments'])))
-                self.loans_table.setItem(row_position, 5, QTableWidgetItem(str(row_data['remaining_installments'])))
-                self.loans_table.setItem(row_position, 6, QTableWidgetItem(f"{row_data['installment_amount']:,.0f}"))
-                
-                # Handle date conversion safely
-                try:
-                    if row_data['start_date']:
-                        date_str = DateConverter.gregorian_to_jalali_str(row_data['start_date'])
-                    else:
-                        date_str = ''
-                except:
-                    date_str = str(row_data['start_date']) if row_data['start_date'] else ''
-                
-                self.loans_table.setItem(row_position, 7, QTableWidgetItem(date_str))
-                self.loans_table.setItem(row_position, 8, QTableWidgetItem("فعال" if row_data['is_active'] else "تسویه شده"))
-                self.loans_table.setItem(row_position, 9, QTableWidgetItem(row_data['description'] or ''))
+                """,
+                key_columns=['l.created_at', 'l.id'],
+                key_fields=['created_at', 'id'],
+                conditions=conditions,
+                params=params
+            )
+            self.loans_model.set_pager(pager)
                 
         except Exception as e:
             logger.error(f"Error loading loans data: {e}")
@@ -288,8 +288,7 @@ class LoansWindow(QWidget):
     
     def filter_loans(self):
         """Filter loans based on criteria"""
-        # Implementation for filtering
-        pass
+        self.load_loans_data()
     
     def show_add_dialog(self):
         """Show add loan dialog"""
@@ -373,27 +372,46 @@ class LoansWindow(QWidget):
                 'is_active': self.is_active_checkbox.isChecked()
             }
             
+            # Installments fall due monthly from the Jalali month of the start date
+            start = DateConverter.gregorian_to_jalali(self.start_date_input.date().toPyDate())
+            first_period = start.year * 12 + start.month - 1
+            
             if self.selected_loan_id:
-                # Update existing loan
-                query = """
+                # Update existing loan; paid installments stay, the rest are rescheduled
+                paid_count = "(SELECT COUNT(*) FROM loan_installments WHERE loan_id = %s AND status = 'paid')"
+                query = f"""
                     UPDATE loans SET 
                     personnel_id = %s, loan_amount = %s, installment_amount = %s,
-                    remaining_installments = %s, total_installments = %s, start_date = %s,
+                    remaining_installments = GREATEST(%s - {paid_count}, 0), total_installments = %s, start_date = %s,
                     description = %s, is_active = %s
                     WHERE id = %s
                 """
-                params = tuple(loan_data.values()) + (self.selected_loan_id,)
+                values = tuple(loan_data.values())
+                params = values[:4] + (self.selected_loan_id,) + values[4:] + (self.selected_loan_id,)
+                schedule_query = self.db.loan_schedule_insert_sql(
+                    "(SELECT * FROM loans WHERE id = %s)", "%s",
+                    "(SELECT COUNT(*) + 1 FROM loan_installments WHERE loan_id = l.id AND status = 'paid')"
+                )
+                saved = self.db.execute_transaction([
+                    (query, params),
+                    ("DELETE FROM loan_installments WHERE loan_id = %s AND status = 'due'", (self.selected_loan_id,)),
+                    (schedule_query, (first_period, first_period, self.selected_loan_id))
+                ]) is not None
             else:
-                # Insert new loan
+                # Insert new loan together with its installment schedule
                 query = """
-                    INSERT INTO loans 
-                    (personnel_id, loan_amount, installment_amount, remaining_installments,
-                     total_installments, start_date, description, is_active)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                params = tuple(loan_data.values())
+                    WITH new_loan AS (
+                        INSERT INTO loans 
+                        (personnel_id, loan_amount, installment_amount, remaining_installments,
+                         total_installments, start_date, description, is_active)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING *
+                    )
+                """ + self.db.loan_schedule_insert_sql("new_loan", "%s")
+                params = tuple(loan_data.values()) + (first_period, first_period)
+                saved = self.db.execute_query(query, params)
             
-            if self.db.execute_query(query, params):
+            if saved:
                 self.show_success_message("موفقیت", "اطلاعات وام با موفقیت ذخیره شد")
                 self.clear_form()
                 self.load_loans_data()
@@ -106,38 +106,15 @@ class LoginWindow(BaseWindow):
         # Login button
         self.login_button = QPushButton("ورود به سیستم")
         self.login_button.setMinimumHeight(40)
+        self.login_button.setObjectName("login_button")
         self.login_button.setFont(FontManager.get_font(point_size=12, bold=True))
-        self.login_button.setStyleSheet("""
-            QPushButton {
-                background-color: #2ecc71;
-                color: white;
-                border: none;
-                border-radius: 5px;
-            }
-            QPushButton:hover {
-                background-color: #27ae60;
-            }
-            QPushButton:pressed {
-                background-color: #229954;
-            }
-        """)
         self.login_button.clicked.connect(self.attempt_login)
         layout.addWidget(self.login_button)
         
         # Forgot password
         forgot_button = QPushButton("کلمه عبور را فراموش کرده‌ام")
+        forgot_button.setObjectName("forgot_button")
         forgot_button.setFont(FontManager.get_font(point_size=9))
-        forgot_button.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #3498db;
-                border: none;
-            }
-            QPushButton:hover {
-                color: #2980b9;
-                text-decoration: underline;
-            }
-        """)
         layout.addWidget(forgot_button)
     
     def attempt_login(self):
@@ -11,6 +11,7 @@ from .advances_window import AdvancesWindow
 from .payroll_window import PayrollWindow
 from .reports_window import ReportsWindow
 from .settings_window import SettingsWindow
+from .backup_scheduler import BackupScheduler
 from utils.font_manager import FontManager
 from utils.date_converter import DateConverter
 import logging
@@ -24,6 +25,10 @@ class MainWindow(BaseWindow):
         self.setup_ui()
         self.setup_navigation()
         
+        # Automatic backups while the application is open
+        self.backup_scheduler = BackupScheduler(parent=self)
+        self.backup_scheduler.start()
+        
     def setup_ui(self):
         """Setup main window UI"""
         self.setWindowTitle("سیستم حقوق و دستمزد فران")
@@ -47,29 +52,16 @@ class MainWindow(BaseWindow):
     def setup_sidebar(self, main_layout: QHBoxLayout):
         """Setup sidebar navigation"""
         sidebar = QFrame()
+        sidebar.setObjectName("sidebar")
         sidebar.setFixedWidth(250)
-        sidebar.setStyleSheet("""
-            QFrame {
-                background-color: #2c3e50;
-                border: none;
-            }
-        """)
         sidebar_layout = QVBoxLayout(sidebar)
         sidebar_layout.setContentsMargins(10, 20, 10, 20)
         sidebar_layout.setSpacing(10)
         
         # Company info
         company_label = QLabel("شرکت فران")
+        company_label.setObjectName("company_label")
         company_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        company_label.setStyleSheet("""
-            QLabel {
-                color: #ecf0f1;
-                font-size: 16px;
-                font-weight: bold;
-                padding: 10px;
-                border-bottom: 1px solid #34495e;
-            }
-        """)
         company_label.setFont(FontManager.get_font(point_size=14, bold=True))
         sidebar_layout.addWidget(company_label)
         
@@ -89,24 +81,8 @@ class MainWindow(BaseWindow):
             btn = QPushButton(f"{icon} {text}")
             btn.setMinimumHeight(45)
             btn.setFont(FontManager.get_font(point_size=11))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: transparent;
-                    color: #bdc3c7;
-                    border: none;
-                    text-align: right;
-                    padding: 10px 15px;
-                    border-radius: 5px;
-                }
-                QPushButton:hover {
-                    background-color: #34495e;
-                    color: #ecf0f1;
-                }
-                QPushButton:pressed {
-                    background-color: #1abc9c;
-                }
-            """)
             btn.setProperty('nav_key', key)
+            btn.setProperty('active', False)
             btn.clicked.connect(self.on_nav_clicked)
             sidebar_layout.addWidget(btn)
             self.nav_buttons[key] = btn
@@ -115,37 +91,21 @@ class MainWindow(BaseWindow):
         
         # User info and logout
         user_widget = QFrame()
-        user_widget.setStyleSheet("""
-            QFrame {
-                background-color: #34495e;
-                border-radius: 5px;
-                padding: 10px;
-            }
-        """)
+        user_widget.setObjectName("user_panel")
         user_layout = QVBoxLayout(user_widget)
         
         user_label = QLabel("کاربر: مدیر سیستم")
-        user_label.setStyleSheet("color: #ecf0f1;")
+        user_label.setObjectName("user_label")
         user_label.setFont(FontManager.get_font(point_size=10))
         
         date_label = QLabel(DateConverter.get_current_jalali_date_str())
-        date_label.setStyleSheet("color: #bdc3c7;")
+        date_label.setObjectName("date_label")
         date_label.setFont(FontManager.get_font(point_size=9))
         
         logout_btn = QPushButton("🚪 خروج")
         logout_btn.setMinimumHeight(35)
+        logout_btn.setObjectName("logout_button")
         logout_btn.setFont(FontManager.get_font(point_size=10))
-        logout_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #e74c3c;
-                color: white;
-                border: none;
-                border-radius: 3px;
-            }
-            QPushButton:hover {
-                background-color: #c0392b;
-            }
-        """)
         logout_btn.clicked.connect(self.logout)
         
         user_layout.addWidget(user_label)
@@ -158,7 +118,7 @@ class MainWindow(BaseWindow):
     def setup_content_area(self, main_layout: QHBoxLayout):
         """Setup main content area"""
         content_widget = QWidget()
-        content_widget.setStyleSheet("background-color: #ecf0f1;")
+        content_widget.setObjectName("content_area")
         content_layout = QVBoxLayout(content_widget)
         content_layout.setContentsMargins(20, 20, 20, 20)
         content_layout.setSpacing(20)
@@ -166,7 +126,7 @@ class MainWindow(BaseWindow):
         # Header
         header_label = QLabel("داشبورد اصلی")
         header_label.setFont(FontManager.get_font(point_size=18, bold=True))
-        header_label.setStyleSheet("color: #2c3e50;")
+        header_label.setObjectName("page_header")
         content_layout.addWidget(header_label)
         
         # Stacked widget for different pages
@@ -220,34 +180,13 @@ class MainWindow(BaseWindow):
         if page_key in self.pages:
             self.stacked_widget.setCurrentWidget(self.pages[page_key])
             
-            # Update button styles
+            # Update button styles; only buttons whose state changed are re-polished
             for key, btn in self.nav_buttons.items():
-                if key == page_key:
-                    btn.setStyleSheet("""
-                        QPushButton {
-                            background-color: #1abc9c;
-                            color: white;
-                            border: none;
-                            text-align: right;
-                            padding: 10px 15px;
-                            border-radius: 5px;
-                        }
-                    """)
-                else:
-                    btn.setStyleSheet("""
-                        QPushButton {
-                            background-color: transparent;
-                            color: #bdc3c7;
-                            border: none;
-                            text-align: right;
-                            padding: 10px 15px;
-                            border-radius: 5px;
-                        }
-                        QPushButton:hover {
-                            background-color: #34495e;
-                            color: #ecf0f1;
-                        }
-                    """)
+                active = key == page_key
+                if btn.property('active') != active:
+                    btn.setProperty('active', active)
+                    btn.style().unpolish(btn)
+                    btn.style().polish(btn)
     
     def logout(self):
         """Handle logout"""
@@ -279,6 +218,7 @@ class MainWindow(BaseWindow):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
+            self.backup_scheduler.stop()
             event.accept()
             logger.info("Application closed by user")
         else:
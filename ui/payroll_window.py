@@ -7,6 +7,10 @@ from PyQt6.QtCore import Qt
 from widgets.modern_button import ModernButton
 from widgets.modern_table import ModernTable
 from database.database_manager import DatabaseManager
+from payroll.diff import FIELD_LABELS, diff_months, diff_runs, load_stored_run
+from payroll.payments import post_payments
+from payroll.service import PayrollService
+from payroll.simulation import PayrollSimulation, Scenario
 from utils.date_converter import DateConverter
 from utils.font_manager import FontManager
 import logging
@@ -14,6 +18,9 @@ import json
 
 logger = logging.getLogger(__name__)
 
+# Employees listed in the changes tab; totals always cover everyone
+MAX_DIFF_EMPLOYEES = 1000
+
 class PayrollWindow(QWidget):
     def __init__(self):
         super().__init__()
@@ -51,11 +58,15 @@ class PayrollWindow(QWidget):
         self.calculate_btn = ModernButton("🧮 محاسبه حقوق")
         self.calculate_btn.clicked.connect(self.calculate_payroll)
         
+        self.full_recalc_check = QCheckBox("محاسبه مجدد همه")
+        self.full_recalc_check.setToolTip("بدون انتخاب، فقط پرسنلی که اطلاعاتشان تغییر کرده محاسبه می‌شوند")
+        
         self.pay_all_btn = ModernButton("💳 پرداخت همه")
         self.pay_all_btn.clicked.connect(self.pay_all_salaries)
         
         controls_layout.addWidget(self.pay_all_btn)
         controls_layout.addWidget(self.calculate_btn)
+        controls_layout.addWidget(self.full_recalc_check)
         controls_layout.addWidget(QLabel("سال:"))
         controls_layout.addWidget(self.year_combo)
         controls_layout.addWidget(QLabel("ماه:"))
@@ -76,19 +87,19 @@ class PayrollWindow(QWidget):
         cards_layout.setSpacing(15)
         
         # Total employees card
-        total_card = self.create_summary_card("👥 تعداد پرسنل", "0", "#3498db")
+        total_card = self.create_summary_card("👥 تعداد پرسنل", "0", "blue")
         cards_layout.addWidget(total_card)
         
         # Total payroll card
-        payroll_card = self.create_summary_card("💰 مجموع حقوق", "0 ریال", "#2ecc71")
+        payroll_card = self.create_summary_card("💰 مجموع حقوق", "0 ریال", "green")
         cards_layout.addWidget(payroll_card)
         
         # Paid salaries card
-        paid_card = self.create_summary_card("✅ حقوق پرداختی", "0 ریال", "#27ae60")
+        paid_card = self.create_summary_card("✅ حقوق پرداختی", "0 ریال", "teal")
         cards_layout.addWidget(paid_card)
         
         # Unpaid salaries card
-        unpaid_card = self.create_summary_card("⏳ حقوق پرداخت نشده", "0 ریال", "#e74c3c")
+        unpaid_card = self.create_summary_card("⏳ حقوق پرداخت نشده", "0 ریال", "red")
         cards_layout.addWidget(unpaid_card)
         
         self.summary_cards = {
@@ -101,25 +112,19 @@ class PayrollWindow(QWidget):
         main_layout.addLayout(cards_layout)
     
     def create_summary_card(self, title: str, value: str, color: str) -> QFrame:
-        """Create a summary card"""
+        """Create a summary card (color is a theme card-color name)"""
         card = QFrame()
+        card.setObjectName("summary_card")
+        card.setProperty('card-color', color)
         card.setFrameStyle(QFrame.Shape.StyledPanel)
-        card.setStyleSheet(f"""
-            QFrame {{
-                background-color: {color};
-                border-radius: 10px;
-                padding: 15px;
-            }}
-        """)
         
         layout = QVBoxLayout(card)
         
         title_label = QLabel(title)
-        title_label.setStyleSheet("color: white; font-size: 12px;")
         title_label.setFont(FontManager.get_font(point_size=10))
         
         value_label = QLabel(value)
-        value_label.setStyleSheet("color: white; font-size: 16px; font-weight: bold;")
+        value_label.setProperty('value', True)
         value_label.setFont(FontManager.get_font(point_size=14, bold=True))
         
         layout.addWidget(title_label)
@@ -137,6 +142,12 @@ class PayrollWindow(QWidget):
         # Calculation settings tab
         self.setup_settings_tab(tabs)
         
+        # What-if simulation tab
+        self.setup_simulation_tab(tabs)
+        
+        # Changes between calculations tab
+        self.setup_changes_tab(tabs)
+        
         main_layout.addWidget(tabs)
     
     def setup_payroll_list_tab(self, tabs: QTabWidget):
@@ -169,6 +180,191 @@ class PayrollWindow(QWidget):
         
         layout.addWidget(self.payroll_table)
     
+    def setup_simulation_tab(self, tabs: QTabWidget):
+        """Setup what-if simulation tab"""
+        simulation_tab = QWidget()
+        layout = QVBoxLayout(simulation_tab)
+        
+        scenario_group = QGroupBox("سناریو")
+        scenario_layout = QFormLayout(scenario_group)
+        
+        self.sim_base_salary_change = QDoubleSpinBox()
+        self.sim_base_salary_change.setRange(-100, 500)
+        self.sim_base_salary_change.setSuffix(" %")
+        
+        self.sim_housing_check = QCheckBox("تغییر نرخ حق مسکن")
+        self.sim_housing_rate = QDoubleSpinBox()
+        self.sim_housing_rate.setRange(0, 1)
+        self.sim_housing_rate.setSingleStep(0.05)
+        self.sim_housing_rate.setValue(0.25)
+        
+        self.sim_family_check = QCheckBox("تغییر نرخ حق عائله")
+        self.sim_family_rate = QDoubleSpinBox()
+        self.sim_family_rate.setRange(0, 1)
+        self.sim_family_rate.setSingleStep(0.05)
+        self.sim_family_rate.setValue(0.1)
+        
+        self.sim_insurance_employer = QDoubleSpinBox()
+        self.sim_insurance_employer.setRange(0, 1)
+        self.sim_insurance_employer.setSingleStep(0.01)
+        self.sim_insurance_employer.setValue(self.insurance_employer_rate.value())
+        
+        scenario_layout.addRow("افزایش حقوق پایه:", self.sim_base_salary_change)
+        scenario_layout.addRow(self.sim_housing_check, self.sim_housing_rate)
+        scenario_layout.addRow(self.sim_family_check, self.sim_family_rate)
+        scenario_layout.addRow("نرخ بیمه کارفرما:", self.sim_insurance_employer)
+        
+        buttons_layout = QHBoxLayout()
+        run_btn = ModernButton("🔍 اجرای سناریو")
+        run_btn.clicked.connect(self.run_simulation)
+        reload_btn = ModernButton("🔄 بارگذاری مجدد اطلاعات")
+        reload_btn.clicked.connect(self.reload_simulation)
+        buttons_layout.addWidget(run_btn)
+        buttons_layout.addWidget(reload_btn)
+        buttons_layout.addStretch()
+        
+        self.simulation_table = ModernTable()
+        self.simulation_table.setColumnCount(6)
+        self.simulation_table.setHorizontalHeaderLabels([
+            "سمت", "تعداد", "هزینه فعلی", "هزینه سناریو", "تفاوت", "درصد تغییر"
+        ])
+        self.simulation_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        
+        self.simulation_total_label = QLabel()
+        
+        layout.addWidget(scenario_group)
+        layout.addLayout(buttons_layout)
+        layout.addWidget(self.simulation_table)
+        layout.addWidget(self.simulation_total_label)
+        
+        # Inputs are loaded once per month and reused for every scenario
+        self.simulation = None
+        self.simulation_period = None
+        
+        tabs.addTab(simulation_tab, "شبیه‌سازی")
+    
+    def setup_changes_tab(self, tabs: QTabWidget):
+        """Setup tab listing what changed between two calculations"""
+        changes_tab = QWidget()
+        layout = QVBoxLayout(changes_tab)
+        
+        buttons_layout = QHBoxLayout()
+        compare_btn = ModernButton("🔀 مقایسه با ماه قبل")
+        compare_btn.clicked.connect(self.compare_with_previous_month)
+        buttons_layout.addWidget(compare_btn)
+        buttons_layout.addStretch()
+        
+        self.changes_title_label = QLabel("پس از محاسبه حقوق، تغییرات نسبت به محاسبه قبلی اینجا نمایش داده می‌شود")
+        
+        self.changes_table = ModernTable()
+        self.changes_table.setColumnCount(6)
+        self.changes_table.setHorizontalHeaderLabels([
+            "کد پرسنلی", "نام و نام خانوادگی", "قلم", "قبل", "بعد", "تفاوت"
+        ])
+        self.changes_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        
+        self.changes_total_label = QLabel()
+        self.changes_total_label.setWordWrap(True)
+        
+        layout.addLayout(buttons_layout)
+        layout.addWidget(self.changes_title_label)
+        layout.addWidget(self.changes_table)
+        layout.addWidget(self.changes_total_label)
+        
+        tabs.addTab(changes_tab, "تغییرات")
+    
+    def compare_with_previous_month(self):
+        """Show the stored payroll of the selected month against the month before"""
+        try:
+            month = self.month_combo.currentIndex() + 1
+            year = int(self.year_combo.currentText())
+            self.show_payroll_diff(diff_months(self.db, year, month))
+        except Exception as e:
+            logger.error(f"Error comparing payroll months: {e}")
+            self.show_error_message("خطا", "خطا در مقایسه حقوق با ماه قبل")
+    
+    def show_payroll_diff(self, diff):
+        """Fill the changes tab with the changed employees and components of a diff"""
+        self.changes_title_label.setText(
+            f"{diff.before} ← {diff.after}: {len(diff.changed)} نفر تغییر، "
+            f"{len(diff.added)} نفر جدید، {len(diff.removed)} نفر حذف، {diff.unchanged_count} نفر بدون تغییر"
+        )
+        
+        changed_ids = list(diff.changed)[:MAX_DIFF_EMPLOYEES]
+        names = {}
+        if changed_ids:
+            query = "SELECT id, employee_code, first_name, last_name FROM personnel WHERE id = ANY(%s)"
+            names = {row['id']: row for row in self.db.fetch_all(query, (changed_ids,))}
+        
+        self.changes_table.setRowCount(0)
+        for personnel_id in changed_ids:
+            person = names.get(personnel_id, {})
+            for field, (before, after) in diff.changed[personnel_id].items():
+                row_position = self.changes_table.rowCount()
+                self.changes_table.insertRow(row_position)
+                self.changes_table.setItem(row_position, 0, QTableWidgetItem(str(person.get('employee_code', personnel_id))))
+                self.changes_table.setItem(row_position, 1, QTableWidgetItem(f"{person.get('first_name', '')} {person.get('last_name', '')}"))
+                self.changes_table.setItem(row_position, 2, QTableWidgetItem(FIELD_LABELS.get(field, field)))
+                self.changes_table.setItem(row_position, 3, QTableWidgetItem(f"{before:,.0f}"))
+                self.changes_table.setItem(row_position, 4, QTableWidgetItem(f"{after:,.0f}"))
+                self.changes_table.setItem(row_position, 5, QTableWidgetItem(f"{after - before:+,.0f}"))
+        
+        totals = [f"{FIELD_LABELS.get(field, field)}: {delta:+,.0f}"
+                  for field, (_, _, delta) in diff.totals.items() if abs(delta) >= 1]
+        text = "تغییر جمع اقلام (ریال) — " + "، ".join(totals) if totals else "جمع اقلام تغییری نکرده است"
+        if len(diff.changed) > MAX_DIFF_EMPLOYEES:
+            text += f"\nفقط {MAX_DIFF_EMPLOYEES} نفر اول از {len(diff.changed)} نفر نمایش داده شده‌اند"
+        self.changes_total_label.setText(text)
+    
+    def reload_simulation(self):
+        """Drop cached simulation inputs and run again"""
+        self.simulation = None
+        self.run_simulation()
+    
+    def run_simulation(self):
+        """Evaluate the scenario against the cached month, without writing anything"""
+        try:
+            month = self.month_combo.currentIndex() + 1
+            year = int(self.year_combo.currentText())
+            
+            if self.simulation is None or self.simulation_period != (year, month):
+                service = PayrollService(self.db, self.get_calculation_settings())
+                self.simulation = PayrollSimulation.load(service, year, month)
+                self.simulation_period = (year, month)
+            
+            scenario = Scenario(
+                name="سناریو",
+                base_salary_factor=1 + self.sim_base_salary_change.value() / 100,
+                housing_allowance_rate=self.sim_housing_rate.value() if self.sim_housing_check.isChecked() else None,
+                family_allowance_rate=self.sim_family_rate.value() if self.sim_family_check.isChecked() else None,
+                rates={'insurance_employer': self.sim_insurance_employer.value()}
+            )
+            departments = self.simulation.compare([scenario])[0]['departments']
+            
+            self.simulation_table.setRowCount(0)
+            total_baseline = 0
+            total_simulated = 0
+            for department, result in sorted(departments.items()):
+                row_position = self.simulation_table.rowCount()
+                self.simulation_table.insertRow(row_position)
+                self.simulation_table.setItem(row_position, 0, QTableWidgetItem(department))
+                self.simulation_table.setItem(row_position, 1, QTableWidgetItem(str(result['headcount'])))
+                self.simulation_table.setItem(row_position, 2, QTableWidgetItem(f"{result['baseline_cost']:,.0f}"))
+                self.simulation_table.setItem(row_position, 3, QTableWidgetItem(f"{result['simulated_cost']:,.0f}"))
+                self.simulation_table.setItem(row_position, 4, QTableWidgetItem(f"{result['cost_delta']:+,.0f}"))
+                self.simulation_table.setItem(row_position, 5, QTableWidgetItem(f"{result['cost_delta_percent']:+.1f} %"))
+                total_baseline += result['baseline_cost']
+                total_simulated += result['simulated_cost']
+            
+            delta = total_simulated - total_baseline
+            self.simulation_total_label.setText(
+                f"هزینه کل ماهانه: {total_baseline:,.0f} ← {total_simulated:,.0f} ریال (تفاوت {delta:+,.0f} ریال)"
+            )
+            
+        except Exception as e:
+            logger.error(f"Error running payroll simulation: {e}")
+            self.show_error_message("خطا", "خطا در اجرای شبیه‌سازی")
+    
     def setup_settings_tab(self, tabs: QTabWidget):
         """Setup calculation settings tab"""
         settings_tab = QWidget()
@@ -230,12 +426,27 @@ class PayrollWindow(QWidget):
         insurance_layout.addRow("نرخ بیمه کارفرما:", self.insurance_employer_rate)
         insurance_layout.addRow("آستانه معافیت مالیاتی:", self.tax_threshold)
         
+        # Deductions settings
+        deductions_group = QGroupBox("تنظیمات کسورات")
+        deductions_layout = QFormLayout(deductions_group)
+        
+        self.advance_deduction_cap = QDoubleSpinBox()
+        # Shown in percent; the setting is a fraction of net pay
+        self.advance_deduction_cap.setRange(0, 100)
+        self.advance_deduction_cap.setValue(self.calculation_config.get('advance_deduction_cap', 0.5) * 100)
+        self.advance_deduction_cap.setSingleStep(5)
+        self.advance_deduction_cap.setSuffix(" %")
+        self.advance_deduction_cap.setToolTip("بیشترین سهم حقوق خالص که هر ماه بابت مساعده کسر می‌شود؛ باقیمانده به ماه‌های بعد منتقل می‌شود")
+        
+        deductions_layout.addRow("سقف کسر مساعده از خالص:", self.advance_deduction_cap)
+        
         # Save settings button
         save_btn = ModernButton("💾 ذخیره تنظیمات")
         save_btn.clicked.connect(self.save_calculation_settings)
         
         layout.addWidget(allowances_group)
         layout.addWidget(insurance_group)
+        layout.addWidget(deductions_group)
         layout.addWidget(save_btn)
         layout.addStretch()
         
@@ -267,9 +478,6 @@ class PayrollWindow(QWidget):
             results = self.db.fetch_all(query, (year, month))
             
             self.payroll_table.setRowCount(0)
-            total_payroll = 0
-            paid_amount = 0
-            unpaid_amount = 0
             
             for row_data in results:
                 row_position = self.payroll_table.rowCount()
@@ -313,16 +521,17 @@ class PayrollWindow(QWidget):
                                   row_data['other_deductions'])
                 self.payroll_table.setItem(row_position, 13, QTableWidgetItem(f"{total_deductions:,.0f}"))
                 self.payroll_table.setItem(row_position, 14, QTableWidgetItem(f"{row_data['net_salary']:,.0f}"))
-                
-                # Update totals
-                total_payroll += row_data['net_salary']
-                if row_data['is_paid']:
-                    paid_amount += row_data['net_salary']
-                else:
-                    unpaid_amount += row_data['net_salary']
             
-            # Update summary cards
-            self.update_summary_cards(len(results), total_payroll, paid_amount, unpaid_amount)
+            # Update summary cards from the precomputed monthly totals
+            summary = self.db.fetch_one(
+                "SELECT * FROM payroll_month_summary WHERE year = %s AND month = %s",
+                (year, month)
+            )
+            if summary:
+                self.update_summary_cards(summary['employee_count'], summary['total_net_salary'],
+                                          summary['paid_amount'], summary['unpaid_amount'])
+            else:
+                self.update_summary_cards(0, 0, 0, 0)
             
         except Exception as e:
             logger.error(f"Error loading payroll data: {e}")
@@ -366,202 +575,54 @@ class PayrollWindow(QWidget):
             month = self.month_combo.currentIndex() + 1
             year = int(self.year_combo.currentText())
             
-            # Get active personnel
-            query = "SELECT * FROM personnel WHERE is_active = TRUE"
-            personnel_list = self.db.fetch_all(query)
+            service = PayrollService(self.db, self.get_calculation_settings())
+            before = load_stored_run(self.db, year, month, "محاسبه قبلی")
+            result = service.calculate_month(year, month, full=self.full_recalc_check.isChecked())
+            diff = diff_runs(before, load_stored_run(self.db, year, month, "محاسبه جدید"))
+            self.show_payroll_diff(diff)
             
-            if not personnel_list:
+            if not result['total']:
                 self.show_error_message("هشدار", "هیچ پرسنل فعالی برای محاسبه حقوق وجود ندارد")
                 return
             
-            successful_calculations = 0
-            
-            for personnel in personnel_list:
-                payroll_data = self.calculate_employee_payroll(personnel, year, month)
-                
-                if payroll_data:
-                    # Check if payroll already exists
-                    check_query = """
-                        SELECT id FROM payroll 
-                        WHERE personnel_id = %s AND year = %s AND month = %s
-                    """
-                    existing = self.db.fetch_one(check_query, (personnel['id'], year, month))
-                    
-                    if existing:
-                        # Update existing payroll
-                        update_query = """
-                            UPDATE payroll SET 
-                            base_salary = %s, housing_allowance = %s, family_allowance = %s,
-                            child_allowance = %s, overtime_amount = %s, other_allowances = %s,
-                            gross_salary = %s, insurance_employee = %s, insurance_employer = %s,
-                            tax_amount = %s, loan_deduction = %s, advance_deduction = %s,
-                            other_deductions = %s, net_salary = %s
-                            WHERE id = %s
-                        """
-                        params = tuple(payroll_data.values()) + (existing['id'],)
-                    else:
-                        # Insert new payroll
-                        insert_query = """
-                            INSERT INTO payroll 
-                            (personnel_id, year, month, base_salary, housing_allowance,
-                             family_allowance, child_allowance, overtime_amount, other_allowances,
-                             gross_salary, insurance_employee, insurance_employer, tax_amount,
-                             loan_deduction, advance_deduction, other_deductions, net_salary)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """
-                        params = (personnel['id'], year, month) + tuple(payroll_data.values())
-                    
-                    if self.db.execute_query(insert_query if not existing else update_query, params):
-                        successful_calculations += 1
-            
-            self.show_success_message("موفقیت", f"حقوق {successful_calculations} نفر از {len(personnel_list)} نفر با موفقیت محاسبه شد")
+            skipped = result['skipped']
+            calculated_count = result['total'] - len(skipped)
+            message = f"حقوق {result['calculated']} نفر از {calculated_count} نفر با موفقیت محاسبه شد"
+            if skipped:
+                message += f"\n\n{len(skipped)} نفر بدون تغییر از محاسبه قبلی رد شدند"
+                names = [f"{personnel['first_name']} {personnel['last_name']}" for personnel in skipped[:10]]
+                if len(skipped) > 10:
+                    names.append("...")
+                message += ":\n" + "، ".join(names)
+            if before:
+                message += f"\n\nتغییر نسبت به محاسبه قبلی: {len(diff.changed)} نفر (جزئیات در برگه تغییرات)"
+            logger.info(f"Payroll {year}/{month}: calculated {result['calculated']}, skipped {len(skipped)} unchanged, "
+                        f"{len(diff.changed)} changed")
+            
+            self.show_success_message("موفقیت", message)
             self.load_payroll_data()
             
         except Exception as e:
             logger.error(f"Error calculating payroll: {e}")
             self.show_error_message("خطا", "خطا در محاسبه حقوق")
     
-    def calculate_employee_payroll(self, personnel: dict, year: int, month: int) -> dict:
-        """Calculate payroll for a single employee"""
-        try:
-            # Base salary
-            base_salary = personnel['base_salary']
-            
-            # Allowances
-            housing_allowance = base_salary * personnel['housing_allowance_rate']
-            family_allowance = base_salary * personnel['family_allowance_rate']
-            child_allowance = self.child_allowance_amount.value() * personnel['children_count']
-            
-            # Overtime calculation (simplified)
-            overtime_amount = self.calculate_overtime(personnel['id'], year, month)
-            
-            # Other allowances
-            other_allowances = 0
-            
-            # Gross salary
-            gross_salary = base_salary + housing_allowance + family_allowance + child_allowance + overtime_amount + other_allowances
-            
-            # Deductions
-            insurance_employee = gross_salary * self.insurance_employee_rate.value()
-            insurance_employer = gross_salary * self.insurance_employer_rate.value()
-            
-            # Tax calculation (simplified)
-            tax_amount = self.calculate_tax(gross_salary - insurance_employee)
-            
-            # Loan deductions
-            loan_deduction = self.calculate_loan_deductions(personnel['id'])
-            
-            # Advance deductions
-            advance_deduction = self.calculate_advance_deductions(personnel['id'])
-            
-            # Other deductions
-            other_deductions = 0
-            
-            # Net salary
-            net_salary = gross_salary - insurance_employee - tax_amount - loan_deduction - advance_deduction - other_deductions
-            
-            return {
-                'base_salary': base_salary,
-                'housing_allowance': housing_allowance,
-                'family_allowance': family_allowance,
-                'child_allowance': child_allowance,
-                'overtime_amount': overtime_amount,
-                'other_allowances': other_allowances,
-                'gross_salary': gross_salary,
-                'insurance_employee': insurance_employee,
-                'insurance_employer': insurance_employer,
-                'tax_amount': tax_amount,
-                'loan_deduction': loan_deduction,
-                'advance_deduction': advance_deduction,
-                'other_deductions': other_deductions,
-                'net_salary': net_salary
-            }
-            
-        except Exception as e:
-            logger.error(f"Error calculating employee payroll: {e}")
-            return None
-    
-    def calculate_overtime(self, personnel_id: int, year: int, month: int) -> float:
-        """Calculate overtime amount for employee"""
-        try:
-            query = """
-                SELECT COALESCE(SUM(overtime_hours), 0) as total_overtime
-                FROM attendance 
-                WHERE personnel_id = %s 
-                AND EXTRACT(YEAR FROM date) = %s 
-                AND EXTRACT(MONTH FROM date) = %s
-            """
-            result = self.db.fetch_one(query, (personnel_id, year, month))
-            
-            if result:
-                # Simplified overtime calculation (overtime rate = base hourly rate * 1.4)
-                base_hourly_rate = 56000000 / 240  # Assuming 240 working hours per month
-                overtime_rate = base_hourly_rate * 1.4
-                return result['total_overtime'] * overtime_rate
-            
-            return 0
-        except Exception as e:
-            logger.error(f"Error calculating overtime: {e}")
-            return 0
-    
-    def calculate_tax(self, taxable_income: float) -> float:
-        """Calculate tax amount based on taxable income"""
-        tax_threshold = self.tax_threshold.value()
-        
-        if taxable_income <= tax_threshold:
-            return 0
-        
-        # Simplified tax calculation
-        excess_income = taxable_income - tax_threshold
-        tax_rate = 0.1  # 10% for excess income
-        return excess_income * tax_rate
-    
-    def calculate_loan_deductions(self, personnel_id: int) -> float:
-        """Calculate total loan deductions for employee"""
-        try:
-            query = """
-                SELECT installment_amount 
-                FROM loans 
-                WHERE personnel_id = %s AND is_active = TRUE AND remaining_installments > 0
-            """
-            result = self.db.fetch_one(query, (personnel_id,))
-            
-            if result:
-                return result['installment_amount']
-            
-            return 0
-        except Exception as e:
-            logger.error(f"Error calculating loan deductions: {e}")
-            return 0
-    
-    def calculate_advance_deductions(self, personnel_id: int) -> float:
-        """Calculate total advance deductions for employee"""
-        try:
-            query = """
-                SELECT advance_amount 
-                FROM advances 
-                WHERE personnel_id = %s AND is_settled = FALSE
-                LIMIT 1
-            """
-            result = self.db.fetch_one(query, (personnel_id,))
-            
-            if result:
-                return result['advance_amount']
-            
-            return 0
-        except Exception as e:
-            logger.error(f"Error calculating advance deductions: {e}")
-            return 0
+    def get_calculation_settings(self) -> dict:
+        """Calculation settings as currently shown in the settings tab"""
+        return {
+            'child_allowance': self.child_allowance_amount.value(),
+            'insurance_employee': self.insurance_employee_rate.value(),
+            'insurance_employer': self.insurance_employer_rate.value(),
+            'tax_threshold': self.tax_threshold.value(),
+            'advance_deduction_cap': self.advance_deduction_cap.value() / 100,
+            'tax_brackets': self.calculation_config.get('tax_brackets', {}),
+            'rules': self.calculation_config.get('rules', [])
+        }
     
     def pay_salary(self, payroll_id: int):
         """Mark salary as paid"""
         try:
-            query = """
-                UPDATE payroll 
-                SET is_paid = TRUE, payment_date = CURRENT_DATE 
-                WHERE id = %s
-            """
-            if self.db.execute_query(query, (payroll_id,)):
+            payroll = self.db.fetch_one("SELECT year, month FROM payroll WHERE id = %s", (payroll_id,))
+            if payroll and post_payments(self.db, payroll['year'], payroll['month'], [payroll_id]) is not None:
                 self.show_success_message("موفقیت", "حقوق با موفقیت پرداخت شد")
                 self.load_payroll_data()
             else:
@@ -585,13 +646,14 @@ class PayrollWindow(QWidget):
                 month = self.month_combo.currentIndex() + 1
                 year = int(self.year_combo.currentText())
                 
-                query = """
-                    UPDATE payroll 
-                    SET is_paid = TRUE, payment_date = CURRENT_DATE 
-                    WHERE year = %s AND month = %s AND is_paid = FALSE
-                """
-                if self.db.execute_query(query, (year, month)):
-                    self.show_success_message("موفقیت", "همه حقوق‌ها با موفقیت پرداخت شدند")
+                result = post_payments(self.db, year, month)
+                if result is not None:
+                    self.show_success_message(
+                        "موفقیت",
+                        f"حقوق {result['paid']} نفر با موفقیت پرداخت شد\n"
+                        f"{result['installments']} قسط وام کسر، {result['closed_loans']} وام تسویه "
+                        f"و {result['settled_advances']} مساعده تسویه شد"
+                    )
                     self.load_payroll_data()
                 else:
                     self.show_error_message("خطا", "خطا در پرداخت حقوق‌ها")
@@ -657,7 +719,8 @@ class PayrollWindow(QWidget):
                 'child_allowance': self.child_allowance_amount.value(),
                 'insurance_employee': self.insurance_employee_rate.value(),
                 'insurance_employer': self.insurance_employer_rate.value(),
-                'tax_threshold': self.tax_threshold.value()
+                'tax_threshold': self.tax_threshold.value(),
+                'advance_deduction_cap': self.advance_deduction_cap.value() / 100
             })
             
             # Save to file
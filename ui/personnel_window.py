@@ -3,7 +3,7 @@ from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
                             QLineEdit, QComboBox, QDateEdit, QSpinBox,
                             QDoubleSpinBox, QCheckBox, QTabWidget,
                             QHeaderView, QMessageBox, QFormLayout, QGroupBox)
-from PyQt6.QtCore import QDate, Qt
+from PyQt6.QtCore import QDate, Qt, QTimer
 from PyQt6.QtGui import QIcon
 from .base_window import BaseWindow
 from widgets.modern_button import ModernButton
@@ -12,6 +12,7 @@ from widgets.modern_table import ModernTable
 from database.database_manager import DatabaseManager
 from utils.date_converter import DateConverter
 from utils.font_manager import FontManager
+from utils.search_index import SearchIndex
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,6 +22,7 @@ class PersonnelWindow(QWidget):  # تغییر از BaseWindow به QWidget
         super().__init__()
         self.db = DatabaseManager()
         self.selected_personnel_id = None
+        self.search_index = None
         self.setup_ui()
         self.load_personnel_data()
         
@@ -79,9 +81,15 @@ class PersonnelWindow(QWidget):  # تغییر از BaseWindow به QWidget
         # Search input
         self.search_input = ModernInput()
         self.search_input.setPlaceholderText("جستجو بر اساس نام، کد پرسنلی، کد ملی...")
-        self.search_input.textChanged.connect(self.filter_personnel)
         search_layout.addWidget(self.search_input)
         
+        # Debounce keystrokes so the filter runs once typing pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.filter_personnel)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        
         # Status filter
         self.status_filter = QComboBox()
         self.status_filter.addItems(["همه", "فعال", "غیرفعال"])
@@ -208,9 +216,19 @@ class PersonnelWindow(QWidget):  # تغییر از BaseWindow به QWidget
             """
             results = self.db.fetch_all(query)
             
+            # Build the in-memory search index once per load
+            self.search_index = SearchIndex(
+                results, ['first_name', 'last_name', 'employee_code', 'national_id']
+            )
+            
+            # Both date columns converted at once through the lookup table
+            hire_dates = DateConverter.gregorian_to_jalali_array(row['hire_date'] for row in results)
+            created_dates = DateConverter.gregorian_to_jalali_array(row['created_at'] for row in results)
+            
+            self.personnel_table.setSortingEnabled(False)
             self.personnel_table.setRowCount(0)
             
-            for row_data in results:
+            for row_data, hire_date, created_date in zip(results, hire_dates, created_dates):
                 row_position = self.personnel_table.rowCount()
                 self.personnel_table.insertRow(row_position)
                 
@@ -232,15 +250,22 @@ class PersonnelWindow(QWidget):  # تغییر از BaseWindow به QWidget
                 action_layout.addStretch()
                 
                 self.personnel_table.setCellWidget(row_position, 0, action_widget)
-                self.personnel_table.setItem(row_position, 1, QTableWidgetItem(str(row_data['employee_code'])))
+                
+                code_item = QTableWidgetItem(str(row_data['employee_code']))
+                code_item.setData(Qt.ItemDataRole.UserRole, row_data['id'])
+                code_item.setData(Qt.ItemDataRole.UserRole + 1, bool(row_data['is_active']))
+                self.personnel_table.setItem(row_position, 1, code_item)
                 self.personnel_table.setItem(row_position, 2, QTableWidgetItem(f"{row_data['first_name']} {row_data['last_name']}"))
                 self.personnel_table.setItem(row_position, 3, QTableWidgetItem(str(row_data['national_id'])))
-                self.personnel_table.setItem(row_position, 4, QTableWidgetItem(DateConverter.gregorian_to_jalali_str(row_data['hire_date'])))
+                self.personnel_table.setItem(row_position, 4, QTableWidgetItem(hire_date))
                 self.personnel_table.setItem(row_position, 5, QTableWidgetItem(row_data['position'] or ''))
                 self.personnel_table.setItem(row_position, 6, QTableWidgetItem(f"{row_data['base_salary']:,.0f}"))
                 self.personnel_table.setItem(row_position, 7, QTableWidgetItem(str(row_data['children_count'])))
                 self.personnel_table.setItem(row_position, 8, QTableWidgetItem("فعال" if row_data['is_active'] else "غیرفعال"))
-                self.personnel_table.setItem(row_position, 9, QTableWidgetItem(DateConverter.gregorian_to_jalali_str(row_data['created_at'])))
+                self.personnel_table.setItem(row_position, 9, QTableWidgetItem(created_date))
+            
+            self.personnel_table.setSortingEnabled(True)
+            self.filter_personnel()
                 
         except Exception as e:
             logger.error(f"Error loading personnel data: {e}")
@@ -264,8 +289,26 @@ class PersonnelWindow(QWidget):  # تغییر از BaseWindow به QWidget
     
     def filter_personnel(self):
         """Filter personnel based on search criteria"""
-        # Implementation for filtering
-        pass
+        if self.search_index is None:
+            return
+        
+        matches = self.search_index.search(self.search_input.text())
+        status = self.status_filter.currentIndex()  # 0: all, 1: active, 2: inactive
+        
+        # Hide non-matching rows in place; rows are keyed by personnel id
+        # because sorting reorders them
+        table = self.personnel_table
+        for row in range(table.rowCount()):
+            item = table.item(row, 1)
+            if item is None:
+                continue
+            
+            visible = matches is None or item.data(Qt.ItemDataRole.UserRole) in matches
+            if visible and status:
+                visible = item.data(Qt.ItemDataRole.UserRole + 1) == (status == 1)
+            
+            if table.isRowHidden(row) == visible:
+                table.setRowHidden(row, not visible)
     
     def show_add_dialog(self):
         """Show add personnel dialog"""
@@ -6,7 +6,10 @@ from PyQt6.QtCore import QDate
 from PyQt6.QtPrintSupport import QPrinter, QPrintDialog
 from widgets.modern_button import ModernButton
 from widgets.modern_table import ModernTable
+from database.archive import ArchiveError, YearArchive
 from database.database_manager import DatabaseManager
+from payroll.reports import (PAYMENT_STATUS_PAID, attendance_report_rows, financial_report_rows,
+                             format_financial_report, payroll_report_rows)
 from utils.date_converter import DateConverter
 from utils.font_manager import FontManager
 import logging
@@ -15,11 +18,29 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+ARCHIVE_UNREADABLE_MESSAGE = "این سال از پایگاه داده جدا و بایگانی شده است؛ برای خواندن بایگانی، pyarrow را نصب کنید"
+
 class ReportsWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.db = DatabaseManager()
+        # Closed years archived to files are reported from there
+        self.archive = YearArchive.from_settings(self.load_settings())
         self.setup_ui()
+    
+    def load_settings(self) -> dict:
+        """Load application settings"""
+        try:
+            with open('config/settings.json', 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading settings: {e}")
+            return {}
+    
+    def report_years(self) -> list:
+        """Years offered by the report year selectors: recent and archived ones"""
+        current_year = DateConverter.get_current_jalali_date().year
+        return sorted(set(range(current_year-2, current_year+1)) | set(self.archive.years()))
         
     def setup_ui(self):
         """Setup reports UI"""
@@ -71,7 +92,7 @@ class ReportsWindow(QWidget):
         
         self.payroll_year = QComboBox()
         current_year = DateConverter.get_current_jalali_date().year
-        self.payroll_year.addItems([str(year) for year in range(current_year-2, current_year+1)])
+        self.payroll_year.addItems([str(year) for year in self.report_years()])
         self.payroll_year.setCurrentText(str(current_year))
         
         generate_btn = ModernButton("📊 تولید گزارش حقوق")
@@ -131,7 +152,7 @@ class ReportsWindow(QWidget):
         
         self.attendance_year = QComboBox()
         current_year = DateConverter.get_current_jalali_date().year
-        self.attendance_year.addItems([str(year) for year in range(current_year-2, current_year+1)])
+        self.attendance_year.addItems([str(year) for year in self.report_years()])
         self.attendance_year.setCurrentText(str(current_year))
         
         generate_btn = ModernButton("📊 تولید گزارش حضور")
@@ -168,7 +189,7 @@ class ReportsWindow(QWidget):
         
         self.financial_year = QComboBox()
         current_year = DateConverter.get_current_jalali_date().year
-        self.financial_year.addItems([str(year) for year in range(current_year-2, current_year+1)])
+        self.financial_year.addItems([str(year) for year in self.report_years()])
         self.financial_year.setCurrentText(str(current_year))
         
         generate_btn = ModernButton("📊 گزارش مالی سالانه")
@@ -244,25 +265,7 @@ class ReportsWindow(QWidget):
             month = self.payroll_month.currentIndex() + 1
             year = int(self.payroll_year.currentText())
             
-            query = """
-                SELECT 
-                    p.employee_code,
-                    p.first_name || ' ' || p.last_name as full_name,
-                    pr.base_salary,
-                    (pr.housing_allowance + pr.family_allowance + pr.child_allowance + 
-                     pr.overtime_amount + pr.other_allowances) as allowances,
-                    (pr.insurance_employee + pr.tax_amount + pr.loan_deduction + 
-                     pr.advance_deduction + pr.other_deductions) as deductions,
-                    pr.net_salary,
-                    CASE WHEN pr.is_paid THEN 'پرداخت شده' ELSE 'پرداخت نشده' END as payment_status,
-                    COALESCE(pr.payment_date::text, '-') as payment_date
-                FROM payroll pr
-                JOIN personnel p ON pr.personnel_id = p.id
-                WHERE pr.year = %s AND pr.month = %s
-                ORDER BY p.employee_code
-            """
-            
-            results = self.db.fetch_all(query, (year, month))
+            results = payroll_report_rows(self.db, year, month, self.archive)
             
             self.payroll_report_table.setRowCount(0)
             
@@ -290,7 +293,7 @@ class ReportsWindow(QWidget):
                 total_allowances += row_data['allowances']
                 total_deductions += row_data['deductions']
                 total_net += row_data['net_salary']
-                if row_data['payment_status'] == 'پرداخت شده':
+                if row_data['payment_status'] == PAYMENT_STATUS_PAID:
                     paid_count += 1
             
             # Update summary
@@ -307,6 +310,9 @@ class ReportsWindow(QWidget):
             
             self.summary_text.setText(summary_text)
             
+        except ArchiveError as e:
+            logger.error(f"Error generating payroll report: {e}")
+            self.show_error_message("خطا", ARCHIVE_UNREADABLE_MESSAGE)
         except Exception as e:
             logger.error(f"Error generating payroll report: {e}")
             self.show_error_message("خطا", "خطا در تولید گزارش حقوق")
@@ -317,28 +323,7 @@ class ReportsWindow(QWidget):
             month = self.attendance_month.currentIndex() + 1
             year = int(self.attendance_year.currentText())
             
-            query = """
-                SELECT 
-                    p.employee_code,
-                    p.first_name || ' ' || p.last_name as full_name,
-                    COUNT(CASE WHEN a.absence_type = 'حاضر' THEN 1 END) as work_days,
-                    COUNT(CASE WHEN a.absence_type = 'مرخصی استعلاجی' THEN 1 END) as sick_leave,
-                    COUNT(CASE WHEN a.absence_type = 'مرخصی استحقاقی' THEN 1 END) as annual_leave,
-                    COUNT(CASE WHEN a.absence_type = 'غیبت' THEN 1 END) as absence_days,
-                    COUNT(CASE WHEN a.absence_type = 'تعطیل' THEN 1 END) as holiday_days,
-                    COALESCE(SUM(a.overtime_hours), 0) as overtime_hours,
-                    COUNT(CASE WHEN a.entry_time > '08:15' THEN 1 END) as late_days,
-                    COUNT(CASE WHEN a.absence_type = 'حاضر' THEN 1 END) * 8 as total_work_hours
-                FROM personnel p
-                LEFT JOIN attendance a ON p.id = a.personnel_id 
-                    AND EXTRACT(YEAR FROM a.date) = %s 
-                    AND EXTRACT(MONTH FROM a.date) = %s
-                WHERE p.is_active = TRUE
-                GROUP BY p.id, p.employee_code, p.first_name, p.last_name
-                ORDER BY p.employee_code
-            """
-            
-            results = self.db.fetch_all(query, (year, month))
+            results = attendance_report_rows(self.db, year, month, archive=self.archive)
             
             self.attendance_report_table.setRowCount(0)
             
@@ -357,6 +342,9 @@ class ReportsWindow(QWidget):
                 self.attendance_report_table.setItem(row_position, 8, QTableWidgetItem(str(row_data['late_days'])))
                 self.attendance_report_table.setItem(row_position, 9, QTableWidgetItem(str(row_data['total_work_hours'])))
                 
+        except ArchiveError as e:
+            logger.error(f"Error generating attendance report: {e}")
+            self.show_error_message("خطا", ARCHIVE_UNREADABLE_MESSAGE)
         except Exception as e:
             logger.error(f"Error generating attendance report: {e}")
             self.show_error_message("خطا", "خطا در تولید گزارش حضور")
@@ -366,66 +354,12 @@ class ReportsWindow(QWidget):
         try:
             year = int(self.financial_year.currentText())
             
-            query = """
-                SELECT 
-                    month,
-                    COUNT(*) as employee_count,
-                    SUM(base_salary) as total_base_salary,
-                    SUM(gross_salary) as total_gross_salary,
-                    SUM(net_salary) as total_net_salary,
-                    SUM(insurance_employee) as total_insurance_employee,
-                    SUM(insurance_employer) as total_insurance_employer,
-                    SUM(tax_amount) as total_tax,
-                    COUNT(CASE WHEN is_paid THEN 1 END) as paid_count
-                FROM payroll 
-                WHERE year = %s
-                GROUP BY month
-                ORDER BY month
-            """
-            
-            results = self.db.fetch_all(query, (year,))
-            
-            financial_text = f"گزارش مالی سال {year}\n\n"
-            financial_text += "ماه | تعداد | حقوق پایه | حقوق ناخالص | حقوق خالص | بیمه کارمند | بیمه کارفرما | مالیات | وضعیت پرداخت\n"
-            financial_text += "-" * 100 + "\n"
-            
-            yearly_totals = {
-                'employees': 0,
-                'base_salary': 0,
-                'gross_salary': 0,
-                'net_salary': 0,
-                'insurance_employee': 0,
-                'insurance_employer': 0,
-                'tax': 0,
-                'paid': 0
-            }
-            
-            for row_data in results:
-                month_name = DateConverter.get_jalali_month_name(row_data['month'])
-                financial_text += f"{month_name} | {row_data['employee_count']} | {row_data['total_base_salary']:,.0f} | {row_data['total_gross_salary']:,.0f} | {row_data['total_net_salary']:,.0f} | {row_data['total_insurance_employee']:,.0f} | {row_data['total_insurance_employer']:,.0f} | {row_data['total_tax']:,.0f} | {row_data['paid_count']}/{row_data['employee_count']}\n"
-                
-                # Update yearly totals
-                yearly_totals['employees'] += row_data['employee_count']
-                yearly_totals['base_salary'] += row_data['total_base_salary']
-                yearly_totals['gross_salary'] += row_data['total_gross_salary']
-                yearly_totals['net_salary'] += row_data['total_net_salary']
-                yearly_totals['insurance_employee'] += row_data['total_insurance_employee']
-                yearly_totals['insurance_employer'] += row_data['total_insurance_employer']
-                yearly_totals['tax'] += row_data['total_tax']
-                yearly_totals['paid'] += row_data['paid_count']
-            
-            financial_text += f"\nجمع سالانه:\n"
-            financial_text += f"• تعداد کل پرسنل: {yearly_totals['employees']} نفر\n"
-            financial_text += f"• مجموع حقوق پایه: {yearly_totals['base_salary']:,.0f} ریال\n"
-            financial_text += f"• مجموع حقوق ناخالص: {yearly_totals['gross_salary']:,.0f} ریال\n"
-            financial_text += f"• مجموع حقوق خالص: {yearly_totals['net_salary']:,.0f} ریال\n"
-            financial_text += f"• مجموع بیمه کارمند: {yearly_totals['insurance_employee']:,.0f} ریال\n"
-            financial_text += f"• مجموع بیمه کارفرما: {yearly_totals['insurance_employer']:,.0f} ریال\n"
-            financial_text += f"• مجموع مالیات: {yearly_totals['tax']:,.0f} ریال\n"
-            financial_text += f"• تعداد پرداخت‌ها: {yearly_totals['paid']} پرداخت\n"
-            
-            self.financial_text.setText(financial_text)
+            results = financial_report_rows(self.db, year, self.archive)
+            self.financial_text.setText(format_financial_report(year, results))
             
+        except ArchiveError as e:
+            logger.error(f"Error generating financial report: {e}")
+            self.show_error_message("خطا", ARCHIVE_UNREADABLE_MESSAGE)
         except Exception as e:
             logger.error(f"Error generating financial report: {e}")
             self.show_error_message("خطا", "خطا در تولید گزارش مالی")
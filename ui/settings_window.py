@@ -1,15 +1,16 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                             QPushButton, QLineEdit, QComboBox, QCheckBox,
                             QTabWidget, QMessageBox, QFormLayout, QGroupBox,
-                            QFileDialog, QSpinBox, QTextEdit)
+                            QFileDialog, QSpinBox, QTextEdit, QProgressBar)
 from PyQt6.QtCore import Qt
 from widgets.modern_button import ModernButton
 from widgets.modern_input import ModernInput
+from database.backup import list_backups
 from database.database_manager import DatabaseManager
+from ui.backup_worker import BackupWorker, RestoreWorker
 from utils.font_manager import FontManager
 import logging
 import json
-import os
 import shutil
 from datetime import datetime
 
@@ -20,6 +21,8 @@ class SettingsWindow(QWidget):
         super().__init__()
         self.db = DatabaseManager()
         self.config = self.load_config()
+        self.backup_worker = None
+        self.restore_worker = None
         self.setup_ui()
         self.load_settings()
         
@@ -157,7 +160,7 @@ class SettingsWindow(QWidget):
         
         reset_btn = ModernButton("⚠️ بازنشانی پایگاه داده")
         reset_btn.clicked.connect(self.reset_database)
-        reset_btn.setStyleSheet("background-color: #e74c3c;")
+        reset_btn.setProperty('variant', 'danger')
         
         actions_layout.addWidget(test_btn)
         actions_layout.addWidget(create_tables_btn)
@@ -193,21 +196,37 @@ class SettingsWindow(QWidget):
         self.backup_interval.setSuffix(" روز")
         self.backup_interval.setValue(7)
         
+        self.backup_retention = QSpinBox()
+        self.backup_retention.setRange(1, 100)
+        self.backup_retention.setSuffix(" فایل")
+        self.backup_retention.setValue(10)
+        
         backup_layout.addRow("مسیر پشتیبان‌گیری:", path_layout)
         backup_layout.addRow("فاصله پشتیبان‌گیری:", self.backup_interval)
+        backup_layout.addRow("تعداد پشتیبان‌های نگه‌داری شده:", self.backup_retention)
         
         # Backup actions
         actions_group = QGroupBox("عملیات پشتیبان‌گیری")
         actions_layout = QVBoxLayout(actions_group)
         
-        backup_now_btn = ModernButton("💾 پشتیبان‌گیری اکنون")
-        backup_now_btn.clicked.connect(self.create_backup)
+        self.backup_now_btn = ModernButton("💾 پشتیبان‌گیری اکنون")
+        self.backup_now_btn.clicked.connect(lambda: self.create_backup('full'))
+        
+        self.differential_backup_btn = ModernButton("💾 پشتیبان تغییرات از آخرین پشتیبان کامل")
+        self.differential_backup_btn.clicked.connect(lambda: self.create_backup('differential'))
+        
+        self.restore_btn = ModernButton("🔄 بازیابی پشتیبان")
+        self.restore_btn.clicked.connect(self.restore_backup)
         
-        restore_btn = ModernButton("🔄 بازیابی پشتیبان")
-        restore_btn.clicked.connect(self.restore_backup)
+        self.backup_progress = QProgressBar()
+        self.backup_progress.setVisible(False)
+        self.backup_status_label = QLabel("")
         
-        actions_layout.addWidget(backup_now_btn)
-        actions_layout.addWidget(restore_btn)
+        actions_layout.addWidget(self.backup_now_btn)
+        actions_layout.addWidget(self.differential_backup_btn)
+        actions_layout.addWidget(self.restore_btn)
+        actions_layout.addWidget(self.backup_progress)
+        actions_layout.addWidget(self.backup_status_label)
         
         # Backup history
         history_group = QGroupBox("تاریخچه پشتیبان‌ها")
@@ -316,9 +335,10 @@ class SettingsWindow(QWidget):
             self.db_password_input.setText(db_config.get('password', ''))
             
             # Backup settings
-            report_config = self.config.get('report', {})
-            self.backup_path_input.setText(report_config.get('save_path', './backups'))
+            self.backup_path_input.setText(app_config.get('backup_path', './backups'))
             self.backup_interval.setValue(app_config.get('backup_interval', 7))
+            self.backup_retention.setValue(app_config.get('backup_retention', 10))
+            self.load_backup_history()
             
         except Exception as e:
             logger.error(f"Error loading settings: {e}")
@@ -352,7 +372,9 @@ class SettingsWindow(QWidget):
                 'theme': 'dark' if self.theme_combo.currentText() == 'تیره' else 'light',
                 'currency': self.currency_combo.currentText(),
                 'auto_backup': self.auto_backup_check.isChecked(),
-                'backup_interval': self.backup_interval.value()
+                'backup_path': self.backup_path_input.text(),
+                'backup_interval': self.backup_interval.value(),
+                'backup_retention': self.backup_retention.value()
             })
             
             self.config['database'].update({
@@ -363,10 +385,6 @@ class SettingsWindow(QWidget):
                 'password': self.db_password_input.text()
             })
             
-            self.config['report'].update({
-                'save_path': self.backup_path_input.text()
-            })
-            
             # Save to file
             with open('config/settings.json', 'w', encoding='utf-8') as file:
                 json.dump(self.config, file, indent=4, ensure_ascii=False)
@@ -461,85 +479,132 @@ class SettingsWindow(QWidget):
         if directory:
             self.backup_path_input.setText(directory)
     
-    def create_backup(self):
-        """Create database backup"""
-        try:
-            backup_dir = self.backup_path_input.text()
-            if not backup_dir:
-                self.show_error_message("خطا", "لطفاً مسیر پشتیبان‌گیری را انتخاب کنید")
-                return
-            
-            # Create backup directory if it doesn't exist
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            # Generate backup filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(backup_dir, f"faran_payroll_backup_{timestamp}.sql")
-            
-            # TODO: Implement actual database backup using pg_dump
-            # For now, create a placeholder file
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                f.write("-- Faran Payroll Database Backup\n")
-                f.write(f"-- Created: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("-- This is a placeholder backup file\n")
-            
-            # Update backup history
-            self.update_backup_history(f"پشتیبان ایجاد شده: {timestamp}")
-            
-            self.show_success_message("موفقیت", f"پشتیبان با موفقیت ایجاد شد\n{backup_file}")
-            
-        except Exception as e:
-            logger.error(f"Error creating backup: {e}")
-            self.show_error_message("خطا", "خطا در ایجاد پشتیبان")
+    def create_backup(self, kind: str = 'full'):
+        """Start a full or differential database backup in the background"""
+        if self.backup_worker is not None and self.backup_worker.isRunning():
+            return
+        
+        backup_dir = self.backup_path_input.text()
+        if not backup_dir:
+            self.show_error_message("خطا", "لطفاً مسیر پشتیبان‌گیری را انتخاب کنید")
+            return
+        
+        self.set_backup_buttons_enabled(False)
+        self.backup_progress.setRange(0, 0)
+        self.backup_progress.setVisible(True)
+        self.backup_status_label.setText("در حال پشتیبان‌گیری...")
+        
+        self.backup_worker = BackupWorker(self.config.get('database', {}), backup_dir, self, kind=kind)
+        self.backup_worker.progress.connect(self.show_backup_progress)
+        self.backup_worker.finished_backup.connect(self.backup_finished)
+        self.backup_worker.failed.connect(self.backup_failed)
+        self.backup_worker.start()
+    
+    def set_backup_buttons_enabled(self, enabled: bool):
+        """Enable or disable the backup and restore buttons together"""
+        for button in (self.backup_now_btn, self.differential_backup_btn, self.restore_btn):
+            button.setEnabled(enabled)
+    
+    def show_backup_progress(self, written: int, fraction, throughput: float):
+        """Show bytes written and throughput of the running backup"""
+        if fraction is not None:
+            self.backup_progress.setRange(0, 100)
+            self.backup_progress.setValue(int(fraction * 100))
+        self.backup_status_label.setText(
+            f"{written / 1024 / 1024:,.1f} MB نوشته شد - {throughput / 1024 / 1024:,.1f} MB/s"
+        )
+    
+    def backup_finished(self, manifest: dict):
+        """Report a verified backup"""
+        self.set_backup_buttons_enabled(True)
+        self.backup_progress.setVisible(False)
+        self.backup_status_label.setText(
+            f"{manifest['size'] / 1024 / 1024:,.1f} MB در {manifest['duration']:.1f} ثانیه - SHA-256: {manifest['sha256'][:16]}"
+        )
+        self.load_backup_history()
+        self.show_success_message("موفقیت", f"پشتیبان با موفقیت ایجاد و بررسی شد\n{manifest['path']}")
+    
+    def backup_failed(self, message: str):
+        """Report a failed backup"""
+        self.set_backup_buttons_enabled(True)
+        self.backup_progress.setVisible(False)
+        self.backup_status_label.setText("")
+        self.show_error_message("خطا", f"خطا در ایجاد پشتیبان\n{message}")
     
     def restore_backup(self):
         """Restore database from backup"""
-        try:
-            backup_file, _ = QFileDialog.getOpenFileName(
-                self,
-                "انتخاب فایل پشتیبان",
-                self.backup_path_input.text(),
-                "SQL Files (*.sql);;All Files (*)"
-            )
-            
-            if backup_file:
-                reply = QMessageBox.warning(
-                    self,
-                    "هشدار",
-                    "این عمل داده‌های فعلی را با داده‌های پشتیبان جایگزین می‌کند.\nآیا ادامه می‌دهید؟",
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                    QMessageBox.StandardButton.No
-                )
-                
-                if reply == QMessageBox.StandardButton.Yes:
-                    # TODO: Implement actual database restore using psql
-                    # For now, just show a message
-                    self.update_backup_history(f"پشتیبان بازیابی شده: {os.path.basename(backup_file)}")
-                    self.show_success_message("موفقیت", "پشتیبان با موفقیت بازیابی شد")
-                    
-        except Exception as e:
-            logger.error(f"Error restoring backup: {e}")
-            self.show_error_message("خطا", "خطا در بازیابی پشتیبان")
+        if self.restore_worker is not None and self.restore_worker.isRunning():
+            return
+        
+        backup_file, _ = QFileDialog.getOpenFileName(
+            self,
+            "انتخاب فایل پشتیبان",
+            self.backup_path_input.text(),
+            "Backup Files (*.dump *.copy.gz);;All Files (*)"
+        )
+        if not backup_file:
+            return
+        
+        reply = QMessageBox.warning(
+            self,
+            "هشدار",
+            "این عمل داده‌های فعلی را با داده‌های پشتیبان جایگزین می‌کند.\nآیا ادامه می‌دهید؟",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        
+        # Open read transactions of the application would block the restore's locks
+        DatabaseManager.end_open_transactions()
+        
+        self.set_backup_buttons_enabled(False)
+        self.backup_progress.setRange(0, 0)
+        self.backup_progress.setVisible(True)
+        self.backup_status_label.setText("در حال بررسی فایل پشتیبان...")
+        
+        self.restore_worker = RestoreWorker(self.config.get('database', {}), backup_file, self)
+        self.restore_worker.progress.connect(self.show_restore_progress)
+        self.restore_worker.finished_restore.connect(self.restore_finished)
+        self.restore_worker.failed.connect(self.restore_failed)
+        self.restore_worker.start()
+    
+    def show_restore_progress(self, table: str, done: int, total: int):
+        """Show the table being restored"""
+        self.backup_progress.setRange(0, max(total, 1))
+        self.backup_progress.setValue(done)
+        self.backup_status_label.setText(f"بازیابی {table} ({done}/{total})")
+    
+    def restore_finished(self, manifest: dict):
+        """Report a completed restore"""
+        self.set_backup_buttons_enabled(True)
+        self.backup_progress.setVisible(False)
+        self.backup_status_label.setText(
+            f"{len(manifest['toc'])} جدول در {manifest['restore_duration']:.1f} ثانیه بازیابی شد"
+        )
+        self.update_backup_history(f"پشتیبان بازیابی شده: {manifest['file']}")
+        self.show_success_message("موفقیت", "پشتیبان با موفقیت بازیابی شد")
+    
+    def restore_failed(self, message: str):
+        """Report a failed restore"""
+        self.set_backup_buttons_enabled(True)
+        self.backup_progress.setVisible(False)
+        self.backup_status_label.setText("")
+        self.show_error_message("خطا", f"خطا در بازیابی پشتیبان\n{message}")
     
     def load_backup_history(self):
         """Load backup history"""
         try:
-            backup_dir = self.backup_path_input.text()
-            if os.path.exists(backup_dir):
-                backups = []
-                for file in os.listdir(backup_dir):
-                    if file.startswith('faran_payroll_backup_') and file.endswith('.sql'):
-                        file_path = os.path.join(backup_dir, file)
-                        file_time = os.path.getmtime(file_path)
-                        backups.append((file_time, file))
-                
-                # Sort by date (newest first)
-                backups.sort(reverse=True)
-                
+            backups = list_backups(self.backup_path_input.text())
+            if backups:
                 history_text = "تاریخچه پشتیبان‌ها:\n\n"
-                for file_time, file_name in backups[:10]:  # Show last 10 backups
-                    date_str = datetime.fromtimestamp(file_time).strftime('%Y/%m/%d %H:%M')
-                    history_text += f"• {date_str} - {file_name}\n"
+                for backup in backups[:10]:  # Show last 10 backups
+                    date_str = datetime.fromtimestamp(backup['modified']).strftime('%Y/%m/%d %H:%M')
+                    manifest = backup['manifest'] or {}
+                    status = "✓" if manifest else "?"
+                    kind = "تغییرات" if manifest.get('kind') == 'differential' else "کامل"
+                    history_text += (f"• {date_str} - {backup['name']} ({kind}، "
+                                     f"{backup['size'] / 1024 / 1024:,.1f} MB) {status}\n")
                 
                 self.backup_history.setText(history_text)
             else:
@@ -1,40 +1,235 @@
-from datetime import datetime, date
+from array import array
+from datetime import datetime, date, timedelta
+from functools import lru_cache
 import jdatetime
-from typing import Optional
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Gregorian range served from the lookup table; other dates go through jdatetime
+TABLE_START = date(1900, 1, 1)
+TABLE_END = date(2101, 1, 1)
+DEFAULT_FORMAT = "%Y/%m/%d"
+
+
+class _JalaliTable:
+    """Jalali year, month and day of every Gregorian day in the table range
+
+    Day ``i`` of the range is ``TABLE_START + i``. ``month_starts`` holds the
+    day index of the first day of every Jalali month in the range, so the
+    reverse conversion is one lookup as well. ``default_strings`` holds each
+    day in DEFAULT_FORMAT. Built once, on first use.
+    """
+
+    def __init__(self):
+        first = jdatetime.date.fromgregorian(date=TABLE_START)
+        total_days = (TABLE_END - TABLE_START).days
+
+        self.first_year = first.year
+        self.first_position = first.month - 1
+        self.years = array('H')
+        self.months = array('B')
+        self.days = array('B')
+        # Placeholders for the months of the first year before the range
+        self.month_starts = array('l', [0] * self.first_position)
+
+        year, month, day = first.year, first.month, first.day
+        index = -(day - 1)
+        while index < total_days:
+            length = self.month_length(year, month)
+            self.month_starts.append(index)
+            for current_day in range(1, length + 1):
+                if 0 <= index < total_days:
+                    self.years.append(year)
+                    self.months.append(month)
+                    self.days.append(current_day)
+                index += 1
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        self.default_strings = [f"{y:04d}/{m:02d}/{d:02d}" for y, m, d in zip(self.years, self.months, self.days)]
+
+        if NUMPY_AVAILABLE:
+            self.years_array = np.frombuffer(self.years, dtype=np.uint16)
+            self.months_array = np.frombuffer(self.months, dtype=np.uint8)
+            self.days_array = np.frombuffer(self.days, dtype=np.uint8)
+            self.default_strings_array = np.array(self.default_strings, dtype=object)
+
+    @staticmethod
+    def month_length(year: int, month: int) -> int:
+        if month <= 6:
+            return 31
+        if month <= 11:
+            return 30
+        return 30 if jdatetime.date(year, 12, 1).isleap() else 29
+
+    def jalali(self, index: int) -> Tuple[int, int, int]:
+        return self.years[index], self.months[index], self.days[index]
+
+    def gregorian_index(self, year: int, month: int, day: int) -> Optional[int]:
+        """Day index of a Jalali date, or None outside the table"""
+        position = (year - self.first_year) * 12 + month - 1
+        if not self.first_position <= position < len(self.month_starts) or not 1 <= day <= 31:
+            return None
+        index = self.month_starts[position] + day - 1
+        if not 0 <= index < len(self.years):
+            return None
+        return index
+
+
+_table: Optional[_JalaliTable] = None
+_TABLE_START_ORDINAL = TABLE_START.toordinal()
+_TABLE_DAYS = (TABLE_END - TABLE_START).days
+
+
+def _get_table() -> _JalaliTable:
+    global _table
+    if _table is None:
+        _table = _JalaliTable()
+    return _table
+
+
+def _to_date(value) -> Optional[date]:
+    """A date from a date, datetime or ISO string (as demo rows hold them)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value:
+        return date.fromisoformat(value[:10])
+    return None
+
+
+def _format_ordinal(ordinal: int, format_str: str) -> str:
+    """Formatted Jalali date of a Gregorian day ordinal"""
+    index = ordinal - _TABLE_START_ORDINAL
+    if format_str == DEFAULT_FORMAT and 0 <= index < _TABLE_DAYS:
+        return _get_table().default_strings[index]
+    return _format_other(ordinal, format_str)
+
+
+# Other formats are rare; cache up to one string per day of the table
+@lru_cache(maxsize=_TABLE_DAYS)
+def _format_other(ordinal: int, format_str: str) -> str:
+    index = ordinal - _TABLE_START_ORDINAL
+    if 0 <= index < _TABLE_DAYS:
+        return jdatetime.date(*_get_table().jalali(index)).strftime(format_str)
+    return jdatetime.date.fromgregorian(date=date.fromordinal(ordinal)).strftime(format_str)
+
+
+def _day_indexes(dates) -> Tuple:
+    """Table day indexes of a column of dates, and a mask of its empty values"""
+    if isinstance(dates, np.ndarray):
+        days = dates.astype('datetime64[D]')
+        return (days - np.datetime64(TABLE_START, 'D')).astype(np.int64), np.isnat(days)
+
+    # Reading date objects through numpy is slow; their ordinals are not
+    try:
+        ordinals = [value.toordinal() for value in dates]
+        empty = np.zeros(len(ordinals), dtype=bool)
+    except AttributeError:
+        values = [_to_date(value) for value in dates]
+        ordinals = [value.toordinal() if value is not None else _TABLE_START_ORDINAL for value in values]
+        empty = np.array([value is None for value in values], dtype=bool)
+    return np.array(ordinals, dtype=np.int64) - _TABLE_START_ORDINAL, empty
+
+
+def _format_indexes(indexes, empty) -> List[str]:
+    """DEFAULT_FORMAT strings of table day indexes ('' where empty)"""
+    inside = ~empty & (indexes >= 0) & (indexes < _TABLE_DAYS)
+    result = np.full(len(indexes), '', dtype=object)
+    result[inside] = _get_table().default_strings_array[indexes[inside]]
+    for position in np.flatnonzero(~empty & ~inside):
+        result[position] = _format_other(int(indexes[position]) + _TABLE_START_ORDINAL, DEFAULT_FORMAT)
+    return result.tolist()
+
 
 class DateConverter:
     @staticmethod
     def gregorian_to_jalali(gregorian_date: date) -> jdatetime.date:
         """Convert Gregorian date to Jalali date"""
+        gregorian_date = _to_date(gregorian_date)
+        index = gregorian_date.toordinal() - _TABLE_START_ORDINAL
+        if 0 <= index < _TABLE_DAYS:
+            return jdatetime.date(*_get_table().jalali(index))
         return jdatetime.date.fromgregorian(date=gregorian_date)
-    
+
     @staticmethod
     def jalali_to_gregorian(jalali_date: jdatetime.date) -> date:
         """Convert Jalali date to Gregorian date"""
-        return jalali_date.togregorian()
-    
+        index = _get_table().gregorian_index(jalali_date.year, jalali_date.month, jalali_date.day)
+        if index is None:
+            return jalali_date.togregorian()
+        return TABLE_START + timedelta(days=index)
+
     @staticmethod
-    def gregorian_to_jalali_str(gregorian_date: date, format_str: str = "%Y/%m/%d") -> str:
+    def gregorian_to_jalali_str(gregorian_date: date, format_str: str = DEFAULT_FORMAT) -> str:
         """Convert Gregorian date to Jalali string"""
-        jalali_date = DateConverter.gregorian_to_jalali(gregorian_date)
-        return jalali_date.strftime(format_str)
-    
+        gregorian_date = _to_date(gregorian_date)
+        if gregorian_date is None:
+            return ''
+        return _format_ordinal(gregorian_date.toordinal(), format_str)
+
+    @staticmethod
+    def gregorian_to_jalali_array(dates: Iterable, format_str: str = DEFAULT_FORMAT) -> List[str]:
+        """Jalali strings of a whole column of dates ('' for empty values)
+
+        Takes dates, datetimes, ISO strings or a numpy datetime64 array. With
+        numpy the default format is one index lookup in the table's strings
+        for the whole column; other formats are converted value by value.
+        """
+        if NUMPY_AVAILABLE and format_str == DEFAULT_FORMAT:
+            if not isinstance(dates, (list, tuple, np.ndarray)):
+                dates = list(dates)
+            return _format_indexes(*_day_indexes(dates))
+
+        result = []
+        for value in dates:
+            value = _to_date(value)
+            result.append(_format_ordinal(value.toordinal(), format_str) if value is not None else '')
+        return result
+
+    @staticmethod
+    def jalali_components(dates: Sequence) -> Tuple:
+        """Jalali years, months and days of a column of dates
+
+        Takes dates or a numpy datetime64 array; with numpy the result is
+        three numpy arrays computed with one index operation. Dates must lie
+        in the table range.
+        """
+        table = _get_table()
+        if NUMPY_AVAILABLE:
+            days = np.asarray(dates, dtype='datetime64[D]')
+            indexes = (days - np.datetime64(TABLE_START, 'D')).astype(np.int64)
+            if indexes.size and (indexes.min() < 0 or indexes.max() >= _TABLE_DAYS):
+                raise ValueError(f"Dates must be between {TABLE_START} and {TABLE_END}")
+            return table.years_array[indexes], table.months_array[indexes], table.days_array[indexes]
+
+        indexes = [_to_date(value).toordinal() - _TABLE_START_ORDINAL for value in dates]
+        if any(not 0 <= index < _TABLE_DAYS for index in indexes):
+            raise ValueError(f"Dates must be between {TABLE_START} and {TABLE_END}")
+        return ([table.years[i] for i in indexes], [table.months[i] for i in indexes],
+                [table.days[i] for i in indexes])
+
     @staticmethod
-    def jalali_str_to_gregorian(jalali_str: str, format_str: str = "%Y/%m/%d") -> date:
+    def jalali_str_to_gregorian(jalali_str: str, format_str: str = DEFAULT_FORMAT) -> date:
         """Convert Jalali string to Gregorian date"""
         jalali_date = jdatetime.datetime.strptime(jalali_str, format_str)
-        return jalali_date.togregorian()
-    
+        return DateConverter.jalali_to_gregorian(jalali_date.date())
+
     @staticmethod
     def get_current_jalali_date() -> jdatetime.date:
         """Get current Jalali date"""
         return jdatetime.date.today()
-    
+
     @staticmethod
-    def get_current_jalali_date_str(format_str: str = "%Y/%m/%d") -> str:
+    def get_current_jalali_date_str(format_str: str = DEFAULT_FORMAT) -> str:
         """Get current Jalali date as string"""
-        return jdatetime.date.today().strftime(format_str)
-    
+        return DateConverter.gregorian_to_jalali_str(date.today(), format_str)
+
     @staticmethod
     def get_jalali_month_name(month_number: int) -> str:
         """Get Jalali month name"""
@@ -52,4 +247,20 @@ class DateConverter:
             11: "بهمن",
             12: "اسفند"
         }
-        return months.get(month_number, "")
\ No newline at end of file
+        return months.get(month_number, "")
+
+    @staticmethod
+    def jalali_month_length(year: int, month: int) -> int:
+        """Number of days of a Jalali month (Esfand has 30 in leap years)"""
+        return _JalaliTable.month_length(year, month)
+
+    @staticmethod
+    def jalali_period_range(year: int, month: Optional[int] = None) -> tuple:
+        """Get the Gregorian [start, end) date range of a Jalali year or month"""
+        if month is None:
+            start = jdatetime.date(year, 1, 1)
+            end = jdatetime.date(year + 1, 1, 1)
+        else:
+            start = jdatetime.date(year, month, 1)
+            end = jdatetime.date(year + month // 12, month % 12 + 1, 1)
+        return DateConverter.jalali_to_gregorian(start), DateConverter.jalali_to_gregorian(end)
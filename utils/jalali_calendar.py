@@ -0,0 +1,161 @@
+"""Jalali work calendar
+
+The twelve months of a Jalali year are built once per year and cached:
+their Gregorian [start, end) range, length, official holidays and number
+of working days. Lookups by (year, month) or by Gregorian date are then a
+dict access. The days can also be written to the jalali_calendar table so
+attendance and payroll queries can join on them.
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from utils.date_converter import DateConverter
+
+logger = logging.getLogger(__name__)
+
+# Weekdays counted from Saturday (0), as jdatetime does; Friday is the weekend
+DEFAULT_WEEKEND = (6,)
+
+# Holidays on the same Jalali day every year; lunar holidays move and are
+# configured per year in settings.json ("calendar" -> "holidays")
+FIXED_HOLIDAYS = {
+    (1, 1): "نوروز",
+    (1, 2): "نوروز",
+    (1, 3): "نوروز",
+    (1, 4): "نوروز",
+    (1, 12): "روز جمهوری اسلامی",
+    (1, 13): "روز طبیعت",
+    (3, 14): "رحلت امام خمینی",
+    (3, 15): "قیام ۱۵ خرداد",
+    (11, 22): "پیروزی انقلاب اسلامی",
+    (12, 29): "ملی شدن صنعت نفت"
+}
+
+CALENDAR_COLUMNS = (
+    'gregorian_date', 'jalali_year', 'jalali_month', 'jalali_day',
+    'weekday', 'is_holiday', 'is_working_day', 'holiday_name'
+)
+CALENDAR_CHUNK_SIZE = 500
+
+
+@dataclass(frozen=True)
+class JalaliMonth:
+    """One Jalali month of the work calendar"""
+    year: int
+    month: int
+    start: date
+    end: date  # first day of the next month
+    days: int
+    working_days: int
+    # Gregorian date -> holiday name
+    holidays: Mapping[date, str] = field(default_factory=dict)
+
+    def __contains__(self, day: date) -> bool:
+        return self.start <= day < self.end
+
+    def dates(self) -> List[date]:
+        return [self.start + timedelta(days=offset) for offset in range(self.days)]
+
+
+class JalaliCalendar:
+    """Month tables of Jalali years, built on first use"""
+
+    def __init__(self, weekend: Iterable[int] = DEFAULT_WEEKEND,
+                 holidays: Optional[Mapping[Any, Mapping[str, str]]] = None):
+        self.weekend = frozenset(weekend)
+        # year -> {(month, day): name}, from settings keys like "1403": {"01/23": "..."}
+        self.extra_holidays: Dict[int, Dict[Tuple[int, int], str]] = {}
+        for year, days in (holidays or {}).items():
+            self.extra_holidays[int(year)] = {
+                tuple(int(part) for part in day.split('/')): name for day, name in days.items()
+            }
+        self._years: Dict[int, Tuple[JalaliMonth, ...]] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Mapping[str, Any]) -> 'JalaliCalendar':
+        """Calendar of the "calendar" section of settings.json"""
+        calendar = settings.get('calendar', {})
+        return cls(calendar.get('weekend', DEFAULT_WEEKEND), calendar.get('holidays', {}))
+
+    @staticmethod
+    def weekday(day: date) -> int:
+        """Weekday counted from Saturday (0)"""
+        return (day.weekday() + 2) % 7
+
+    def year(self, year: int) -> Tuple[JalaliMonth, ...]:
+        """The twelve months of a year"""
+        months = self._years.get(year)
+        if months is None:
+            months = self._years[year] = tuple(self._build_month(year, month) for month in range(1, 13))
+        return months
+
+    def _build_month(self, year: int, month: int) -> JalaliMonth:
+        start, end = DateConverter.jalali_period_range(year, month)
+        days = DateConverter.jalali_month_length(year, month)
+        named_days = dict(FIXED_HOLIDAYS)
+        named_days.update(self.extra_holidays.get(year, {}))
+
+        holidays = {}
+        working_days = 0
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            name = named_days.get((month, offset + 1))
+            if name is not None:
+                holidays[day] = name
+            elif self.weekday(day) not in self.weekend:
+                working_days += 1
+        return JalaliMonth(year, month, start, end, days, working_days, holidays)
+
+    def month(self, year: int, month: int) -> JalaliMonth:
+        return self.year(year)[month - 1]
+
+    def month_of(self, day: date) -> JalaliMonth:
+        """The Jalali month a Gregorian date falls in"""
+        jalali = DateConverter.gregorian_to_jalali(day)
+        return self.month(jalali.year, jalali.month)
+
+    def is_holiday(self, day: date) -> bool:
+        return day in self.month_of(day).holidays
+
+    def is_working_day(self, day: date) -> bool:
+        return not self.is_holiday(day) and self.weekday(day) not in self.weekend
+
+    def working_days(self, year: int, month: Optional[int] = None) -> int:
+        """Working days of a month, or of a whole year"""
+        if month is not None:
+            return self.month(year, month).working_days
+        return sum(jalali_month.working_days for jalali_month in self.year(year))
+
+    def day_rows(self, years: Iterable[int]) -> List[tuple]:
+        """jalali_calendar rows of every day of some years"""
+        rows = []
+        for year in years:
+            for jalali_month in self.year(year):
+                for offset, day in enumerate(jalali_month.dates()):
+                    weekday = self.weekday(day)
+                    name = jalali_month.holidays.get(day)
+                    rows.append((day, year, jalali_month.month, offset + 1, weekday, name is not None,
+                                 name is None and weekday not in self.weekend, name))
+        return rows
+
+
+def load_calendar(db, calendar: JalaliCalendar, years: Iterable[int]) -> bool:
+    """Replace the jalali_calendar rows of some years in one transaction"""
+    years = sorted(set(years))
+    rows = calendar.day_rows(years)
+    statements = [("DELETE FROM jalali_calendar WHERE jalali_year = ANY(%s)", (years,))]
+    for offset in range(0, len(rows), CALENDAR_CHUNK_SIZE):
+        chunk = rows[offset:offset + CALENDAR_CHUNK_SIZE]
+        query = f"""
+            INSERT INTO jalali_calendar ({', '.join(CALENDAR_COLUMNS)})
+            VALUES {', '.join(['(' + ', '.join(['%s'] * len(CALENDAR_COLUMNS)) + ')'] * len(chunk))}
+        """
+        statements.append((query, tuple(value for row in chunk for value in row)))
+
+    if db.execute_transaction(statements) is None:
+        logger.error(f"Failed to load the Jalali calendar of {years}")
+        return False
+    logger.info(f"Loaded {len(rows)} calendar days of {years}")
+    return True
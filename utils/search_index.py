@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Arabic code points commonly typed instead of their Persian equivalents,
+# plus Persian/Arabic-Indic digits so "۱۰۰۱" finds employee code "1001".
+_NORMALIZE_TABLE = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian keheh
+    '\u0629': '\u0647',  # teh marbuta -> heh
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u200c': ' ',       # ZWNJ
+    '\u200f': None,      # RLM
+    '\u200e': None,      # LRM
+    '\u0640': None,      # tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+
+
+def normalize_persian(text: Any) -> str:
+    """Normalize Persian text for searching (ی/ي, ک/ك, ZWNJ, digits)"""
+    if text is None:
+        return ''
+    return ' '.join(str(text).translate(_NORMALIZE_TABLE).lower().split())
+
+
+class SearchIndex:
+    """In-memory trigram index over a list of records
+
+    The index is built once per data load; queries never touch the database.
+    Every term matches as a substring, whatever its length: terms of three
+    characters or more are resolved with trigram posting lists, shorter
+    terms with a table of every one and two character substring of a word.
+    All terms of a query must match (AND semantics).
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]], fields: List[str], key: str = 'id'):
+        self.fields = fields
+        self.key = key
+        self.keys: List[Any] = []
+        self.texts: List[str] = []
+        self.trigrams: Dict[str, Set[int]] = {}
+        self.short_grams: Dict[str, Set[int]] = {}
+        self.build(records)
+
+    def build(self, records: Iterable[Dict[str, Any]]):
+        """Build the index from records"""
+        trigrams: Dict[str, Set[int]] = {}
+        short_grams: Dict[str, Set[int]] = {}
+
+        for position, record in enumerate(records):
+            text = normalize_persian(' '.join(str(record.get(field) or '') for field in self.fields))
+            self.keys.append(record.get(self.key))
+            self.texts.append(text)
+
+            for token in set(text.split()):
+                for i in range(len(token)):
+                    short_grams.setdefault(token[i], set()).add(position)
+                    if i + 1 < len(token):
+                        short_grams.setdefault(token[i:i + 2], set()).add(position)
+                padded = f" {token} "
+                for i in range(len(padded) - 2):
+                    trigrams.setdefault(padded[i:i + 3], set()).add(position)
+
+        self.trigrams = trigrams
+        self.short_grams = short_grams
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str) -> Optional[Set[Any]]:
+        """Return the keys of matching records, or None when the query is empty"""
+        terms = normalize_persian(query).split()
+        if not terms:
+            return None
+
+        # Resolve the most selective (longest) term first
+        positions: Optional[Set[int]] = None
+        for term in sorted(terms, key=len, reverse=True):
+            matches = self._search_term(term, positions)
+            positions = matches if positions is None else positions & matches
+            if not positions:
+                return set()
+
+        return {self.keys[position] for position in positions}
+
+    def _search_term(self, term: str, candidates: Optional[Set[int]]) -> Set[int]:
+        """Positions of records containing term"""
+        if len(term) < 3:
+            return self.short_grams.get(term, set())
+
+        postings = []
+        for i in range(len(term) - 2):
+            posting = self.trigrams.get(term[i:i + 3])
+            if not posting:
+                return set()
+            postings.append(posting)
+
+        postings.sort(key=len)
+        result = set(candidates & postings[0]) if candidates is not None else set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                return result
+
+        # Trigrams can match out of order; confirm the substring
+        texts = self.texts
+        return {position for position in result if term in texts[position]}
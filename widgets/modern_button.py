@@ -16,24 +16,4 @@ class ModernButton(QPushButton):
         self.setCursor(Qt.CursorShape.PointingHandCursor)
         self.setMinimumHeight(35)
         
-        # Base style
-        self.setStyleSheet("""
-            ModernButton {
-                background-color: #3498db;
-                color: white;
-                border: none;
-                border-radius: 5px;
-                padding: 8px 15px;
-                font-weight: bold;
-            }
-            ModernButton:hover {
-                background-color: #2980b9;
-            }
-            ModernButton:pressed {
-                background-color: #21618c;
-            }
-            ModernButton:disabled {
-                background-color: #bdc3c7;
-                color: #7f8c8d;
-            }
-        """)
\ No newline at end of file
+        # Styling comes from the application theme (themes/*.qss)
\ No newline at end of file
@@ -14,23 +14,7 @@ class ModernInput(QLineEdit):
         self.setFont(FontManager.get_font(point_size=10))
         self.setMinimumHeight(35)
         
-        # Base style
-        self.setStyleSheet("""
-            ModernInput {
-                border: 2px solid #bdc3c7;
-                border-radius: 5px;
-                padding: 5px 10px;
-                background-color: white;
-                selection-background-color: #3498db;
-            }
-            ModernInput:focus {
-                border-color: #3498db;
-            }
-            ModernInput:disabled {
-                background-color: #ecf0f1;
-                color: #7f8c8d;
-            }
-        """)
+        # Styling comes from the application theme (themes/*.qss)
         
         # Set text alignment for RTL
         self.setAlignment(Qt.AlignmentFlag.AlignRight)
\ No newline at end of file
@@ -0,0 +1,92 @@
+from PyQt6.QtWidgets import QTableView, QAbstractItemView, QWidget, QHBoxLayout
+from typing import Callable
+from widgets.modern_button import ModernButton
+from utils.font_manager import FontManager
+
+class ModernTableView(QTableView):
+    """Modern styled table view for model-backed (paged) lists"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setup_table()
+    
+    def setup_table(self):
+        """Setup table styling"""
+        self.setFont(FontManager.get_font(point_size=9))
+        
+        # Styling comes from the application theme (themes/*.qss)
+        
+        # Table properties; rows arrive in server order, so no client sorting
+        self.setAlternatingRowColors(True)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.verticalHeader().setDefaultSectionSize(36)
+        
+        # Paged models keep only the pages around the visible rows
+        self.verticalScrollBar().valueChanged.connect(self.load_visible_rows)
+    
+    def setModel(self, model):
+        """Set the model and follow the rows a paged model drops"""
+        super().setModel(model)
+        if hasattr(model, 'rowsEvicted'):
+            model.rowsEvicted.connect(self.remove_index_widgets)
+    
+    def set_row_actions(self, on_edit: Callable[[int], None], on_delete: Callable[[int], None]):
+        """Show edit/delete buttons in the first column of a paged model's rows
+        
+        The callbacks get the row's id. Buttons are added whenever the model
+        (re)loads rows and removed with the rows it drops.
+        """
+        self.on_edit = on_edit
+        self.on_delete = on_delete
+        self.model().rowsLoaded.connect(self.add_action_buttons)
+    
+    def add_action_buttons(self, first: int, last: int):
+        """Add edit/delete buttons to rows whose data was (re)loaded"""
+        model = self.model()
+        for row in range(first, last + 1):
+            record_id = model.row_data(row)['id']
+            
+            action_widget = QWidget()
+            action_layout = QHBoxLayout(action_widget)
+            action_layout.setContentsMargins(5, 2, 5, 2)
+            
+            edit_btn = ModernButton("✏️")
+            edit_btn.setFixedSize(30, 30)
+            edit_btn.clicked.connect(lambda checked, id=record_id: self.on_edit(id))
+            
+            delete_btn = ModernButton("🗑️")
+            delete_btn.setFixedSize(30, 30)
+            delete_btn.clicked.connect(lambda checked, id=record_id: self.on_delete(id))
+            
+            action_layout.addWidget(edit_btn)
+            action_layout.addWidget(delete_btn)
+            action_layout.addStretch()
+            
+            self.setIndexWidget(model.index(row, 0), action_widget)
+    
+    def load_visible_rows(self):
+        """Ask a paged model to load the rows in view"""
+        model = self.model()
+        if not hasattr(model, 'ensure_rows'):
+            return
+        first = self.rowAt(0)
+        if first < 0:
+            return
+        last = self.rowAt(self.viewport().height() - 1)
+        if last < 0:
+            last = model.rowCount() - 1
+        model.ensure_rows(first, last)
+    
+    def remove_index_widgets(self, first: int, last: int):
+        """Delete the widgets of rows whose data was dropped"""
+        model = self.model()
+        for row in range(first, last + 1):
+            for column in range(model.columnCount()):
+                index = model.index(row, column)
+                if self.indexWidget(index) is not None:
+                    self.setIndexWidget(index, None)
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.load_visible_rows()
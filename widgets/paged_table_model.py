@@ -0,0 +1,170 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from typing import Callable, List, Dict, Any, Optional
+from utils.date_converter import DateConverter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Pages kept in memory on each side of the visible ones
+PAGE_WINDOW = 2
+
+class PagedTableModel(QAbstractTableModel):
+    """Table model that pulls rows from a KeysetPager on demand
+
+    The view calls canFetchMore/fetchMore when it is scrolled to the bottom,
+    so only the pages the user actually reaches are queried. Display strings
+    are formatted once when a page arrives, not on every repaint.
+
+    Only a window of pages around the visible rows is kept in memory. The
+    key each page started after is remembered, so a page that was dropped
+    is read again through the pager when it is scrolled back into view
+    (see ensure_rows). rowsLoaded/rowsEvicted tell the view which rows
+    gained or lost their data, e.g. to add or remove index widgets.
+
+    ``columns`` is a list of (header, formatter) pairs; a formatter of None
+    leaves the cell empty (e.g. for a column of action buttons).
+    """
+
+    RowDataRole = Qt.ItemDataRole.UserRole
+
+    rowsLoaded = pyqtSignal(int, int)
+    rowsEvicted = pyqtSignal(int, int)
+
+    def __init__(self, columns: List[tuple], parent=None):
+        super().__init__(parent)
+        self.headers = [header for header, _ in columns]
+        self.formatters: List[Optional[Callable[[Dict[str, Any]], str]]] = [formatter for _, formatter in columns]
+        self.page_keys: List[Optional[tuple]] = []
+        self.pages: Dict[int, tuple] = {}
+        self.row_count = 0
+        self.pager = None
+
+    def set_pager(self, pager):
+        """Replace the row source and load its first page"""
+        self.beginResetModel()
+        self.pager = pager
+        self.page_keys = []
+        self.pages = {}
+        self.row_count = 0
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.row_count
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        page = self.pages.get(index.row() // self.pager.page_size)
+        offset = index.row() % self.pager.page_size
+        if page is None or offset >= len(page[0]):
+            return None
+        rows, display = page
+        if role == Qt.ItemDataRole.DisplayRole:
+            return display[offset][index.column()]
+        if role == self.RowDataRole:
+            return rows[offset]
+        return None
+
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and self.pager is not None and self.pager.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        start_key = self.pager.last_key
+        try:
+            rows = self.pager.fetch_next()
+        except Exception as e:
+            logger.error(f"Error fetching rows: {e}")
+            self.pager.has_more = False
+            return
+
+        if not rows:
+            return
+
+        display = [self.format_row(row) for row in rows]
+        page = len(self.page_keys)
+        first = self.row_count
+        last = first + len(rows) - 1
+        self.beginInsertRows(QModelIndex(), first, last)
+        self.page_keys.append(start_key)
+        self.pages[page] = (rows, display)
+        self.row_count += len(rows)
+        self.endInsertRows()
+        self.rowsLoaded.emit(first, last)
+
+        # Fetching happens at the bottom of the view
+        self.evict_pages(page, page)
+
+    def ensure_rows(self, first: int, last: int):
+        """Make sure rows first..last are in memory and drop far-away pages"""
+        if self.pager is None or self.row_count == 0:
+            return
+        first_page = max(first, 0) // self.pager.page_size
+        last_page = min(last, self.row_count - 1) // self.pager.page_size
+        for page in range(first_page, last_page + 1):
+            if page not in self.pages:
+                self.load_page(page)
+        self.evict_pages(first_page, last_page)
+
+    def load_page(self, page: int):
+        """Read a dropped page again from the key it started after"""
+        first = page * self.pager.page_size
+        count = min(self.pager.page_size, self.row_count - first)
+        try:
+            rows = self.pager.fetch_page(self.page_keys[page])[:count]
+        except Exception as e:
+            logger.error(f"Error reloading rows: {e}")
+            return
+
+        self.pages[page] = (rows, [self.format_row(row) for row in rows])
+        self.dataChanged.emit(self.index(first, 0), self.index(first + count - 1, len(self.headers) - 1))
+        if rows:
+            self.rowsLoaded.emit(first, first + len(rows) - 1)
+
+    def evict_pages(self, first_page: int, last_page: int):
+        """Drop pages more than PAGE_WINDOW pages away from first_page..last_page"""
+        for page in list(self.pages):
+            if first_page - PAGE_WINDOW <= page <= last_page + PAGE_WINDOW:
+                continue
+            rows, _ = self.pages.pop(page)
+            first = page * self.pager.page_size
+            self.rowsEvicted.emit(first, first + len(rows) - 1)
+
+    def format_row(self, row: Dict[str, Any]) -> List[str]:
+        """Format a row's cells for display"""
+        cells = []
+        for formatter in self.formatters:
+            if formatter is None:
+                cells.append('')
+                continue
+            try:
+                cells.append(formatter(row))
+            except Exception:
+                cells.append('')
+        return cells
+
+    @staticmethod
+    def format_date(value) -> str:
+        """Convert a date to a Jalali string, falling back to the raw value"""
+        try:
+            return DateConverter.gregorian_to_jalali_str(value) if value else ''
+        except Exception:
+            return str(value) if value else ''
+
+    def row_data(self, row: int) -> Dict[str, Any]:
+        """Get the raw data of a row, reading its page again if it was dropped"""
+        page = row // self.pager.page_size
+        if page not in self.pages:
+            self.load_page(page)
+        return self.pages[page][0][row % self.pager.page_size]